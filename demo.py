@@ -9,6 +9,7 @@ from main import (
     sherlock_gs_offers,
     sherlock_kelkoo,
     sherlock_kuantokusta,
+    sherlock_products,
 )
 
 
@@ -174,6 +175,36 @@ def demo_sherlock_kuantokusta():
     sherlock_kuantokusta(event, {})
 
 
+def demo_sherlock_products():
+    message = {
+        "created_at": 1622804976212,
+        "product_id": 9978653,
+        "gtin": "00889842651393",
+        "offer_fetch_complete": False,
+        "offer_urls": {
+            "idealo_DE": [
+                "https://www.idealo.de/preisvergleich/OffersOfProduct/200637075"
+            ],
+            "google_shopping_FR": ["11731787905184659847"],
+        },
+        "product_token": "test_gAAAAAAAAAAAsMFK1hehjtyl8OSy9z19N9wvdLUdZdZlh0BWDUgGGc08fkgYGqeXaQn1JegqyzvYRJKhMGix6cIKlNUjHqI2sQ==",
+        "triggered_from_client": True,
+        "user_country": "SE",
+        "triggered_by": {
+            "source": "b2b_job",
+            "job_id": "UupuDUjLXoHbAKjHsrtH",
+            "task_id": "hyAnhCIoQQyt0qWl5W3S",
+            "offer_search_id": "JGUl2cEn2pU77PevQBYx",
+            "requested_sources": ["idealo", "google_shopping"],
+            "target_countries": ["FR"],
+        },
+    }
+
+    event = {"data": base64.b64encode(json.dumps(message).encode())}
+
+    sherlock_products(event, {})
+
+
 if __name__ == "__main__":
     # Instantiate the parser
     parser = argparse.ArgumentParser(
@@ -189,6 +220,7 @@ if __name__ == "__main__":
             "idealo",
             "google_shopping",
             "kuantokusta",
+            "all",
         ],
         help="run a scraper",
     )
@@ -207,3 +239,5 @@ if __name__ == "__main__":
         demo_sherlock_gs_offers()
     elif args.scraper == "kuantokusta":
         demo_sherlock_kuantokusta()
+    elif args.scraper == "all":
+        demo_sherlock_products()
@@ -1,18 +1,15 @@
 import json
+import os
 import asyncio
 import base64
+import functools
+import importlib
+from types import ModuleType
 from typing import Literal, Optional, TypedDict, Any
 
 import structlog
 
 from sherlock_offer_scrapers import helpers
-from sherlock_offer_scrapers.scrapers import (
-    pricerunner,
-    kelkoo,
-    idealo,
-    google_shopping,
-    kuantokusta,
-)
 
 
 helpers.structlog.config_structlog()
@@ -46,6 +43,29 @@ OfferSourceType = Literal[
 ]
 
 
+# Sources scraped by `sherlock_products`, by default the ones that are deployed
+# as their own function.
+COMBINED_OFFER_SOURCES: list[OfferSourceType] = [
+    source.strip()  # type: ignore
+    for source in os.environ.get(
+        "SHERLOCK_OFFER_SOURCES", "google_shopping,idealo,pricerunner"
+    ).split(",")
+    if source.strip()
+]
+
+# Sources that cost us too much (proxies, Scrapfly credits) to run for every
+# product a user looks at, so they are only used for b2b jobs.
+B2B_ONLY_OFFER_SOURCES = ["google_shopping", "kuantokusta"]
+
+# Countries scraped at most per product on Google Shopping when the job doesn't
+# target specific countries, the most promising first. Unlimited if not set.
+GOOGLE_SHOPPING_MAX_COUNTRIES: Optional[int] = (
+    int(os.environ["GOOGLE_SHOPPING_MAX_COUNTRIES"])
+    if os.environ.get("GOOGLE_SHOPPING_MAX_COUNTRIES")
+    else None
+)
+
+
 def sherlock_prisjakt(event, context):
     """Search for offers on Prisjakt for a product."""
     payload: Payload = json.loads(base64.b64decode(event["data"]))
@@ -72,54 +92,130 @@ def sherlock_idealo(event, context):
 
 def sherlock_gs_offers(event, context):
     payload: Payload = json.loads(base64.b64decode(event["data"]))
-
-    # Only trigger for our b2b-flow
-    if payload["triggered_by"]["source"] != "b2b_job":
-        logger.msg("Skipping search. Google shopping is only enabled for b2b")
-        return
-
     _sherlock_scrape("google_shopping", payload)
 
 
 def sherlock_kuantokusta(event, context):
     payload: Payload = json.loads(base64.b64decode(event["data"]))
-    if (
-        "source" not in payload["triggered_by"]
-        or payload["triggered_by"]["source"] != "b2b_job"
-    ):
-        return  # ignore kuanto kusta for non b2b to avoid burning scrapfly credits
-
     _sherlock_scrape("kuantokusta", payload)
 
 
-def _sherlock_scrape(offer_source: OfferSourceType, payload: Payload) -> None:
-    gtin = payload.get("gtin", None)
-    sku = payload.get("sku", None)
+def sherlock_products(event, context):
+    """Search for offers on all the requested sources for a product.
+
+    Alternative to deploying one function per source on the `sherlock_products`
+    topic: the message is decoded once and the sources are scraped concurrently
+    in the same invocation, sharing the HTTP connection pools. Each source still
+    publishes its own result.
+    """
+    payload: Payload = json.loads(base64.b64decode(event["data"]))
+    helpers.deadline.start()
+    try:
+        asyncio.run(_sherlock_scrape_all(payload, COMBINED_OFFER_SOURCES))
+    finally:
+        # The instance can be throttled as soon as the function returns
+        helpers.dump_html.flush()
+
+
+def _load_scraper(offer_source: OfferSourceType) -> ModuleType:
+    """Import the scraper of a source on first use.
+
+    The scrapers are not imported at module load so that every function only
+    pays the import time (bs4, price_parser, ...) of the sources it scrapes.
+    """
+    return importlib.import_module(f"sherlock_offer_scrapers.scrapers.{offer_source}")
+
+
+def _should_scrape(offer_source: OfferSourceType, payload: Payload) -> bool:
+    triggered_by = payload["triggered_by"]
+    is_b2b_job = triggered_by.get("source") == "b2b_job"
+
+    if offer_source in B2B_ONLY_OFFER_SOURCES and not is_b2b_job:
+        logger.msg(
+            "Skipping search. Source is only enabled for b2b",
+            offer_source=offer_source,
+        )
+        return False
 
     if (
-        "source" in payload["triggered_by"]
-        and payload["triggered_by"]["source"] == "b2b_job"
-        and "requested_sources" in payload["triggered_by"]
-        and payload["triggered_by"]["requested_sources"]
-        and offer_source not in payload["triggered_by"]["requested_sources"]
+        is_b2b_job
+        and triggered_by.get("requested_sources")
+        and offer_source not in triggered_by["requested_sources"]
     ):
         logger.info(
             "Skipping execution, because the source is not listed in requested list: ",
-            payload=payload,
+            requested_sources=triggered_by["requested_sources"],
             offer_source=offer_source,
+            gtin=payload.get("gtin"),
         )
+        return False
+
+    return True
+
+
+async def _sherlock_scrape_all(
+    payload: Payload, offer_sources: list[OfferSourceType]
+) -> None:
+    results = await asyncio.gather(
+        *[
+            _sherlock_scrape_async(offer_source, payload)
+            for offer_source in offer_sources
+            if _should_scrape(offer_source, payload)
+        ],
+        return_exceptions=True,
+    )
+
+    # Every source has published its result and logged its error by now.
+    errors = [result for result in results if isinstance(result, Exception)]
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def _sherlock_scrape(offer_source: OfferSourceType, payload: Payload) -> None:
+    if not _should_scrape(offer_source, payload):
         return
 
+    helpers.deadline.start()
+    try:
+        asyncio.run(_sherlock_scrape_async(offer_source, payload))
+    finally:
+        # The instance can be throttled as soon as the function returns
+        helpers.dump_html.flush()
+
+
+async def _sherlock_scrape_async(
+    offer_source: OfferSourceType, payload: Payload
+) -> None:
+    with helpers.tracing.span(
+        "sherlock-scrape", offer_source=offer_source, gtin=payload.get("gtin")
+    ):
+        await _scrape_and_publish(offer_source, payload)
+
+
+async def _scrape_and_publish(offer_source: OfferSourceType, payload: Payload) -> None:
+    gtin = payload.get("gtin", None)
+    sku = payload.get("sku", None)
+
     logger.info(
         "offer-scraping-started",
         offer_source=offer_source,
-        payload=payload,
         gtin=gtin,
+        sku=sku,
+        product_id=payload.get("product_id"),
+        triggered_by=payload.get("triggered_by", {}).get("source"),
+        nb_offer_urls=sum(len(urls) for urls in payload.get("offer_urls", {}).values()),
     )
+    # The full payload, only rendered with LOG_LEVEL=debug
+    logger.debug("offer-scraping-payload", offer_source=offer_source, payload=payload)
+
+    loop = asyncio.get_event_loop()
 
     cached_offer_urls = payload.get("offer_urls")
     offers = []
     exceptions: list[tuple[Exception, str]] = []
+    # False when some countries or pages were given up for lack of time
+    is_complete = True
+    batched_publisher: Optional[helpers.offers.BatchedOffersPublisher] = None
     cached_offer_single_url = {
         k: l[0] for k, l in cached_offer_urls.items() if len(l) >= 1
     }
@@ -128,57 +224,88 @@ def _sherlock_scrape(offer_source: OfferSourceType, payload: Payload) -> None:
     if not gtin and offer_source != "google_shopping":
         pass
 
+    countries = (
+        await loop.run_in_executor(None, _get_google_shopping_countries, payload)
+        if offer_source == "google_shopping"
+        else None
+    )
+
+    # Reuse the offers of an identical scrape triggered just before, instead of
+    # scraping the same pages again.
+    coalescing_key = helpers.coalescing.make_key(
+        offer_source, gtin, sku, countries, cached_offer_urls
+    )
+    reused_offers, claimed = await loop.run_in_executor(
+        None, helpers.coalescing.get_or_claim, coalescing_key
+    )
+    if reused_offers is not None:
+        logger.info(
+            "reusing offers of identical scrape",
+            offer_source=offer_source,
+            gtin=gtin,
+            nb_offers=len(reused_offers),
+        )
+        await loop.run_in_executor(
+            None,
+            helpers.tracing.bind(_publish_reused_offers),
+            payload,
+            reused_offers,
+            offer_source,
+            countries,
+        )
+        return
+
     try:
         if offer_source == "prisjakt":
             pass
         elif offer_source == "pricerunner":
-            offers = pricerunner.scrape(gtin, cached_offer_single_url)
+            pricerunner = _load_scraper("pricerunner")
+            offers = await loop.run_in_executor(
+                None,
+                helpers.tracing.bind(
+                    functools.partial(pricerunner.scrape, gtin, cached_offer_single_url)
+                ),
+            )
         elif offer_source == "kelkoo":
-            offers = kelkoo.scrape(gtin)
+            kelkoo = _load_scraper("kelkoo")
+            offers = await loop.run_in_executor(
+                None, helpers.tracing.bind(kelkoo.scrape), gtin
+            )
         elif offer_source == "idealo":
-            offers = idealo.scrape(gtin, cached_offer_single_url)
+            idealo = _load_scraper("idealo")
+            offers = await loop.run_in_executor(
+                None,
+                helpers.tracing.bind(
+                    functools.partial(idealo.scrape, gtin, cached_offer_single_url)
+                ),
+            )
         elif offer_source == "google_shopping":
-            default_countries = [
-                "SE",
-                "FI",
-                "NO",
-                "DK",
-                "DE",
-                "UK",
-                "NL",
-                "PL",
-                "CZ",
-                "FR",
-                # "IT",
-                # "BE",
-                # "IE",
-                # "PT",
-                # "CH",
-                # "GR",
-                # "SK",
-                # "RO",
-                # "HU",
-            ]
-
-            if (
-                "triggered_by" in payload
-                and "target_countries" in payload["triggered_by"]
-                and payload["triggered_by"]["target_countries"]
-            ):
-                countries = payload["triggered_by"]["target_countries"]
-            else:
-                countries = default_countries
-
-            offers, exceptions = asyncio.run(
-                google_shopping.scrape(
-                    gtin,
-                    sku,
-                    cached_offer_urls,
-                    countries,
-                )
+            assert countries is not None
+            # Publish every country as soon as it's done, so that a timeout
+            # in one country doesn't lose the offers of the others.
+            batched_publisher = helpers.offers.BatchedOffersPublisher(
+                payload, offer_source
+            )
+            (
+                offers,
+                exceptions,
+                is_complete,
+            ) = await _scrape_google_shopping_by_country(
+                gtin,
+                sku,
+                cached_offer_urls,
+                countries,
+                batched_publisher,
+                _get_product_key(payload),
             )
         elif offer_source == "kuantokusta":
-            offers = kuantokusta.scrape(gtin)
+            kuantokusta = _load_scraper("kuantokusta")
+            offers = await loop.run_in_executor(
+                None,
+                helpers.tracing.bind(
+                    functools.partial(kuantokusta.scrape, gtin, cached_offer_single_url)
+                ),
+            )
         else:
             raise Exception(f"Offer source {offer_source} not supported.")
 
@@ -194,8 +321,165 @@ def _sherlock_scrape(offer_source: OfferSourceType, payload: Payload) -> None:
         if len(exceptions) > 0:
             raise exceptions[0][0]
 
+        # An incomplete scrape would deprive the identical ones of the missing
+        # offers. So could an empty one: the scrapers return no offers when
+        # they give up on a page (Scrapfly error or credits exhausted, blocked
+        # by idealo, ...).
+        if is_complete and offers:
+            await loop.run_in_executor(
+                None, helpers.coalescing.store, coalescing_key, offers
+            )
+        else:
+            logger.info(
+                "incomplete or empty scrape, not shared",
+                offer_source=offer_source,
+                gtin=gtin,
+            )
+
     except Exception as ex:
         logger.exception("exception", exc_info=ex)
         raise ex
     finally:
+        if claimed:
+            await loop.run_in_executor(
+                None, helpers.coalescing.release, coalescing_key
+            )
+        helpers.tracing.set_attribute("offer_count", len(offers))
+        if batched_publisher is not None:
+            await loop.run_in_executor(
+                None, helpers.tracing.bind(batched_publisher.publish_last)
+            )
+        else:
+            await loop.run_in_executor(
+                None,
+                helpers.tracing.bind(helpers.offers.publish_offers),
+                payload,
+                offers,
+                offer_source,
+            )
+
+
+def _get_google_shopping_countries(payload: Payload) -> list[str]:
+    default_countries = [
+        "SE",
+        "FI",
+        "NO",
+        "DK",
+        "DE",
+        "UK",
+        "NL",
+        "PL",
+        "CZ",
+        "FR",
+        # "IT",
+        # "BE",
+        # "IE",
+        # "PT",
+        # "CH",
+        # "GR",
+        # "SK",
+        # "RO",
+        # "HU",
+    ]
+
+    if (
+        "triggered_by" in payload
+        and "target_countries" in payload["triggered_by"]
+        and payload["triggered_by"]["target_countries"]
+    ):
+        return payload["triggered_by"]["target_countries"]
+
+    product_key = _get_product_key(payload)
+    if product_key is None:
+        return default_countries
+
+    # Skip the countries where the product is unlikely to have offers
+    return helpers.yield_stats.select_countries(
+        "google_shopping",
+        product_key,
+        default_countries,
+        GOOGLE_SHOPPING_MAX_COUNTRIES,
+    )
+
+
+def _get_product_key(payload: Payload) -> Optional[str]:
+    """Identifier of the product in `helpers.yield_stats`."""
+    for key in ["product_id", "gtin", "sku"]:
+        if payload.get(key):
+            return str(payload[key])  # type: ignore
+    return None
+
+
+def _publish_reused_offers(
+    payload: Payload,
+    offers: list[helpers.offers.Offer],
+    offer_source: OfferSourceType,
+    countries: Optional[list[str]],
+) -> None:
+    if countries is not None:
+        # Same shape of messages as a scrape by country, in a single batch.
+        batched_publisher = helpers.offers.BatchedOffersPublisher(
+            payload, offer_source
+        )
+        batched_publisher.publish(offers, countries, is_last=True)
+    else:
         helpers.offers.publish_offers(payload, offers, offer_source)
+
+
+async def _scrape_google_shopping_by_country(
+    gtin: Optional[str],
+    sku: Optional[str],
+    cached_offer_urls: dict,
+    countries: list[str],
+    batched_publisher: helpers.offers.BatchedOffersPublisher,
+    product_key: Optional[str] = None,
+) -> tuple[list, list[tuple[Exception, str]], bool]:
+    """The offers and errors of the `countries`, and whether they were all
+    scraped in full, i.e. no country or page was given up for lack of time."""
+    loop = asyncio.get_event_loop()
+
+    offers = []
+    exceptions: list[tuple[Exception, str]] = []
+    complete_countries: set[str] = set()
+    google_shopping = _load_scraper("google_shopping")
+    results_per_country = google_shopping.scrape_by_country(
+        gtin, sku, cached_offer_urls, countries
+    )
+    async for country, country_offers, country_exceptions in results_per_country:
+        await loop.run_in_executor(
+            None,
+            helpers.tracing.bind(batched_publisher.publish),
+            country_offers,
+            [country],
+        )
+        offers.extend(country_offers)
+        if not any(
+            isinstance(ex, helpers.deadline.DeadlineExceeded)
+            for ex, _ in country_exceptions
+        ):
+            complete_countries.add(country)
+        # Pages skipped for lack of time are not errors
+        exceptions.extend(
+            (ex, ex_country)
+            for ex, ex_country in country_exceptions
+            if not isinstance(ex, helpers.deadline.DeadlineExceeded)
+        )
+
+        # Countries without cached URL, that failed, or with pages skipped for
+        # lack of time, say nothing of the yield
+        has_urls = any(
+            cached_offer_urls.get(offer_source)
+            for offer_source in google_shopping.get_offer_sources(country)
+        )
+        if product_key is not None and has_urls and not country_exceptions:
+            await loop.run_in_executor(
+                None,
+                helpers.yield_stats.record,
+                "google_shopping",
+                product_key,
+                country,
+                len(country_offers),
+            )
+
+    # The countries abandoned at the deadline are never yielded
+    return offers, exceptions, complete_countries == set(countries)
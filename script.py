@@ -20,12 +20,21 @@ from tqdm import tqdm
 from sherlock_offer_scrapers.persistence.db.db_source import DBProductsSource
 
 from sherlock_offer_scrapers.persistence.db.db_sink import DBProductsResultSink
-from sherlock_offer_scrapers.persistence.sink import ProductSearchResult
 from sherlock_offer_scrapers.scrapers.google_shopping import uule_of_country
 from sherlock_offer_scrapers.searcher.generic import (
     normalise_gtin14,
     find_gtin_from_retailer_url,
 )
+from sherlock_offer_scrapers.searcher.batch import (
+    SearchResult,
+    SearchTask,
+    merge_results,
+    read_results,
+    run_sharded,
+    search,
+    select_shard,
+    shard_name,
+)
 from sherlock_offer_scrapers.searcher.google_shopping import GoogleShoppingSearcher
 
 app = typer.Typer(pretty_exceptions_show_locals=False)
@@ -53,8 +62,16 @@ def run(
     products_file: str,
     default_brand: Annotated[str, typer.Argument()] = "Muuto",
     sample_countries: Annotated[int, typer.Option()] = 4,
+    processes: Annotated[int, typer.Option()] = 1,
+    output_dir: Annotated[str, typer.Option()] = "output",
 ):
-    logging.basicConfig(filename="output/logs", encoding="utf-8", level=logging.DEBUG)
+    """
+    With --processes N, the searches run in N worker processes, to use N cores (see
+    `sherlock_offer_scrapers.searcher.batch`). Use `--processes 0` for one per core.
+    """
+    logging.basicConfig(
+        filename=os.path.join(output_dir, "logs"), encoding="utf-8", level=logging.DEBUG
+    )
     products = []
 
     # read the gtin and product name from the csv file
@@ -66,7 +83,7 @@ def run(
             else:
                 products.append((row[0], row[1], row[2], default_brand))
 
-    google_shopping_searcher.load_from_disk()
+    google_shopping_searcher.load_from_disk(output_dir)
 
     countries = [c for c in uule_of_country.keys()]
 
@@ -74,48 +91,101 @@ def run(
     # take less time each week
     countries = random.sample(countries, sample_countries)
 
-    for c in tqdm(countries, desc="Countries"):
-        for product in tqdm(products, desc="Input products"):
-            logger.info(
-                "Starting with parameters",
-                product_name=product[2],
-                gtin=product[1],
-                sku=product[0],
-                brand=product[3],
-            )
-            sku, gtin, name, brand = product
-            gtin = normalise_gtin14(gtin)
+    tasks = [
+        SearchTask(sku=sku, gtin=gtin, name=name, brand=brand, country=c)
+        for c in countries
+        for sku, gtin, name, brand in products
+    ]
+
+    if processes == 0:
+        processes = os.cpu_count() or 1
 
-            try:
-                product_id = google_shopping_searcher.find_product_id(
-                    name=name, gtin=gtin, sku=sku, country=c, brand=brand
-                )
+    if processes > 1:
+        with tqdm(total=len(tasks), desc="Searches") as progress_bar:
 
-                logger.info("Found product id", id=product_id)
-                google_shopping_searcher.save_to_disk()
+            def save_result(result: SearchResult):
+                if result.error is not None:
+                    logger.warn("Exception encountered", exception=result.error)
+                else:
+                    logger.info("Found product id", id=result.product_id)
+                    _save_result(result.task, result.product_id, output_dir)
+                progress_bar.update()
 
-                with open("output/products_results.csv", "a") as f:
-                    f.write(f"{sku},{gtin},{product_id if product_id else ''}\n")
-            except Exception as e:
-                logger.warn("Exception encountered", exception=str(e))
+            run_sharded(tasks, google_shopping_searcher, processes, save_result)
+        return
+
+    for task in tqdm(tasks, desc="Searches"):
+        logger.info(
+            "Starting with parameters",
+            product_name=task.name,
+            gtin=task.gtin,
+            sku=task.sku,
+            brand=task.brand,
+        )
+
+        try:
+            product_id = search(google_shopping_searcher, task)
+
+            logger.info("Found product id", id=product_id)
+            _save_result(task, product_id, output_dir)
+        except Exception as e:
+            logger.warn("Exception encountered", exception=str(e))
+
+
+def _save_result(task: SearchTask, product_id: Optional[str], output_dir: str):
+    google_shopping_searcher.save_to_disk(output_dir)
+
+    gtin = normalise_gtin14(task.gtin)
+    with open(os.path.join(output_dir, "products_results.csv"), "a") as f:
+        f.write(f"{task.sku},{gtin},{product_id if product_id else ''}\n")
 
 
 @app.command()
-def run_auto():
+def run_auto(
+    processes: Annotated[int, typer.Option()] = 1,
+    shard_index: Annotated[int, typer.Option(envvar="BATCH_TASK_INDEX")] = 0,
+    shard_count: Annotated[int, typer.Option(envvar="BATCH_TASK_COUNT")] = 1,
+    run_id: Annotated[Optional[str], typer.Option(envvar="RUN_ID")] = None,
+):
     """
     The purpose with this function is to connect to the db and create its own input, save its output, and sync the
     storage to google cloud storage.
 
     We want to have this no param script to run inside a container in Google Cloud Batch.
+
+    The products can be split between the tasks of a Cloud Batch job: each task only searches the products of its
+    shard (by GTIN), and uploads its output under `google_searches_cache/{run_id}/shard-{index}-of-{count}/`.
+    The tasks of a job must share the same RUN_ID, and their results are saved to the db by `merge-shards` once
+    all of them are done.
     """
+    if shard_count > 1 and run_id is None:
+        raise typer.BadParameter("RUN_ID must be set to run several shards")
+    if run_id is None:
+        run_id = uuid.uuid4().hex
+
     products_source = DBProductsSource()
     products = products_source.get_products()
 
+    input_file = "input/auto_input.csv"
+    output_dir = "output/"
+    gcs_prefix = f"google_searches_cache/{run_id}"
+    if shard_count > 1:
+        shard = shard_name(shard_index, shard_count)
+        products = select_shard(
+            products,
+            lambda p: normalise_gtin14(p.gtin) or p.sku or "",
+            shard_index,
+            shard_count,
+        )
+        input_file = f"input/auto_input_{shard}.csv"
+        output_dir = f"output/{shard}/"
+        gcs_prefix = f"{gcs_prefix}/{shard}"
+
     if not os.path.exists("input/"):
         os.makedirs("input/")
 
     # save to file
-    with open("input/auto_input.csv", "w") as f:
+    with open(input_file, "w") as f:
         input_writer = csv.writer(f, delimiter=",", quotechar='"')
         for product in products:
             input_writer.writerow(
@@ -127,41 +197,77 @@ def run_auto():
                 ]
             )
 
-    if not os.path.exists("output/"):
-        os.makedirs("output/")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-    run("input/auto_input.csv")
+    run(input_file, processes=processes, output_dir=output_dir)
 
     storage_client = storage.Client("panprices")
     bucket = storage_client.get_bucket("panprices_logs")
-    run_id = uuid.uuid4().hex
     # Print not log, the logs go to the file on disk, we want to show this in console
     print(f"Logging run_id {run_id}")
 
-    blob = bucket.blob(f"google_searches_cache/{run_id}/input.csv")
-    blob.upload_from_filename("input/auto_input.csv")
+    blob = bucket.blob(f"{gcs_prefix}/input.csv")
+    blob.upload_from_filename(input_file)
+
+    for file in os.listdir(output_dir):
+        path = os.path.join(output_dir, file)
+        if os.path.isfile(path):
+            blob = bucket.blob(f"{gcs_prefix}/{file}")
+            blob.upload_from_filename(path)
 
-    for file in os.listdir("output/"):
-        blob = bucket.blob(f"google_searches_cache/{run_id}/{file}")
-        blob.upload_from_filename(f"output/{file}")
+    if shard_count > 1:
+        print(f"Shard {shard_index} of {shard_count} done, see merge-shards")
+        return
 
     sink = DBProductsResultSink()
-    product_results = []
-    with open("output/products_results.csv") as results_file:
-        csv_reader = csv.reader(results_file)
-        for row in csv_reader:
-            if len(row) < 3 or not row[2]:
-                continue  # if we don't have an id now, we don't save it to the db
-
-            product_results.append(
-                ProductSearchResult(
-                    sku=row[0],
-                    gtin=row[1],
-                    url=row[2],
-                )
+    sink.persist(read_results(os.path.join(output_dir, "products_results.csv")))
+
+
+@app.command()
+def merge_shards(
+    shard_count: Annotated[int, typer.Option(envvar="BATCH_TASK_COUNT")],
+    run_id: Annotated[str, typer.Option(envvar="RUN_ID")],
+    local_dir: Annotated[Optional[str], typer.Option()] = None,
+):
+    """
+    Save the results of all the shards of a sharded `run-auto` to the db, in a single transaction.
+
+    The results are read from `google_searches_cache/{run_id}/`, or from the output directory of shards run locally
+    with --local-dir output.
+    """
+    results_per_shard = []
+    missing_shards = []
+    for shard_index in range(shard_count):
+        shard = shard_name(shard_index, shard_count)
+        if local_dir is not None:
+            results_file = os.path.join(local_dir, shard, "products_results.csv")
+        else:
+            results_file = os.path.join("output", shard, "products_results.csv")
+            os.makedirs(os.path.dirname(results_file), exist_ok=True)
+            blob = (
+                storage.Client("panprices")
+                .bucket("panprices_logs")
+                .blob(f"google_searches_cache/{run_id}/{shard}/products_results.csv")
             )
+            if blob.exists():
+                blob.download_to_filename(results_file)
+            elif os.path.exists(results_file):
+                os.remove(results_file)  # Of another run
+
+        if not os.path.exists(results_file):
+            missing_shards.append(shard_index)
+            continue
+        results_per_shard.append(read_results(results_file))
+
+    if missing_shards:
+        # Save the shards that are done anyway, the others can be merged later
+        logger.warn("Missing shard results", run_id=run_id, shards=missing_shards)
+        print(f"Missing the results of the shards {missing_shards}")
 
-    sink.persist(product_results)
+    product_results = merge_results(results_per_shard)
+    DBProductsResultSink().persist(product_results)
+    print(f"Saved {len(product_results)} results of {len(results_per_shard)} shards")
 
 
 @app.command()
@@ -289,10 +395,11 @@ def find_single_product(
     name: str,
     brand: Annotated[Optional[str], typer.Argument()],
     countries: Annotated[Optional[List[str]], typer.Argument()],
+    hedged: Annotated[bool, typer.Option()] = False,
 ):
     logging.basicConfig(filename="output/logs", encoding="utf-8", level=logging.DEBUG)
     product_id = google_shopping_searcher.find_product_id_multiple_markets(
-        name, gtin, countries, brand
+        name, gtin, None, countries, brand, hedged=hedged
     )
     print(product_id)
 
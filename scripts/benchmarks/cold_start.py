@@ -0,0 +1,69 @@
+"""Measure the import time paid by each Cloud Function on a cold start.
+
+Every entry point imports `main`, then the scraper of its source on first
+use. The Pub/Sub client is only imported when the results get published,
+which is reported separately.
+
+Run from the root of the repository:
+    $ python scripts/benchmarks/cold_start.py --runs 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    "sherlock_pricerunner": ["pricerunner"],
+    "sherlock_kelkoo": ["kelkoo"],
+    "sherlock_idealo": ["idealo"],
+    "sherlock_gs_offers": ["google_shopping"],
+    "sherlock_kuantokusta": ["kuantokusta"],
+    "sherlock_products": ["google_shopping", "idealo", "pricerunner"],
+}
+
+
+def measure_import_time_ms(code: str) -> float:
+    """Total import time of `code` in a fresh interpreter, using -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Only count top-level imports, nested ones are part of their cumulative
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+
+    return total_us / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'entry point':<24}{'imports (ms)':>14}{'+ pubsub (ms)':>16}")
+    for entry_point, offer_sources in ENTRY_POINTS.items():
+        load_scrapers = "; ".join(
+            f"main._load_scraper('{offer_source}')" for offer_source in offer_sources
+        )
+        scrape = f"import main; {load_scrapers}"
+        publish = f"{scrape}; from google.cloud import pubsub_v1"
+
+        scrape_ms = statistics.median(
+            measure_import_time_ms(scrape) for _ in range(args.runs)
+        )
+        publish_ms = statistics.median(
+            measure_import_time_ms(publish) for _ in range(args.runs)
+        )
+        print(f"{entry_point:<24}{scrape_ms:>14.0f}{publish_ms:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare the decoding of the obfuscated Idealo product names with the
+previous implementation: ROT47 built one character at a time, and a
+BeautifulSoup parser per name to strip the tags.
+
+A page has up to 30 offers, and most of their names are obfuscated.
+
+Run from the root of the repository:
+    $ PYTHONPATH=. python scripts/benchmarks/idealo_names.py --pages 100
+"""
+
+import argparse
+import codecs
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from sherlock_offer_scrapers.scrapers.idealo import idealo
+
+OFFERS_PER_PAGE = 30
+OBFUSCATED_RATIO = 0.8
+
+NAMES = [
+    "Panasonic Lumix DMC-LX15 Black 4K Black LX-15",
+    "Panasonic Lumix DMC-LX15 <b>Schwarz</b> &amp; Tasche",
+    "Apple iPhone 15 Pro 128GB Titan Natur (MTUX3ZD/A)",
+    "Samsung Galaxy S24 Ultra 256GB Titanium Black &quot;Enterprise&quot;",
+    "Sony WH-1000XM5 Kabellose Kopfhörer mit Noise Cancelling, Schwarz",
+]
+
+
+def reference_decode_product_name(encrypted_product_name: str) -> str:
+    original = ""
+    text = encrypted_product_name.replace(r"（", r"W").replace(r"）", r"X")
+    text = codecs.decode(text, "unicode_escape")  # type: ignore
+    for ch in text:
+        ascii_code = ord(ch)
+        if ascii_code >= 33 and ascii_code <= 126:
+            original += chr(33 + ((ascii_code + 14) % 94))
+        else:
+            original += ch
+
+    soup = BeautifulSoup(original, features="html.parser")
+    return soup.get_text()
+
+
+def encode_product_name(product_name: str) -> str:
+    ciphertext = product_name.translate(idealo._ROT47_TABLE)
+    return ciphertext.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def make_pages(nb_pages: int) -> list[list[str]]:
+    random.seed(0)
+    pages = []
+    for _ in range(nb_pages):
+        page = []
+        for _ in range(OFFERS_PER_PAGE):
+            if random.random() < OBFUSCATED_RATIO:
+                # Only ASCII names, that `unicode_escape` leaves untouched
+                name = random.choice(NAMES).encode("ascii", "ignore").decode()
+                page.append(encode_product_name(name))
+        pages.append(page)
+    return pages
+
+
+def measure_ms(decode, pages: list[list[str]]) -> float:
+    start = time.perf_counter()
+    for page in pages:
+        for encrypted_product_name in page:
+            decode(encrypted_product_name)
+    return (time.perf_counter() - start) * 1000 / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    for page in pages:
+        for encrypted_product_name in page:
+            assert idealo._decode_product_name(
+                encrypted_product_name
+            ) == reference_decode_product_name(encrypted_product_name)
+
+    reference_ms = measure_ms(reference_decode_product_name, pages)
+    current_ms = measure_ms(idealo._decode_product_name, pages)
+    print(f"reference: {reference_ms:.3f} ms per page")
+    print(f"current:   {current_ms:.3f} ms per page")
+    print(f"speedup:   x{reference_ms / current_ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compare the parsing of an Idealo product page with only the regions that we
+read (see `idealo._PAGE_REGIONS`) against the parsing of the full page.
+
+The page is the offers page of the tests, padded with the kind of markup that
+makes up most of a real page (menus, scripts, recommendations), and with 30
+offers.
+
+Run from the root of the repository:
+    $ PYTHONPATH=. python scripts/benchmarks/idealo_page.py --runs 20
+"""
+
+import argparse
+import pathlib
+import statistics
+import time
+import tracemalloc
+
+from sherlock_offer_scrapers.scrapers.idealo import idealo
+
+FIXTURE = (
+    pathlib.Path(__file__).parents[2]
+    / "tests/test_scrapers/idealo/data/offers_page.html"
+)
+
+OFFERS_PER_PAGE = 30
+
+
+def make_page() -> str:
+    page = FIXTURE.read_text()
+
+    start = page.index('      <li class="productOffers-listItem">')
+    end = page.index("    </ul>\n  </div>\n</body>")
+    offers = page[start:end].split("\n      <li")
+    offers = [offers[0]] + ["      <li" + offer for offer in offers[1:]]
+    offers = (offers * OFFERS_PER_PAGE)[:OFFERS_PER_PAGE]
+
+    menu = "".join(
+        f'<li class="nav-item"><a href="/cat/{i}"><span>Category {i}</span></a></li>'
+        for i in range(400)
+    )
+    script = "<script>window.data = {%s};</script>" % ",".join(
+        f'"k{i}": "{"x" * 40}"' for i in range(2000)
+    )
+    recommendations = "".join(
+        f'<div class="reco"><img src="/img/{i}.jpg"><p>Product {i}</p>'
+        f'<span class="price">{i},99 €</span></div>'
+        for i in range(300)
+    )
+
+    page = page[:start] + "\n".join(offers) + "\n" + page[end:]
+    page = page.replace("<body>", f"<body><nav><ul>{menu}</ul></nav>{script}")
+    page = page.replace("</body>", f"<footer>{recommendations}</footer></body>")
+    return page
+
+
+def measure(page: str, runs: int) -> tuple[float, float]:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        idealo._parse_offers(page, "DE")
+        durations.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    idealo._parse_offers(page, "DE")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statistics.median(durations), peak / 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    page = make_page()
+    regions = idealo._PAGE_REGIONS
+
+    offers = idealo._parse_offers(page, "DE")
+    regions_ms, regions_mb = measure(page, args.runs)
+
+    idealo._PAGE_REGIONS = None
+    full_page_offers = idealo._parse_offers(page, "DE")
+    full_page_ms, full_page_mb = measure(page, args.runs)
+    idealo._PAGE_REGIONS = regions
+
+    assert offers == full_page_offers
+
+    print(f"page: {len(page) / 1000:.0f} KB, {len(offers)} offers")
+    print(f"{'':<12}{'time (ms)':>12}{'peak (MB)':>12}")
+    print(f"{'full page':<12}{full_page_ms:>12.1f}{full_page_mb:>12.1f}")
+    print(f"{'regions':<12}{regions_ms:>12.1f}{regions_mb:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
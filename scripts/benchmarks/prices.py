@@ -0,0 +1,61 @@
+"""Compare the memoised price parsing of `helpers.prices` with parsing every
+price text again.
+
+Google Shopping pages have ~20 rows, and the same price texts come back on
+many rows and pages.
+
+Run from the root of the repository:
+    $ PYTHONPATH=. python scripts/benchmarks/prices.py --pages 200
+"""
+
+import argparse
+import random
+import time
+
+from sherlock_offer_scrapers.helpers import prices
+
+ROWS_PER_PAGE = 20
+DISTINCT_PRICES = 200
+
+
+def make_pages(nb_pages: int) -> list[list[tuple[str, str]]]:
+    random.seed(0)
+    price_texts = [
+        (f"{random.randint(10, 5000)},{random.choice(['00', '99', '95'])} kr", "SE")
+        for _ in range(DISTINCT_PRICES // 2)
+    ] + [
+        (f"€{random.randint(10, 5000)}.{random.choice(['00', '99', '95'])}", "NL")
+        for _ in range(DISTINCT_PRICES // 2)
+    ]
+    return [
+        [random.choice(price_texts) for _ in range(ROWS_PER_PAGE)]
+        for _ in range(nb_pages)
+    ]
+
+
+def measure_ms(parse, pages) -> float:
+    start = time.perf_counter()
+    for page in pages:
+        for price_text, country in page:
+            parse(price_text, country)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    prices.parse_price.cache_clear()
+
+    uncached_ms = measure_ms(prices.parse_price.__wrapped__, pages)
+    cached_ms = measure_ms(prices.parse_price, pages)
+
+    print(f"{len(pages) * ROWS_PER_PAGE} rows, {DISTINCT_PRICES} distinct prices")
+    print(f"uncached: {uncached_ms:.1f} ms")
+    print(f"cached:   {cached_ms:.1f} ms ({prices.parse_price.cache_info()})")
+
+
+if __name__ == "__main__":
+    main()
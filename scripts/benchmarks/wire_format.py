@@ -0,0 +1,118 @@
+"""Compare the size and the encoding/decoding time of the formats of the
+`b2b_live_search_offers` messages, see `helpers/message_encoding.py`.
+
+The offers are made up to look like the ones of Idealo: one product sold by
+many retailers in a few countries, with a long description and specs.
+
+Run from the root of the repository:
+    $ PYTHONPATH=. python scripts/benchmarks/wire_format.py --offers 200 --runs 20
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from sherlock_offer_scrapers.helpers import message_encoding
+
+FORMATS = [
+    ("json", "none"),
+    ("json", "gzip"),
+    ("compact", "none"),
+    ("compact", "gzip"),
+    ("compact", "zstd"),
+]
+
+
+def make_message(nb_offers: int) -> dict:
+    countries = ["DE", "UK", "FR", "IT", "ES"]
+    metadata_per_country = {
+        country: json.dumps(
+            {
+                "description": f"Panasonic Lumix DMC-LX15 ({country}). " * 40,
+                "category": ["Electronics", "Photo", "Compact cameras"],
+                "images": [f"https://example.com/{country}/{i}.jpg" for i in range(8)],
+                "specs": {
+                    "General": {f"spec {i}": f"value {i}" for i in range(30)},
+                    "Display": {f"spec {i}": f"value {i}" for i in range(10)},
+                },
+            }
+        )
+        for country in countries
+    }
+
+    offers = []
+    for i in range(nb_offers):
+        country = countries[i % len(countries)]
+        offers.append(
+            {
+                "offer_source": "idealo",
+                "offer_url": f"https://www.idealo.de/relocator/relocate?offerKey={i}",
+                "retail_prod_name": "Panasonic Lumix DMC-LX15 Black 4K",
+                "retailer_name": f"Retailer {i}",
+                "country": country,
+                "price": 40000 + i,
+                "currency": "EUR",
+                "stock_status": "in_stock",
+                "metadata": metadata_per_country[country],
+            }
+        )
+
+    return {
+        "created_at": 1718000000,
+        "product_id": 1234,
+        "gtin": "00889842651393",
+        "sku": None,
+        "product_token": "abcdef",
+        "offer_fetch_complete": False,
+        "offer_urls": {"idealo_DE": ["https://www.idealo.de/preisvergleich/1"]},
+        "user_country": "SE",
+        "triggered_by": {"source": "b2b_job"},
+        "offer_source": "idealo",
+        "offers": offers,
+    }
+
+
+def measure_ms(function, runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offers", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    message = make_message(args.offers)
+
+    print(f"{'format':<20}{'size (KB)':>12}{'encode (ms)':>14}{'decode (ms)':>14}")
+    for message_format, compression in FORMATS:
+        if (
+            compression == message_encoding.COMPRESSION_ZSTD
+            and message_encoding._get_zstandard() is None
+        ):
+            print(f"{message_format}+{compression:<15}  zstandard not installed")
+            continue
+
+        data, attributes = message_encoding.encode(message, message_format, compression)
+        encode_ms = measure_ms(
+            lambda: message_encoding.encode(message, message_format, compression),
+            args.runs,
+        )
+        decode_ms = measure_ms(
+            lambda: message_encoding.decode(data, attributes), args.runs
+        )
+
+        name = f"{message_format}+{compression}"
+        print(
+            f"{name:<20}{len(data) / 1000:>12.1f}{encode_ms:>14.2f}{decode_ms:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
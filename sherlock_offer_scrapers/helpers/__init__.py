@@ -1 +1,3 @@
-from . import offers, requests, structlog, dump_html
+from . import cache, coalescing, deadline, message_encoding, metrics, offers, prices
+from . import page_fingerprints, requests, scrapfly, structlog, tracing, dump_html
+from . import yield_stats
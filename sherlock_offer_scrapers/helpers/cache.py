@@ -0,0 +1,181 @@
+"""Key-value store with expiration, shared by the caches of the scrapers.
+
+The default backend is a SQLite file, enabled by setting `CACHE_SQLITE_PATH`
+(e.g. `/tmp/sherlock_cache.sqlite3`). It is only shared by the invocations
+running on the same instance, or by the processes of a script. Another
+backend (Redis, Firestore, ...) can be plugged in with `set_backend()` to share
+the cache between instances.
+
+When no backend is configured, nothing is cached.
+"""
+
+import abc
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional
+
+
+class CacheBackend(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Return the value of `key`, or None if it is missing or expired."""
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        pass
+
+    @abc.abstractmethod
+    def add(self, key: str, value: str, ttl_seconds: float) -> bool:
+        """Set `key` only if it is missing or expired, atomically.
+
+        Return whether the value has been set.
+        """
+        pass
+
+    @abc.abstractmethod
+    def increment(self, key: str, amount: int, ttl_seconds: float) -> int:
+        """Add `amount` to the integer value of `key`, atomically, and return the
+        new value.
+
+        A missing or expired key starts from 0 and expires in `ttl_seconds`. An
+        existing key keeps its expiration.
+        """
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+
+class SQLiteCacheBackend(CacheBackend):
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per operation: the backend is used from several
+        # threads, and a connection can't be shared between threads.
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) "
+                + "VALUES (?, ?, ?)",
+                (key, value, now + ttl_seconds),
+            )
+            _delete_expired(conn, now)
+
+    def add(self, key: str, value: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT 1 FROM cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at) "
+                        + "VALUES (?, ?, ?)",
+                        (key, value, now + ttl_seconds),
+                    )
+                _delete_expired(conn, now)
+                conn.execute("COMMIT")
+            except Exception as ex:
+                conn.execute("ROLLBACK")
+                raise ex
+
+        return row is None
+
+    def increment(self, key: str, amount: int, ttl_seconds: float) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM cache "
+                    + "WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    value, expires_at = amount, now + ttl_seconds
+                else:
+                    value, expires_at = int(row[0]) + amount, row[1]
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) "
+                    + "VALUES (?, ?, ?)",
+                    (key, str(value), expires_at),
+                )
+                _delete_expired(conn, now)
+                conn.execute("COMMIT")
+            except Exception as ex:
+                conn.execute("ROLLBACK")
+                raise ex
+
+        return value
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+def _delete_expired(conn: sqlite3.Connection, now: float) -> None:
+    # Expired rows are otherwise only replaced when their key is written again,
+    # and most keys (pages, fingerprints) are per url: the file would keep
+    # growing, in the /tmp of the instance.
+    conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+
+_backend: Optional[CacheBackend] = None
+_backend_configured = False
+_backend_lock = threading.Lock()
+
+
+def set_backend(backend: Optional[CacheBackend]) -> None:
+    global _backend, _backend_configured
+    with _backend_lock:
+        _backend = backend
+        _backend_configured = True
+
+
+def get_backend() -> Optional[CacheBackend]:
+    """The configured backend, or None if caching is disabled."""
+    global _backend, _backend_configured
+    with _backend_lock:
+        if not _backend_configured:
+            sqlite_path = os.environ.get("CACHE_SQLITE_PATH")
+            _backend = SQLiteCacheBackend(sqlite_path) if sqlite_path else None
+            _backend_configured = True
+
+    return _backend
@@ -0,0 +1,120 @@
+"""Coalesce identical scrapes triggered at nearly the same time.
+
+When several b2b jobs trigger the same product within a short window, only
+the first invocation scrapes. The others wait for its offers and republish
+them under their own payload. A scrape is identified by its source, product,
+countries and cached offer URLs, see `make_key()`.
+
+Relies on the backend of `helpers.cache`, and does nothing if it's disabled.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional, Tuple
+
+import structlog
+
+from . import cache, deadline
+from .offers import Offer
+
+logger = structlog.get_logger()
+
+# How long the offers of a scrape are reused for.
+RESULT_TTL_SECONDS = float(os.environ.get("COALESCING_RESULT_TTL_SECONDS", 300))
+
+# A scrape can't take longer than an invocation. After that, consider that the
+# invocation running it has died.
+IN_FLIGHT_TTL_SECONDS = deadline.FUNCTION_TIMEOUT_SECONDS
+
+POLL_INTERVAL_SECONDS = 1.0
+
+# Stop waiting for an identical scrape while there is still this much time left
+# to scrape by ourselves.
+MIN_SCRAPE_SECONDS = float(os.environ.get("COALESCING_MIN_SCRAPE_SECONDS", 60))
+
+
+def make_key(
+    offer_source: str,
+    gtin: Optional[str],
+    sku: Optional[str],
+    countries: Optional[list[str]],
+    offer_urls: Optional[dict],
+) -> str:
+    key_parts = {
+        "offer_source": offer_source,
+        "gtin": gtin,
+        "sku": sku,
+        "countries": sorted(countries) if countries else None,
+        "offer_urls": offer_urls,
+    }
+    digest = hashlib.sha256(
+        json.dumps(key_parts, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"scrape:{digest}"
+
+
+def get_or_claim(key: str) -> Tuple[Optional[list[Offer]], bool]:
+    """Return the offers of an identical scrape, or None if the caller has to
+    scrape by itself, and whether the caller has claimed the scrape.
+
+    If an identical scrape is running in another invocation, wait for its
+    offers until it's done, or until there is only `MIN_SCRAPE_SECONDS` left
+    before the deadline. If none is running, claim the scrape: the caller must
+    then call `release()` when done, after `store()` if the scrape succeeded.
+    A caller that gives up waiting scrapes without claiming, and must not
+    release the scrape of the other invocation.
+    """
+    backend = cache.get_backend()
+    if backend is None:
+        return None, False
+
+    while True:
+        offers = _get_offers(backend, key)
+        if offers is not None:
+            return offers, False
+
+        if backend.add(_in_flight_key(key), "1", IN_FLIGHT_TTL_SECONDS):
+            return None, True
+
+        if not deadline.has_time_for(MIN_SCRAPE_SECONDS + POLL_INTERVAL_SECONDS):
+            logger.warning("identical scrape did not finish in time", key=key)
+            return None, False
+
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def store(key: str, offers: list[Offer]) -> None:
+    backend = cache.get_backend()
+    if backend is None:
+        return
+
+    backend.set(
+        _result_key(key),
+        json.dumps([offer.to_message() for offer in offers]),
+        RESULT_TTL_SECONDS,
+    )
+
+
+def release(key: str) -> None:
+    backend = cache.get_backend()
+    if backend is None:
+        return
+
+    backend.delete(_in_flight_key(key))
+
+
+def _get_offers(backend: cache.CacheBackend, key: str) -> Optional[list[Offer]]:
+    value = backend.get(_result_key(key))
+    if value is None:
+        return None
+    return [Offer.from_message(message) for message in json.loads(value)]
+
+
+def _result_key(key: str) -> str:
+    return f"{key}:offers"
+
+
+def _in_flight_key(key: str) -> str:
+    return f"{key}:in_flight"
@@ -0,0 +1,59 @@
+"""Time budget of the current Cloud Function invocation.
+
+The functions are deployed with `--timeout=300s`. Anything still running when
+that time is up gets killed, so retries and new requests should only be made
+while there is enough time left to finish them.
+"""
+import os
+import time
+from typing import Optional
+
+
+FUNCTION_TIMEOUT_SECONDS = float(os.environ.get("FUNCTION_TIMEOUT_SECONDS", 300))
+
+# Time kept aside at the end of the invocation to publish the results.
+SAFETY_MARGIN_SECONDS = float(os.environ.get("DEADLINE_SAFETY_MARGIN_SECONDS", 15))
+
+_deadline: Optional[float] = None
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting work that cannot finish before the deadline."""
+
+    pass
+
+
+def start(timeout: float = FUNCTION_TIMEOUT_SECONDS) -> None:
+    """Start the budget of a new invocation."""
+    global _deadline
+    _deadline = time.monotonic() + timeout - SAFETY_MARGIN_SECONDS
+
+
+def clear() -> None:
+    global _deadline
+    _deadline = None
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline, or None if no deadline has been set
+    (e.g. when running the scrapers from a script)."""
+    if _deadline is None:
+        return None
+    return max(0.0, _deadline - time.monotonic())
+
+
+def has_time_for(seconds: float) -> bool:
+    time_left = remaining()
+    return time_left is None or time_left >= seconds
+
+
+def cap_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Shrink a request timeout so that it does not go past the deadline."""
+    time_left = remaining()
+    if time_left is None:
+        return timeout
+    if time_left <= 0:
+        raise DeadlineExceeded("No time left for this invocation.")
+    if timeout is None:
+        return time_left
+    return min(timeout, time_left)
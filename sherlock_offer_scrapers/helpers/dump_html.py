@@ -1,21 +1,219 @@
-from google.cloud import storage
+"""Dumps of the pages that couldn't be parsed, to debug the parsers.
+
+`dump_html()` only queues the page: the pages are compressed and uploaded by a
+background thread, so that a change of a website doesn't slow down every fetch
+that fails to parse it. `flush()` waits for the queued dumps to be uploaded and
+must be called before the end of the invocation.
+
+A page is dumped once per product and page variant: pages of the same product
+with the same structure (the classes used in the page) are only dumped once.
+At most `HTML_DUMP_MAX_PER_INVOCATION` pages are dumped per invocation.
+
+The dumps are uploaded to the `panprices_logs` bucket, or written to the
+directory `HTML_DUMP_DIR` if it is set (e.g. when running locally).
+"""
+
+import abc
+import collections
+import functools
+import gzip
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from typing import Optional
+
 import structlog
 
+from . import deadline
+
 logger = structlog.get_logger()
 
+MAX_DUMPS_PER_INVOCATION = int(os.environ.get("HTML_DUMP_MAX_PER_INVOCATION", 5))
+
+# Time given to the uploads by `flush()`, within the invocation deadline
+FLUSH_TIMEOUT_SECONDS = float(os.environ.get("HTML_DUMP_FLUSH_TIMEOUT_SECONDS", 10))
+
+# Pages already dumped by the instance, remembered across invocations
+_DEDUPE_SIZE = 1024
+
+_class_regex = re.compile(r'class="([^"]*)"')
+
+
+class DumpBackend(abc.ABC):
+    @abc.abstractmethod
+    def upload(self, path: str, data: bytes) -> None:
+        """Store the gzipped html `data` of a dump at `path`, without its
+        extension."""
+        pass
+
+
+class GCSBackend(DumpBackend):
+    def __init__(self, bucket_name: str = "panprices_logs"):
+        self.bucket_name = bucket_name
+
+    def upload(self, path: str, data: bytes) -> None:
+        # No get_bucket(), which is an API call of its own
+        bucket = _get_storage_client().bucket(self.bucket_name)
+        blob = bucket.blob(f"{path}.html")
+        # Served decompressed by GCS
+        blob.content_encoding = "gzip"
+        blob.upload_from_string(data, content_type="text/html")
+
+
+class LocalDirBackend(DumpBackend):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def upload(self, path: str, data: bytes) -> None:
+        filepath = os.path.join(self.directory, f"{path}.html.gz")
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "wb") as f:
+            f.write(data)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_storage_client():
+    # Imported here to keep it out of the cold start of every function.
+    from google.cloud import storage
+
+    return storage.Client("panprices")
+
+
+class DumpQueue:
+    def __init__(self, backend: DumpBackend, max_dumps: int = MAX_DUMPS_PER_INVOCATION):
+        self.backend = backend
+        self.max_dumps = max_dumps
+
+        self._queue: "queue.Queue[tuple[str, str]]" = queue.Queue()
+        self._lock = threading.Condition()
+        self._pending = 0
+        self._nb_dumps = 0
+        self._dumped: collections.OrderedDict = collections.OrderedDict()
+        self._worker: Optional[threading.Thread] = None
+
+    def put(self, html: str, offer_source: str, gtin: str, country: str) -> bool:
+        """Queue a dump, return whether it has been queued."""
+        variant = page_variant_hash(html)
+        key = (offer_source, gtin, variant)
+        with self._lock:
+            if key in self._dumped:
+                logger.info(
+                    "html dump skipped, page variant already dumped",
+                    offer_source=offer_source,
+                    gtin=gtin,
+                    country=country,
+                    page_variant=variant,
+                )
+                return False
+            if self._nb_dumps >= self.max_dumps:
+                logger.info(
+                    "html dump skipped, too many dumps in this invocation",
+                    offer_source=offer_source,
+                    gtin=gtin,
+                    country=country,
+                )
+                return False
+
+            self._dumped[key] = True
+            if len(self._dumped) > _DEDUPE_SIZE:
+                self._dumped.popitem(last=False)
+            self._nb_dumps += 1
+            self._pending += 1
+            self._start_worker()
+
+        path = f"offer_scrapers_html/{offer_source}/{gtin}_{country}_{variant}"
+        logger.warn(
+            "taking a html dump",
+            filepath=path,
+            offer_source=offer_source,
+            gtin=gtin,
+            country=country,
+        )
+        self._queue.put((path, html))
+        return True
+
+    def flush(self, timeout: Optional[float] = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Wait for the queued dumps to be uploaded, at most `timeout` seconds
+        and until the invocation deadline, and start a new invocation.
+
+        Return whether all the dumps have been uploaded.
+        """
+        time_left = deadline.remaining()
+        if time_left is not None:
+            timeout = time_left if timeout is None else min(timeout, time_left)
+
+        with self._lock:
+            done = self._lock.wait_for(lambda: self._pending == 0, timeout)
+            if not done:
+                logger.warning("html dumps not uploaded in time", pending=self._pending)
+            self._nb_dumps = 0
+            return done
+
+    def _start_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._upload_forever, name="dump-html", daemon=True
+            )
+            self._worker.start()
+
+    def _upload_forever(self) -> None:
+        while True:
+            path, html = self._queue.get()
+            start = time.monotonic()
+            try:
+                data = gzip.compress(html.encode("utf-8"), compresslevel=6)
+                self.backend.upload(path, data)
+                logger.info(
+                    "html dump uploaded",
+                    filepath=path,
+                    size_bytes=len(data),
+                    duration_ms=round((time.monotonic() - start) * 1000),
+                )
+            except Exception as ex:
+                logger.error("html dump upload failed", filepath=path, error=str(ex))
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._lock.notify_all()
+
+
+def page_variant_hash(html: str) -> str:
+    """Hash of the structure of a page, the same for the pages of a website
+    that only differ by their content."""
+    classes = set(_class_regex.findall(html))
+    return hashlib.sha1("\n".join(sorted(classes)).encode("utf-8")).hexdigest()[:12]
+
+
+_dump_queue: Optional[DumpQueue] = None
+_dump_queue_lock = threading.Lock()
+
+
+def _get_dump_queue() -> DumpQueue:
+    global _dump_queue
+    with _dump_queue_lock:
+        if _dump_queue is None:
+            directory = os.environ.get("HTML_DUMP_DIR")
+            backend = LocalDirBackend(directory) if directory else GCSBackend()
+            _dump_queue = DumpQueue(backend)
+
+    return _dump_queue
+
+
+def set_dump_queue(dump_queue: Optional[DumpQueue]) -> None:
+    global _dump_queue
+    with _dump_queue_lock:
+        _dump_queue = dump_queue
+
 
 def dump_html(html, offer_source, gtin, country):
-    filepath = f"offer_scrapers_html/{offer_source}/{gtin}.html"
-    logger.warn(
-        "taking a html dump",
-        filepath=filepath,
-        offer_source=offer_source,
-        gtin=gtin,
-        country=country,
-    )
-
-    storage_client = storage.Client("panprices")
-    bucket = storage_client.get_bucket("panprices_logs")
-    blob = bucket.blob(f"offer_scrapers_html/{offer_source}/{gtin}.html")
-
-    blob.upload_from_string(html)
+    _get_dump_queue().put(html, offer_source, gtin, country)
+
+
+def flush(timeout: Optional[float] = FLUSH_TIMEOUT_SECONDS) -> bool:
+    """Wait for the dumps of the invocation to be uploaded, if there are any."""
+    if _dump_queue is None:
+        return True
+    return _dump_queue.flush(timeout)
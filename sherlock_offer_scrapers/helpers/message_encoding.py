@@ -0,0 +1,174 @@
+"""Encoding of the `b2b_live_search_offers` messages.
+
+Two formats are supported, selected with the `OFFERS_MESSAGE_FORMAT` env var:
+
+- `json` (default): the message as plain JSON, with the metadata of every offer
+  as a JSON string. This is what the consumers have always received.
+- `compact`: the metadata are stored once as native objects in a `metadata`
+  table, and every offer references its metadata by index. Offers of the same
+  product from different retailers or countries often share the exact same
+  metadata, and their JSON strings are no longer escaped a second time.
+
+    {
+        "format": "compact",
+        "version": 1,
+        ...
+        "metadata": [{"images": ["https://..."]}],
+        "offers": [{"offer_url": "https://...", ..., "metadata": 0}],
+    }
+
+  An offer whose metadata is not valid JSON keeps the raw string.
+
+The data can additionally be compressed with `OFFERS_MESSAGE_COMPRESSION` set
+to `gzip` or `zstd` (requires the optional `zstandard` package, otherwise gzip
+is used). The format and the compression are set in the attributes of the
+Pub/Sub message, so that consumers know how to decode it with `decode()`.
+"""
+
+import gzip
+import json
+import os
+from typing import Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+COMPACT_VERSION = 1
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+
+# Names of the attributes of the Pub/Sub message
+FORMAT_ATTRIBUTE = "format"
+COMPRESSION_ATTRIBUTE = "compression"
+
+MESSAGE_FORMAT = os.environ.get("OFFERS_MESSAGE_FORMAT", FORMAT_JSON)
+MESSAGE_COMPRESSION = os.environ.get("OFFERS_MESSAGE_COMPRESSION", COMPRESSION_NONE)
+
+
+def encode(
+    message: dict,
+    message_format: str = MESSAGE_FORMAT,
+    compression: str = MESSAGE_COMPRESSION,
+) -> tuple[bytes, dict[str, str]]:
+    """Return the data and the attributes of the Pub/Sub message."""
+    attributes: dict[str, str] = {}
+
+    if message_format == FORMAT_COMPACT:
+        compact_message = _to_compact(message)
+        data = json.dumps(compact_message, separators=(",", ":")).encode("utf-8")
+        attributes[FORMAT_ATTRIBUTE] = f"{FORMAT_COMPACT}/{COMPACT_VERSION}"
+    elif message_format == FORMAT_JSON:
+        # Byte for byte what the consumers have always received
+        data = json.dumps(message).encode("utf-8")
+    else:
+        raise ValueError(f"Unknown message format: {message_format}")
+
+    if compression == COMPRESSION_ZSTD and _get_zstandard() is None:
+        logger.warning("zstandard is not installed, falling back to gzip")
+        compression = COMPRESSION_GZIP
+
+    if compression == COMPRESSION_GZIP:
+        data = gzip.compress(data, compresslevel=6)
+        attributes[COMPRESSION_ATTRIBUTE] = COMPRESSION_GZIP
+    elif compression == COMPRESSION_ZSTD:
+        data = _get_zstandard().ZstdCompressor(level=3).compress(data)
+        attributes[COMPRESSION_ATTRIBUTE] = COMPRESSION_ZSTD
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unknown message compression: {compression}")
+
+    return data, attributes
+
+
+def decode(data: bytes, attributes: Optional[dict[str, str]] = None) -> dict:
+    """Decode a message encoded with any format into the `json` format.
+
+    The metadata of the offers are converted back to JSON strings, so they may
+    differ from the original strings by their whitespace.
+    """
+    attributes = attributes or {}
+
+    compression = attributes.get(COMPRESSION_ATTRIBUTE, COMPRESSION_NONE)
+    if compression == COMPRESSION_GZIP:
+        data = gzip.decompress(data)
+    elif compression == COMPRESSION_ZSTD:
+        zstandard = _get_zstandard()
+        if zstandard is None:
+            raise ValueError("zstandard is required to decode this message")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unknown message compression: {compression}")
+
+    message = json.loads(data)
+
+    message_format = attributes.get(FORMAT_ATTRIBUTE, FORMAT_JSON)
+    if message_format == f"{FORMAT_COMPACT}/{COMPACT_VERSION}":
+        return _from_compact(message)
+    if message_format != FORMAT_JSON:
+        raise ValueError(f"Unknown message format: {message_format}")
+
+    return message
+
+
+def _to_compact(message: dict) -> dict:
+    metadata_table: list = []
+    metadata_indexes: dict[str, int] = {}
+
+    compact_offers = []
+    for offer in message["offers"]:
+        compact_offer = dict(offer)
+        metadata = offer.get("metadata")
+        if metadata is not None:
+            if metadata not in metadata_indexes:
+                try:
+                    metadata_table.append(json.loads(metadata))
+                except (TypeError, ValueError):
+                    metadata_indexes[metadata] = -1
+                else:
+                    metadata_indexes[metadata] = len(metadata_table) - 1
+
+            index = metadata_indexes[metadata]
+            # Keep the raw string if the metadata isn't JSON
+            compact_offer["metadata"] = index if index >= 0 else metadata
+        compact_offers.append(compact_offer)
+
+    compact_message = dict(message)
+    compact_message["format"] = FORMAT_COMPACT
+    compact_message["version"] = COMPACT_VERSION
+    compact_message["metadata"] = metadata_table
+    compact_message["offers"] = compact_offers
+    return compact_message
+
+
+def _from_compact(compact_message: dict) -> dict:
+    metadata_table = compact_message["metadata"]
+    metadata_strings = [json.dumps(metadata) for metadata in metadata_table]
+
+    offers = []
+    for compact_offer in compact_message["offers"]:
+        offer = dict(compact_offer)
+        metadata = compact_offer.get("metadata")
+        if isinstance(metadata, int):
+            offer["metadata"] = metadata_strings[metadata]
+        offers.append(offer)
+
+    message = {
+        key: value
+        for key, value in compact_message.items()
+        if key not in ("format", "version", "metadata")
+    }
+    message["offers"] = offers
+    return message
+
+
+def _get_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+
+    return zstandard
@@ -0,0 +1,221 @@
+"""Metrics of the HTTP requests made by the scrapers.
+
+Every request made with `helpers.requests` is measured (see `RequestMetrics`).
+The metrics are always added to the `make-request` log, and can also be sent to
+a metrics backend by setting `METRICS_EXPORTERS` to a comma-separated list of:
+
+- `prometheus`: histograms and counters of `prometheus_client`, labelled by
+  host, country, proxy and status code. Requires the optional
+  `prometheus-client` package.
+- `opentelemetry`: the same instruments with the meter provider configured
+  for OpenTelemetry. Requires the optional `opentelemetry-api` package.
+
+Other backends can be plugged in with `add_sink()`.
+"""
+
+import abc
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+import structlog
+
+logger = structlog.get_logger()
+
+
+@dataclass
+class RequestMetrics:
+    method: str
+    url: str
+    status_code: int
+    country: Optional[str]
+    proxy_ip: Optional[str]
+    # 1 when the request succeeded at the first try
+    attempts: int
+    # Time of all the attempts, including the backoff between them
+    duration_ms: int
+    # From sending the last attempt to receiving the headers of the response.
+    # requests doesn't tell apart the DNS resolution, the connection and the
+    # TLS handshake, so they are included when a new connection was opened.
+    ttfb_ms: int
+    # Time to read the body of the response of the last attempt
+    download_ms: int
+    # Size of the body as received, and once decompressed
+    wire_bytes: Optional[int]
+    body_bytes: int
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.url).hostname or ""
+
+    def to_log(self) -> dict:
+        return {
+            "request_attempts": self.attempts,
+            "request_duration_ms": self.duration_ms,
+            "response_ttfb_ms": self.ttfb_ms,
+            "response_download_ms": self.download_ms,
+            "response_wire_size_bytes": self.wire_bytes,
+        }
+
+
+def measure_request(
+    method: str,
+    url: str,
+    response: requests.Response,
+    attempts: int,
+    duration_seconds: float,
+    attempt_duration_seconds: float,
+    country: Optional[str] = None,
+    proxy_url: Optional[str] = None,
+) -> RequestMetrics:
+    """Metrics of a request whose body has been read, from the duration of all
+    its attempts and of the last attempt."""
+    ttfb_seconds = response.elapsed.total_seconds()
+    return RequestMetrics(
+        method=method,
+        url=url,
+        status_code=response.status_code,
+        country=country,
+        proxy_ip=urlsplit(proxy_url).hostname if proxy_url else None,
+        attempts=attempts,
+        duration_ms=round(duration_seconds * 1000),
+        ttfb_ms=round(ttfb_seconds * 1000),
+        download_ms=round(max(0.0, attempt_duration_seconds - ttfb_seconds) * 1000),
+        wire_bytes=_get_wire_bytes(response),
+        body_bytes=len(response.content),
+    )
+
+
+class MetricsSink(abc.ABC):
+    @abc.abstractmethod
+    def record_request(self, metrics: RequestMetrics) -> None:
+        pass
+
+
+class PrometheusSink(MetricsSink):
+    def __init__(self, registry=None):
+        import prometheus_client
+
+        labels = ["host", "country", "proxy_ip", "status_code"]
+        kwargs = {"registry": registry} if registry is not None else {}
+        self.duration = prometheus_client.Histogram(
+            "sherlock_request_duration_seconds",
+            "Duration of the requests, including the retries",
+            labels,
+            **kwargs,
+        )
+        self.ttfb = prometheus_client.Histogram(
+            "sherlock_request_ttfb_seconds",
+            "Time to the first byte of the response",
+            labels,
+            **kwargs,
+        )
+        self.attempts = prometheus_client.Counter(
+            "sherlock_request_attempts",
+            "Attempts made to send the requests",
+            labels,
+            **kwargs,
+        )
+        self.wire_bytes = prometheus_client.Counter(
+            "sherlock_response_wire_bytes",
+            "Size of the responses as received",
+            labels,
+            **kwargs,
+        )
+
+    def record_request(self, metrics: RequestMetrics) -> None:
+        labels = (
+            metrics.host,
+            metrics.country or "",
+            metrics.proxy_ip or "",
+            str(metrics.status_code),
+        )
+        self.duration.labels(*labels).observe(metrics.duration_ms / 1000)
+        self.ttfb.labels(*labels).observe(metrics.ttfb_ms / 1000)
+        self.attempts.labels(*labels).inc(metrics.attempts)
+        if metrics.wire_bytes is not None:
+            self.wire_bytes.labels(*labels).inc(metrics.wire_bytes)
+
+
+class OpenTelemetrySink(MetricsSink):
+    def __init__(self):
+        from opentelemetry import metrics
+
+        meter = metrics.get_meter("sherlock_offer_scrapers")
+        self.duration = meter.create_histogram("sherlock.request.duration", unit="ms")
+        self.ttfb = meter.create_histogram("sherlock.request.ttfb", unit="ms")
+        self.attempts = meter.create_counter("sherlock.request.attempts")
+        self.wire_bytes = meter.create_counter("sherlock.response.wire_size", unit="By")
+
+    def record_request(self, metrics: RequestMetrics) -> None:
+        attributes = {
+            "host": metrics.host,
+            "country": metrics.country or "",
+            "proxy_ip": metrics.proxy_ip or "",
+            "status_code": metrics.status_code,
+        }
+        self.duration.record(metrics.duration_ms, attributes)
+        self.ttfb.record(metrics.ttfb_ms, attributes)
+        self.attempts.add(metrics.attempts, attributes)
+        if metrics.wire_bytes is not None:
+            self.wire_bytes.add(metrics.wire_bytes, attributes)
+
+
+_EXPORTERS = {
+    "prometheus": PrometheusSink,
+    "opentelemetry": OpenTelemetrySink,
+}
+
+_sinks: list[MetricsSink] = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink: MetricsSink) -> None:
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def clear_sinks() -> None:
+    with _sinks_lock:
+        _sinks.clear()
+
+
+def record_request(metrics: RequestMetrics) -> None:
+    """Send the metrics of a request to the sinks. A failing sink never fails
+    the request."""
+    with _sinks_lock:
+        sinks = list(_sinks)
+
+    for sink in sinks:
+        try:
+            sink.record_request(metrics)
+        except Exception as ex:
+            logger.warning(
+                "metrics-sink-failed", sink=type(sink).__name__, error=str(ex)
+            )
+
+
+def _get_wire_bytes(response: requests.Response) -> Optional[int]:
+    # Bytes read from the socket by urllib3, before decompression
+    try:
+        return response.raw.tell()
+    except Exception:
+        return None
+
+
+def _configure_from_env() -> None:
+    exporters = os.environ.get("METRICS_EXPORTERS", "")
+    for name in [e.strip() for e in exporters.split(",") if e.strip()]:
+        if name not in _EXPORTERS:
+            logger.warning("unknown metrics exporter", exporter=name)
+            continue
+        try:
+            add_sink(_EXPORTERS[name]())
+        except ImportError:
+            logger.warning("metrics exporter is not installed", exporter=name)
+
+
+_configure_from_env()
@@ -1,13 +1,43 @@
-from typing import Any, Literal, Optional, List, TypedDict, Union
+from dataclasses import dataclass
+from typing import Any, Literal, Optional, List
+import functools
 import json
 
 import structlog
-from google.cloud import pubsub_v1
+
+from . import message_encoding, tracing
 
 logger = structlog.get_logger()
 
 
-class Offer(TypedDict):
+StockStatus = Literal["in_stock", "out_of_stock", "unknown"]
+STOCK_STATUSES = ("in_stock", "out_of_stock", "unknown")
+
+
+@dataclass
+class Offer:
+    """An offer found by a scraper, validated when created.
+
+    The attributes are stored in slots rather than in a dict per offer, and
+    the offers are only converted to dicts when published, by `to_message()`.
+
+    Raise ValueError if an attribute is missing or invalid, e.g. an empty
+    retailer name because it couldn't be parsed. Use `create_or_none()` to
+    skip such an offer rather than lose the whole page.
+    """
+
+    __slots__ = (
+        "offer_source",
+        "offer_url",
+        "retail_prod_name",
+        "retailer_name",
+        "country",
+        "price",
+        "currency",
+        "stock_status",
+        "metadata",
+    )
+
     offer_source: str
     offer_url: str
 
@@ -17,7 +47,7 @@ class Offer(TypedDict):
 
     price: int
     currency: str
-    stock_status: Literal["in_stock", "out_of_stock", "unknown"]
+    stock_status: StockStatus
 
     """
     This is a json as a string. It has the following structure: 
@@ -34,12 +64,97 @@ class Offer(TypedDict):
             ...
         }
     """
-    metadata: Union[str, None]
+    metadata: Optional[str]
+
+    def __post_init__(self):
+        for name in (
+            "offer_source",
+            "offer_url",
+            "retail_prod_name",
+            "retailer_name",
+            "country",
+            "currency",
+        ):
+            value = getattr(self, name)
+            if not isinstance(value, str) or value == "":
+                raise ValueError(f"Offer.{name} must be a non-empty string: {value!r}")
+
+        if (
+            not isinstance(self.price, int)
+            or isinstance(self.price, bool)
+            or self.price <= 0
+        ):
+            raise ValueError(f"Offer.price must be a positive int: {self.price!r}")
+
+        if self.stock_status not in STOCK_STATUSES:
+            raise ValueError(f"Invalid Offer.stock_status: {self.stock_status!r}")
+
+        if self.metadata is not None and not isinstance(self.metadata, str):
+            raise ValueError(f"Offer.metadata must be a string: {self.metadata!r}")
+
+    @classmethod
+    def create_or_none(
+        cls, log_context: Optional[dict[str, Any]] = None, **fields: Any
+    ) -> Optional["Offer"]:
+        """The offer with the `fields`, or None if they are invalid.
+
+        The invalid offers are logged with the `log_context`, and skipped.
+        """
+        try:
+            return cls(**fields)
+        except ValueError as ex:
+            logger.warning(
+                "skipping invalid offer",
+                error=str(ex),
+                country=fields.get("country"),
+                **(log_context or {}),
+            )
+            return None
+
+    def to_message(self) -> dict[str, Any]:
+        """The offer as sent in the messages, see `publish_offers()`."""
+        return {
+            "offer_source": self.offer_source,
+            "offer_url": self.offer_url,
+            "retail_prod_name": self.retail_prod_name,
+            "retailer_name": self.retailer_name,
+            "country": self.country,
+            "price": self.price,
+            "currency": self.currency,
+            "stock_status": self.stock_status,
+            "metadata": self.metadata,
+        }
+
+    @classmethod
+    def from_message(cls, message: dict[str, Any]) -> "Offer":
+        return cls(
+            offer_source=message["offer_source"],
+            offer_url=message["offer_url"],
+            retail_prod_name=message["retail_prod_name"],
+            retailer_name=message["retailer_name"],
+            country=message["country"],
+            price=message["price"],
+            currency=message["currency"],
+            stock_status=message["stock_status"],
+            metadata=message["metadata"],
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_publisher_client():
+    """Pub/Sub client shared by all the publishers of the instance.
+
+    Imported and created on first use: `google.cloud.pubsub_v1` is by far the
+    slowest import of the project and not every code path publishes.
+    """
+    from google.cloud import pubsub_v1
+
+    return pubsub_v1.PublisherClient()
 
 
 class Publisher:
     def __init__(self, project_id, topic):
-        self.client = pubsub_v1.PublisherClient()
+        self.client = _get_publisher_client()
         self.topic_path = self.client.topic_path(project_id, topic)
 
     def publish_message(self, message: dict):
@@ -49,6 +164,11 @@ class Publisher:
         message_id = future.result()
         return message_id
 
+    def publish_data(self, data: bytes, attributes: dict[str, str]):
+        future = self.client.publish(self.topic_path, data=data, **attributes)
+        message_id = future.result()
+        return message_id
+
     def publish_messages(self, messages: List[dict]) -> List[str]:
         message_ids = []
         for message in messages:
@@ -78,23 +198,76 @@ def publish_new_offer_urls(gtin: str, offer_urls: dict[str, Optional[str]]):
     )
 
 
-def publish_offers(payload, offers: list[Offer], offer_source: str):
+def publish_offers(
+    payload, offers: list[Offer], offer_source: str, batch: Optional[dict] = None
+):
+    """Publish the offers found for a product.
+
+    `batch` is set when the offers of one scrape are published in several
+    messages, see `BatchedOffersPublisher`.
+    """
     live_search_publisher = Publisher("panprices", "b2b_live_search_offers")
 
-    live_search_message = payload
+    live_search_message = dict(payload)
     live_search_message["offer_source"] = offer_source
-    live_search_message["offers"] = offers
+    live_search_message["offers"] = [offer.to_message() for offer in offers]
+    if batch is not None:
+        live_search_message["batch"] = batch
 
-    live_search_publisher.publish_message(live_search_message)
+    with tracing.span(
+        "publish-offers", offer_source=offer_source, offer_count=len(offers)
+    ) as publish_span:
+        # The format is set with OFFERS_MESSAGE_FORMAT, see `message_encoding`
+        data, attributes = message_encoding.encode(live_search_message)
+        live_search_publisher.publish_data(data, attributes)
+        publish_span.set_attribute("message_bytes", len(data))
 
     nb_offers_per_country = _get_number_of_offers_per_country(offers)
     logger.info(
         "live-search-offers-published",
         nb_offers=len(offers),
+        batch=batch,
+        message_bytes=len(data),
+        **attributes,
         **nb_offers_per_country,
     )
 
 
+class BatchedOffersPublisher:
+    """Publish the offers of one scrape incrementally, e.g. one message per
+    country as soon as the country is done, so that they are not lost if the
+    invocation times out before the end of the scrape.
+
+    Each message only contains the new offers. The last message of the scrape
+    has `batch.is_last` set, and may contain no offer at all.
+
+    Example of `batch`: {"index": 2, "countries": ["DK"], "is_last": False}
+    """
+
+    def __init__(self, payload, offer_source: str):
+        self.payload = payload
+        self.offer_source = offer_source
+        self.nb_batches = 0
+        self.nb_offers = 0
+
+    def publish(self, offers: list[Offer], countries: list[str], is_last=False):
+        publish_offers(
+            self.payload,
+            offers,
+            self.offer_source,
+            batch={
+                "index": self.nb_batches,
+                "countries": countries,
+                "is_last": is_last,
+            },
+        )
+        self.nb_batches += 1
+        self.nb_offers += len(offers)
+
+    def publish_last(self):
+        self.publish([], [], is_last=True)
+
+
 def _get_number_of_offers_per_country(offers: list[Offer]) -> dict[str, int]:
     """Example output:
     {
@@ -104,7 +277,7 @@ def _get_number_of_offers_per_country(offers: list[Offer]) -> dict[str, int]:
     """
     log_offers_per_country: dict[str, int] = {}
     for offer in offers:
-        country = offer["country"]
+        country = offer.country
         key = f"nb_offers_{country}"
         if key in log_offers_per_country:
             log_offers_per_country[key] += 1
@@ -0,0 +1,208 @@
+"""Skip parsing the offer pages that haven't changed since their last scrape.
+
+For every offer page, the scrapers remember a hash of the region of the page
+holding the offers, with the offers parsed from it and the validators of the
+response (`ETag`, `Last-Modified`):
+
+    previous = page_fingerprints.get(url)
+    response = get(url, headers=page_fingerprints.conditional_headers(previous))
+    offers_list = page_fingerprints.find_element(response.text, "ul", "offers")
+    region = page_fingerprints.region_hash(offers_list) if offers_list else None
+    offers = page_fingerprints.unchanged_offers(url, previous, response, region)
+    if offers is None:
+        offers = parse(response.text)
+    page_fingerprints.store(url, response, region, offers, previous)
+
+When the server answers 304 Not Modified, or when the region of the page is the
+same as last time, the previous offers are reused instead of parsing the page.
+The offers are only reused until `TTL_SECONDS` after the page was parsed: the
+links of the offers are signed click urls that expire, so the page is parsed
+again then, even if it hasn't changed.
+
+Relies on the backend of `helpers.cache`, and does nothing if it's disabled.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+import structlog
+
+from . import cache, tracing
+from .offers import Offer
+
+logger = structlog.get_logger()
+
+# How long after the parse of a page its offers are reused for, while the page
+# doesn't change
+TTL_SECONDS = float(os.environ.get("PAGE_FINGERPRINT_TTL_SECONDS", 2 * 24 * 3600))
+
+# Click tracking tokens, different in every response: the query parameters of
+# the links, e.g. "&amp;ved=2ahUKEw...", and the attributes, e.g. data-ved="..."
+_TRACKING_PARAMS = re.compile(r"(?:\?|&amp;|&)(?:sa|ved|usg|ei|ai|sig)=[^&\"'\s]*")
+_TRACKING_ATTRIBUTES = re.compile(r'\s(?:data-ved|data-hveid|ved|jsdata)="[^"]*"')
+
+
+@dataclass
+class PageFingerprint:
+    region_hash: Optional[str]
+    offers: list[Offer]
+    parsed_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def get(url: str) -> Optional[PageFingerprint]:
+    backend = cache.get_backend()
+    if backend is None:
+        return None
+
+    value = backend.get(_key(url))
+    if value is None:
+        return None
+
+    fingerprint = json.loads(value)
+    if fingerprint["parsed_at"] + TTL_SECONDS <= time.time():
+        return None
+
+    return PageFingerprint(
+        region_hash=fingerprint["region_hash"],
+        offers=[Offer.from_message(message) for message in fingerprint["offers"]],
+        parsed_at=fingerprint["parsed_at"],
+        etag=fingerprint["etag"],
+        last_modified=fingerprint["last_modified"],
+    )
+
+
+def store(
+    url: str,
+    response: requests.Response,
+    region_hash: Optional[str],
+    offers: list[Offer],
+    previous: Optional[PageFingerprint] = None,
+) -> None:
+    """Remember the offers parsed from the page, or reused from `previous`.
+
+    Nothing is stored for a page without the region or validators: it can't
+    be recognized on the next scrape. Reused offers keep the expiry of the
+    parse they come from.
+    """
+    backend = cache.get_backend()
+    if backend is None:
+        return
+
+    # A 304 may not repeat the validators of the page
+    etag = response.headers.get("ETag") or (previous.etag if previous else None)
+    last_modified = response.headers.get("Last-Modified") or (
+        previous.last_modified if previous else None
+    )
+    if response.status_code == 304 and previous is not None:
+        region_hash = previous.region_hash
+    if region_hash is None and etag is None and last_modified is None:
+        return
+
+    now = time.time()
+    if _unchanged_reason(previous, response, region_hash) is not None:
+        assert previous is not None
+        parsed_at = previous.parsed_at
+    else:
+        parsed_at = now
+    ttl_seconds = parsed_at + TTL_SECONDS - now
+    if ttl_seconds <= 0:
+        return
+
+    backend.set(
+        _key(url),
+        json.dumps(
+            {
+                "region_hash": region_hash,
+                "offers": [offer.to_message() for offer in offers],
+                "parsed_at": parsed_at,
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+        ),
+        ttl_seconds,
+    )
+
+
+def conditional_headers(previous: Optional[PageFingerprint]) -> dict[str, str]:
+    """Headers to only get the page from the server if it has changed."""
+    headers = {}
+    if previous is not None and previous.etag is not None:
+        headers["If-None-Match"] = previous.etag
+    if previous is not None and previous.last_modified is not None:
+        headers["If-Modified-Since"] = previous.last_modified
+    return headers
+
+
+def unchanged_offers(
+    url: str,
+    previous: Optional[PageFingerprint],
+    response: requests.Response,
+    region_hash: Optional[str],
+) -> Optional[list[Offer]]:
+    """The offers of the previous scrape of the page if it hasn't changed, or
+    None if the page has to be parsed."""
+    reason = _unchanged_reason(previous, response, region_hash)
+    if reason is None:
+        return None
+
+    assert previous is not None
+    logger.info(
+        "page-unchanged", url=url, reason=reason, nb_offers=len(previous.offers)
+    )
+    tracing.set_attribute("page_unchanged", reason)
+    return previous.offers
+
+
+def _unchanged_reason(
+    previous: Optional[PageFingerprint],
+    response: requests.Response,
+    region_hash: Optional[str],
+) -> Optional[str]:
+    if previous is None:
+        return None
+    if response.status_code == 304:
+        return "not_modified"
+    if region_hash is not None and region_hash == previous.region_hash:
+        return "same_region"
+    return None
+
+
+def find_element(html: str, tag: str, class_name: str) -> Optional[str]:
+    """HTML of the first `tag` element with the class `class_name`, found
+    without parsing the page, or None if there is none."""
+    start_tag = re.search(
+        rf'<{tag}\b[^>]*\bclass="(?:[^"]*\s)?{re.escape(class_name)}[\s"]', html
+    )
+    if start_tag is None:
+        return None
+
+    # Skip the elements of the same tag nested in it
+    tags = re.compile(rf"<{tag}\b|</{tag}\s*>")
+    depth = 0
+    for match in tags.finditer(html, start_tag.start()):
+        depth += -1 if match.group().startswith("</") else 1
+        if depth == 0:
+            return html[start_tag.start() : match.end()]
+    return None
+
+
+def region_hash(*regions: str) -> str:
+    """Hash of the `regions` of a page, without their click tracking tokens."""
+    digest = hashlib.sha256()
+    for region in regions:
+        region = _TRACKING_ATTRIBUTES.sub("", _TRACKING_PARAMS.sub("", region))
+        digest.update(region.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _key(url: str) -> str:
+    return f"page_fingerprint:{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
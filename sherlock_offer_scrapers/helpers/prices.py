@@ -0,0 +1,101 @@
+"""Parsing of the prices displayed by the sources.
+
+The same price texts come back on many rows and pages (shipping costs, round
+prices, the same offer in several countries), so the parsed prices are
+memoised.
+"""
+
+import functools
+import os
+import re
+from typing import Optional, Tuple
+
+# Currency symbols, and their ISO 4217 code.
+CURRENCY_SYMBOLS = {
+    "€": "EUR",
+    "£": "GBP",
+    "$": "USD",
+    "NZ$": "NZD",
+    "A$": "AUD",
+    "AU$": "AUD",
+    "MX$": "MXN",
+    "Mex$": "MXN",
+    "₪": "ILS",
+    "Can$": "CAD",
+    "C$": "CAD",
+    "CA$": "CAD",
+}
+
+# "kr" is used by the krona and the krone, we can only tell them apart from
+# the country. In other countries, "kr" is kept as is.
+KRONA_SYMBOL = "kr"
+KRONA_CURRENCIES = {
+    "SE": "SEK",
+    "NO": "NOK",
+    "DK": "DKK",
+}
+
+# Currency of the prices displayed without a symbol, per country
+COUNTRY_CURRENCIES = {
+    "AT": "EUR",
+    "BE": "EUR",
+    "DE": "EUR",
+    "ES": "EUR",
+    "FI": "EUR",
+    "FR": "EUR",
+    "IE": "EUR",
+    "IT": "EUR",
+    "NL": "EUR",
+    "PT": "EUR",
+    "UK": "GBP",
+    **KRONA_CURRENCIES,
+}
+
+PRICE_CACHE_SIZE = int(os.environ.get("PRICE_CACHE_SIZE", 4096))
+
+_iso_currency_regex = re.compile(r"^[A-Za-z]{3}$")
+
+
+class UnknownCurrencyError(ValueError):
+    def __init__(self, currency: str, amount: int):
+        super().__init__(f"Cannot convert currency: {currency}")
+        self.currency = currency
+        self.amount = amount
+
+
+def to_iso_currency(currency: str, country: str) -> Optional[str]:
+    """ISO 4217 code of a currency symbol or code, or None if it is unknown."""
+    if currency == KRONA_SYMBOL:
+        return KRONA_CURRENCIES.get(country, currency)
+    if currency in CURRENCY_SYMBOLS:
+        return CURRENCY_SYMBOLS[currency]
+    if _iso_currency_regex.search(currency) is not None:
+        return currency.upper()
+    return None
+
+
+@functools.lru_cache(maxsize=PRICE_CACHE_SIZE)
+def parse_price(price_text: str, country: str) -> Optional[Tuple[int, str]]:
+    """Parse a price like "19 990,00 kr" into its amount in cents and its
+    ISO 4217 currency, e.g. (1999000, "SEK") in Sweden.
+
+    Return None if the price is 0. Raise ValueError if the price can't be
+    parsed, or UnknownCurrencyError if the currency is unknown.
+    """
+    # Imported on first use, see `main._load_scraper()`
+    import price_parser
+
+    price_obj = price_parser.parse_price(price_text)
+
+    if price_obj.amount == 0:
+        return None
+
+    if price_obj.amount is None or price_obj.currency is None:
+        raise ValueError(f"Error when parsing price: {price_text}")
+
+    amount = round(price_obj.amount * 100)
+    currency = to_iso_currency(price_obj.currency, country)
+    if currency is None:
+        raise UnknownCurrencyError(price_obj.currency, amount)
+
+    return amount, currency
@@ -1,11 +1,17 @@
-from typing import List, Optional
+from dataclasses import dataclass
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, FrozenSet, List, Optional
 import os
 import base64
 import random
+import threading
+import time
 
 import requests
 import structlog
 
+from . import deadline, metrics, tracing
+
 
 logger = structlog.get_logger()
 
@@ -45,28 +51,203 @@ _default_user_agents = [
 ]
 
 
+# Transient failures: timeouts, rate limiting and errors from the server or
+# from the proxy in front of it.
+RETRYABLE_STATUS_CODES: FrozenSet[int] = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+# Methods that can be sent twice without side effects on the server.
+IDEMPOTENT_METHODS: FrozenSet[str] = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+# Don't start a new attempt with less time than this left before the deadline.
+MIN_ATTEMPT_SECONDS = 5.0
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 8.0
+    retry_on_status: FrozenSet[int] = RETRYABLE_STATUS_CODES
+    retry_non_idempotent: bool = False
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retrying after the `attempt`-th failure (starting at 1).
+
+        Uses "full jitter": a random delay below an exponentially growing
+        ceiling, so that concurrent requests that failed together don't all
+        retry at the same moment.
+        """
+        ceiling = min(
+            self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)
+        )
+        return random.uniform(0, ceiling)
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def send_with_retries(
+    send: Callable[[Optional[float]], requests.Response],
+    method: str,
+    url: str,
+    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    timeout: Optional[float] = None,
+) -> requests.Response:
+    """Call `send(timeout)` until it returns a non-retryable response.
+
+    Connection errors, timeouts and responses with a status code in
+    `retry_policy.retry_on_status` are retried with a jittered backoff. A retry
+    is only made if the request is idempotent (or the policy allows otherwise)
+    and if it can still finish before the invocation deadline. The timeout
+    passed to `send` is shrunk to fit in the remaining time.
+
+    When giving up, the last response is returned, or the last exception is
+    raised, as if no retry had been made.
+    """
+    can_retry = (
+        retry_policy.retry_non_idempotent or method.upper() in IDEMPOTENT_METHODS
+    )
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = send(deadline.cap_timeout(timeout))
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            delay = retry_policy.backoff(attempt)
+            if not can_retry or not _can_attempt_again(
+                attempt, delay, retry_policy
+            ):
+                raise ex
+            logger.warning(
+                "request-retry",
+                request_type=method,
+                request_url=url,
+                attempt=attempt,
+                delay_seconds=round(delay, 2),
+                error=str(ex),
+            )
+        else:
+            if response.status_code not in retry_policy.retry_on_status:
+                return response
+
+            delay = max(retry_policy.backoff(attempt), _get_retry_after(response))
+            if not can_retry or not _can_attempt_again(
+                attempt, delay, retry_policy
+            ):
+                return response
+            logger.warning(
+                "request-retry",
+                request_type=method,
+                request_url=url,
+                attempt=attempt,
+                delay_seconds=round(delay, 2),
+                response_status_code=response.status_code,
+            )
+
+        time.sleep(delay)
+
+
+def _can_attempt_again(attempt: int, delay: float, retry_policy: RetryPolicy) -> bool:
+    if attempt >= retry_policy.max_attempts:
+        return False
+    return deadline.has_time_for(delay + MIN_ATTEMPT_SECONDS)
+
+
+def _get_retry_after(response: requests.Response) -> float:
+    """Seconds asked by the server in the Retry-After header, capped to a
+    reasonable value. Dates are not supported and ignored."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return 0.0
+    try:
+        return min(float(retry_after), 30.0)
+    except ValueError:
+        return 0.0
+
+
+# Connections kept open per host, shared by all the scrapers running in the
+# same instance (see `main.sherlock_products`).
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_lock = threading.Lock()
+
+
+def _get_shared_session() -> requests.Session:
+    """Session used by `get()` to reuse connections between requests.
+
+    Cookies set by a response are not kept, so that requests made through the
+    shared session behave as independent requests like before.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _shared_session = session
+
+    return _shared_session
+
+
 class SessionWithLogger(requests.Session):
+    def __init__(self, country: Optional[str] = None):
+        super().__init__()
+        # The country of the offer source, reported in the request metrics
+        self.country = country
+
     def get(self, url, **kwargs) -> requests.Response:  # type: ignore
-        response = super().get(url, **kwargs)
-        _log_request(url, response, **kwargs)
-        return response
+        return self._send_and_log("GET", url, super().get, **kwargs)
 
     def post(self, url, **kwargs) -> requests.Response:  # type: ignore
-        response = super().post(url, **kwargs)
-        _log_request(url, response, **kwargs)
+        return self._send_and_log("POST", url, super().post, **kwargs)
+
+    def _send_and_log(self, method, url, send, **kwargs) -> requests.Response:
+        start = time.monotonic()
+        with tracing.span("http-request", request_url=url) as request_span:
+            response = send(url, **kwargs)
+            request_span.set_attribute("response_status_code", response.status_code)
+        duration = time.monotonic() - start
+        proxies = kwargs.get("proxies") or self.proxies
+        request_metrics = metrics.measure_request(
+            method,
+            url,
+            response,
+            attempts=1,
+            duration_seconds=duration,
+            attempt_duration_seconds=duration,
+            country=self.country,
+            proxy_url=proxies.get("https") if proxies else None,
+        )
+        _log_request(url, response, request_metrics)
+        metrics.record_request(request_metrics)
         return response
 
 
-def _log_request(url, response: requests.Response, **kwargs):
+def _log_request(
+    url, response: requests.Response, request_metrics: metrics.RequestMetrics
+):
     logger.info(
         "make-request",
         request_type=response.request.method,
         request_url=url,
-        request_headers=response.request.headers,
-        request_proxy=response.request.headers.get("Proxy-Authorization"),
+        request_proxy=request_metrics.proxy_ip,
         response_status_code=response.status_code,
-        response_body_size_bytes=len(response.content),
-        country=kwargs.get("offer_source_country"),
+        response_body_size_bytes=request_metrics.body_bytes,
+        country=request_metrics.country,
+        **request_metrics.to_log(),
+    )
+    # Only rendered with LOG_LEVEL=debug, secrets are redacted
+    logger.debug(
+        "make-request-headers",
+        request_url=url,
+        request_headers=response.request.headers,
     )
 
 
@@ -77,10 +258,14 @@ def get(
     proxy_country: str = None,
     offer_source_country: str = None,
     timeout: Optional[int] = 600,
+    retry_policy: RetryPolicy = NO_RETRY,
 ) -> requests.Response:
     """Make a GET request with some default headers and optional proxy.
 
     Supported proxy_country: ["SE", "DE", "UK"]
+
+    Transient errors are retried according to `retry_policy`, each attempt
+    going through a new random proxy.
     """
     if headers is None:
         headers = _get_default_headers()
@@ -88,24 +273,60 @@ def get(
     # Apply proxy if needed
     proxy_config = None
     if proxy_country is not None:
-        # Call the function to get a random proxy configuration
-        proxy_config = _proxy_config[proxy_country]()
         headers.update(_proxy_header)
 
-    response = requests.get(
-        url, headers=headers, proxies=proxy_config, cookies=cookies, timeout=timeout
+    attempts = 0
+    attempt_duration = 0.0
+
+    def send(attempt_timeout: Optional[float]) -> requests.Response:
+        nonlocal proxy_config, attempts, attempt_duration
+        if proxy_country is not None:
+            # Call the function to get a random proxy configuration
+            proxy_config = _proxy_config[proxy_country]()
+
+        attempts += 1
+        attempt_start = time.monotonic()
+        response = _get_shared_session().get(
+            url,
+            headers=headers,
+            proxies=proxy_config,
+            cookies=cookies,
+            timeout=attempt_timeout,
+        )
+        attempt_duration = time.monotonic() - attempt_start
+        return response
+
+    start = time.monotonic()
+    with tracing.span(
+        "http-request", request_url=url, country=offer_source_country
+    ) as request_span:
+        response = send_with_retries(send, "GET", url, retry_policy, timeout)
+        request_span.set_attribute("response_status_code", response.status_code)
+        request_span.set_attribute("request_attempts", attempts)
+    request_metrics = metrics.measure_request(
+        "GET",
+        url,
+        response,
+        attempts=attempts,
+        duration_seconds=time.monotonic() - start,
+        attempt_duration_seconds=attempt_duration,
+        country=offer_source_country,
+        proxy_url=proxy_config["https"] if proxy_config else None,
     )
 
     # TODO: Try to use the _log_request() function
     logger.info(
         "make-request",
         request_url=url,
-        request_headers=headers,
-        request_proxy=proxy_config,
+        request_proxy=request_metrics.proxy_ip,
         response_status_code=response.status_code,
-        response_body_size_bytes=len(response.content),
+        response_body_size_bytes=request_metrics.body_bytes,
         country=offer_source_country,
+        **request_metrics.to_log(),
     )
+    # Only rendered with LOG_LEVEL=debug, secrets are redacted
+    logger.debug("make-request-headers", request_url=url, request_headers=headers)
+    metrics.record_request(request_metrics)
 
     if os.getenv("PANPRICES_ENVIRONMENT") == "local":
         with open("test.html", "wb") as f:
@@ -0,0 +1,300 @@
+"""Client of the Scrapfly API, for the sources that need anti-bot rendering.
+
+    client = helpers.scrapfly.get_client()
+    result = client.scrape("https://www.kuantokusta.pt/...", country="pt", asp=True)
+    soup = BeautifulSoup(result.content, "html.parser")
+
+The client is shared by all the scrapers of the instance, and keeps its
+connections to the API open. Scrapfly rejects the requests above the number of
+concurrent requests of the account plan, so the client never sends more than
+`SCRAPFLY_CONCURRENCY` requests at once; the other threads wait for a slot.
+
+Errors flagged as retryable by Scrapfly (throttling, proxy or anti-bot
+failures) are retried within the invocation deadline. Every request logs its
+cost in credits and its latency, and the credits spent per day can be capped
+with `SCRAPFLY_DAILY_CREDIT_BUDGET` when a cache backend is configured, see
+`helpers.cache`.
+"""
+
+import datetime
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import requests
+import structlog
+
+from . import cache, deadline, tracing
+from .requests import MIN_ATTEMPT_SECONDS, RetryPolicy
+
+logger = structlog.get_logger()
+
+API_URL = os.environ.get("SCRAPFLY_API_URL", "https://api.scrapfly.io/scrape")
+
+# Concurrent requests allowed by the account plan
+CONCURRENCY = int(os.environ.get("SCRAPFLY_CONCURRENCY", 5))
+
+# Scrapfly can take more than a minute to render a page with asp=true
+TIMEOUT_SECONDS = float(os.environ.get("SCRAPFLY_TIMEOUT_SECONDS", 150))
+
+# Responses above this size are dropped instead of being loaded in memory
+MAX_RESPONSE_BYTES = int(os.environ.get("SCRAPFLY_MAX_RESPONSE_BYTES", 20_000_000))
+
+# Maximum number of credits spent per day (UTC), unlimited if not set
+DAILY_CREDIT_BUDGET: Optional[int] = (
+    int(os.environ["SCRAPFLY_DAILY_CREDIT_BUDGET"])
+    if os.environ.get("SCRAPFLY_DAILY_CREDIT_BUDGET")
+    else None
+)
+
+# Status codes of the API itself (not of the scraped page) worth retrying
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=3, backoff_base_seconds=1.0)
+
+_CHUNK_SIZE = 64 * 1024
+
+# The API key, in the urls quoted by the errors of requests
+_API_KEY_PARAM = re.compile(r"([?&]key=)[^&\s'\"]+")
+_CREDITS_TTL_SECONDS = 2 * 24 * 3600
+
+
+class ScrapflyError(Exception):
+    def __init__(self, code: str, message: str, retryable: bool = False):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.retryable = retryable
+
+
+class ScrapflyBudgetExceeded(ScrapflyError):
+    def __init__(self, budget: int):
+        super().__init__(
+            "BUDGET_EXCEEDED", f"Daily credit budget of {budget} credits spent"
+        )
+
+
+@dataclass
+class ScrapeResult:
+    url: str
+    # Status code of the scraped page
+    status_code: int
+    content: str
+    cost: int
+
+
+class ScrapflyClient:
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str = API_URL,
+        concurrency: int = CONCURRENCY,
+        timeout: float = TIMEOUT_SECONDS,
+        max_response_bytes: int = MAX_RESPONSE_BYTES,
+        daily_credit_budget: Optional[int] = DAILY_CREDIT_BUDGET,
+        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    ):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_response_bytes = max_response_bytes
+        self.daily_credit_budget = daily_credit_budget
+        self.retry_policy = retry_policy
+
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def scrape(
+        self,
+        url: str,
+        country: Optional[str] = None,
+        asp: bool = False,
+        render_js: bool = False,
+        tags: Iterable[str] = (),
+    ) -> ScrapeResult:
+        """Scrape `url` through Scrapfly.
+
+        Raise ScrapflyError if Scrapfly couldn't scrape the page, including
+        when the retries are exhausted or the invocation has no time left, and
+        ScrapflyBudgetExceeded (without sending anything) once the daily
+        credit budget is spent.
+        """
+        params = {"key": self.api_key, "url": url}
+        if country is not None:
+            params["country"] = country
+        if asp:
+            params["asp"] = "true"
+        if render_js:
+            params["render_js"] = "true"
+        if tags:
+            params["tags"] = ",".join(tags)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check_budget()
+            try:
+                with tracing.span("scrapfly-request", url=url, attempt=attempt):
+                    return self._send(url, params, attempt)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                # The message quotes the url of the request, with the API key
+                message = _API_KEY_PARAM.sub(r"\1REDACTED", str(ex))
+                error = ScrapflyError("CONNECTION", message, retryable=True)
+            except deadline.DeadlineExceeded as ex:
+                error = ScrapflyError("DEADLINE_EXCEEDED", str(ex))
+            except ScrapflyError as ex:
+                error = ex
+
+            delay = self.retry_policy.backoff(attempt)
+            if not error.retryable or not self._can_attempt_again(attempt, delay):
+                raise error
+            logger.warning(
+                "scrapfly-retry",
+                url=url,
+                attempt=attempt,
+                delay_seconds=round(delay, 2),
+                error=str(error),
+            )
+            time.sleep(delay)
+
+    def _send(self, url: str, params: dict, attempt: int) -> ScrapeResult:
+        with self._slots:
+            start = time.monotonic()
+            with self._session.get(
+                self.api_url,
+                params=params,
+                timeout=deadline.cap_timeout(self.timeout),
+                stream=True,
+            ) as response:
+                body = self._read_body(response)
+            duration_ms = round((time.monotonic() - start) * 1000)
+
+        try:
+            response_object = json.loads(body)
+        except ValueError:
+            raise ScrapflyError(
+                "INVALID_RESPONSE",
+                f"Response is not JSON (status {response.status_code})",
+                retryable=response.status_code in RETRYABLE_STATUS_CODES,
+            )
+
+        cost = _get_cost(response, response_object)
+        credits_used_today = self._record_credits(cost)
+        result = response_object.get("result") or {}
+
+        logger.info(
+            "scrapfly-request",
+            url=url,
+            attempt=attempt,
+            api_status_code=response.status_code,
+            status_code=result.get("status_code"),
+            duration_ms=duration_ms,
+            response_body_size_bytes=len(body),
+            cost=cost,
+            credits_used_today=credits_used_today,
+            daily_credit_budget=self.daily_credit_budget,
+        )
+
+        # Errors are either in the result, or the whole response when the API
+        # rejects the request (e.g. too many concurrent requests)
+        error = result.get("error") or (
+            response_object if "code" in response_object else None
+        )
+        if error:
+            raise ScrapflyError(
+                error.get("code", "UNKNOWN"),
+                error.get("message", ""),
+                retryable=bool(error.get("retryable"))
+                or response.status_code in RETRYABLE_STATUS_CODES,
+            )
+        if response.status_code >= 400:
+            raise ScrapflyError(
+                "HTTP",
+                f"Received status code {response.status_code}",
+                retryable=response.status_code in RETRYABLE_STATUS_CODES,
+            )
+
+        return ScrapeResult(
+            url=url,
+            status_code=result.get("status_code", response.status_code),
+            content=result["content"],
+            cost=cost,
+        )
+
+    def _read_body(self, response: requests.Response) -> bytes:
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None and int(content_length) > self.max_response_bytes:
+            raise ScrapflyError(
+                "TOO_LARGE", f"Response of {content_length} bytes is too large"
+            )
+
+        body = bytearray()
+        for chunk in response.iter_content(_CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) > self.max_response_bytes:
+                raise ScrapflyError(
+                    "TOO_LARGE",
+                    f"Response is larger than {self.max_response_bytes} bytes",
+                )
+        return bytes(body)
+
+    def _can_attempt_again(self, attempt: int, delay: float) -> bool:
+        if attempt >= self.retry_policy.max_attempts:
+            return False
+        return deadline.has_time_for(delay + MIN_ATTEMPT_SECONDS)
+
+    def _check_budget(self) -> None:
+        backend = cache.get_backend()
+        if self.daily_credit_budget is None or backend is None:
+            return
+
+        credits_used = int(backend.get(_credits_key()) or 0)
+        if credits_used >= self.daily_credit_budget:
+            raise ScrapflyBudgetExceeded(self.daily_credit_budget)
+
+    def _record_credits(self, cost: int) -> Optional[int]:
+        backend = cache.get_backend()
+        if backend is None:
+            return None
+        return backend.increment(_credits_key(), cost, _CREDITS_TTL_SECONDS)
+
+
+_client: Optional[ScrapflyClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ScrapflyClient:
+    """Client shared by all the scrapers, configured from the environment."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ScrapflyClient(os.environ.get("SCRAPFLY_API_KEY", ""))
+
+    return _client
+
+
+def set_client(client: Optional[ScrapflyClient]) -> None:
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def _get_cost(response: requests.Response, response_object: dict) -> int:
+    # Scrapfly sends the cost of the request in a header, and in the context
+    cost = response.headers.get("X-Scrapfly-Api-Cost")
+    if cost is None:
+        cost = (response_object.get("context") or {}).get("cost", {}).get("total", 0)
+    return int(cost)
+
+
+def _credits_key() -> str:
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    return f"scrapfly:credits:{today.isoformat()}"
@@ -1,35 +1,170 @@
+"""Configuration of the logs.
+
+The processors are chosen with environment variables:
+
+- `LOG_LEVEL` (default `info`): events below this level are dropped before
+  any processing. An unknown level falls back to `info`, with a warning.
+- `LOG_SAMPLE_RATES`: fraction of the events kept per event name, for the
+  high-volume events, e.g. `make-request=0.1,span=0.05`. Warnings and errors
+  are always kept.
+- `LOG_FIELDS`: comma-separated list of the only fields kept in the events,
+  e.g. `offer_source,country,gtin,request_url`. All fields are kept if not set.
+
+Secrets (proxy credentials, authorization headers, cookies) are always
+redacted, see `REDACTED_KEYS`.
+"""
+
+import logging
 import os
-from typing import Any
+import random
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, Optional
+
 import structlog
 from structlog.dev import set_exc_info, ConsoleRenderer
 from structlog.processors import StackInfoRenderer, TimeStamper, add_log_level
 
+# Fields, and keys of dict fields (e.g. headers), whose value is never logged
+REDACTED_KEYS = frozenset(
+    [
+        "authorization",
+        "proxy-authorization",
+        "cookie",
+        "set-cookie",
+        "x-api-key",
+        "password",
+    ]
+)
+REDACTED = "[REDACTED]"
+
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
+# Levels of the events that are never sampled
+_SAMPLED_METHODS = frozenset(["debug", "info"])
+
+# Fields of the events that are never removed by the whitelist
+_RESERVED_FIELDS = frozenset(["event", "level", "timestamp", "exc_info", "stack_info"])
+
 
 def config_structlog():
-    # Custom renderer when in development:
-    if os.getenv("PANPRICES_ENVIRONMENT") == "local":
-        structlog.configure_once(
-            processors=[
-                add_log_level,
-                StackInfoRenderer(),
-                set_exc_info,
-                TimeStamper(fmt="%Y-%m-%d %H:%M.%S", utc=False),
-                ConsoleRenderer(),
-            ]
-        )
-    else:
-        structlog.configure_once(
-            processors=[
-                add_log_level,
-                StackInfoRenderer(),
-                set_exc_info,
-                _GCP_severity_processor,
-                _GCP_display_message_processor,
-                structlog.processors.JSONRenderer(),
-            ]
+    log_level = os.getenv("LOG_LEVEL", "info")
+    level = _parse_log_level(log_level)
+    structlog.configure_once(
+        processors=build_processors(
+            local=os.getenv("PANPRICES_ENVIRONMENT") == "local",
+            sample_rates=_parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+            fields=_parse_fields(os.getenv("LOG_FIELDS", "")),
+        ),
+        wrapper_class=structlog.make_filtering_bound_logger(
+            level if level is not None else logging.INFO
+        ),
+        # Otherwise the module-level loggers build a new bound logger for
+        # every event
+        cache_logger_on_first_use=True,
+    )
+    if level is None:
+        structlog.get_logger().warning(
+            "unknown LOG_LEVEL, using info", log_level=log_level
         )
 
 
+def build_processors(
+    local: bool = False,
+    sample_rates: Optional[Dict[str, float]] = None,
+    fields: Optional[Iterable[str]] = None,
+) -> List[Any]:
+    processors: List[Any] = []
+    # Sampled first, so that dropped events cost nothing more
+    if sample_rates:
+        processors.append(SampleProcessor(sample_rates))
+    processors.append(add_log_level)
+    if fields:
+        processors.append(KeepFieldsProcessor(fields))
+    processors.append(redact_processor)
+
+    # Custom renderer when in development:
+    if local:
+        return processors + [
+            StackInfoRenderer(),
+            set_exc_info,
+            TimeStamper(fmt="%Y-%m-%d %H:%M.%S", utc=False),
+            ConsoleRenderer(),
+        ]
+
+    return processors + [
+        StackInfoRenderer(),
+        set_exc_info,
+        _GCP_severity_processor,
+        _GCP_display_message_processor,
+        structlog.processors.JSONRenderer(),
+    ]
+
+
+class SampleProcessor:
+    """Keep only a fraction of the debug and info events with the given names."""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        self.sample_rates = sample_rates
+
+    def __call__(self, logger: Any, method_name: str, event_dict: Any) -> Any:
+        sample_rate = self.sample_rates.get(event_dict.get("event"))
+        if (
+            sample_rate is not None
+            and method_name in _SAMPLED_METHODS
+            and random.random() >= sample_rate
+        ):
+            raise structlog.DropEvent
+        return event_dict
+
+
+class KeepFieldsProcessor:
+    """Remove the fields of the events that are not in the whitelist."""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = frozenset(fields) | _RESERVED_FIELDS
+
+    def __call__(self, logger: Any, method_name: str, event_dict: Any) -> Any:
+        return {k: v for k, v in event_dict.items() if k in self.fields}
+
+
+def redact_processor(logger: Any, method_name: str, event_dict: Any) -> Any:
+    for key in REDACTED_KEYS.intersection(event_dict):
+        event_dict[key] = REDACTED
+
+    for key, value in event_dict.items():
+        # Most fields are scalars, checked first as the Mapping check is slower
+        if type(value) in _SCALAR_TYPES or not isinstance(value, Mapping):
+            continue
+        if not REDACTED_KEYS.isdisjoint(
+            k.lower() for k in value.keys() if isinstance(k, str)
+        ):
+            event_dict[key] = {
+                k: REDACTED if isinstance(k, str) and k.lower() in REDACTED_KEYS else v
+                for k, v in value.items()
+            }
+    return event_dict
+
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    sample_rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            event, rate = item.rsplit("=", 1)
+            sample_rates[event.strip()] = float(rate)
+    return sample_rates
+
+
+def _parse_log_level(value: str) -> Optional[int]:
+    """The level named `value`, e.g. `debug`, or None if there is none."""
+    # getLevelName() returns "Level <value>" for the unknown names
+    level = logging.getLevelName(value.strip().upper())
+    return level if isinstance(level, int) else None
+
+
+def _parse_fields(value: str) -> List[str]:
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+
 def _GCP_severity_processor(
     logger: Any,
     method_name: str,
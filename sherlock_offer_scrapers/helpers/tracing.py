@@ -0,0 +1,227 @@
+"""Spans around the steps of an invocation, to see where its time goes.
+
+    with helpers.tracing.span("parse-offers", country=country) as parse_span:
+        offers = parse(soup)
+        parse_span.set_attribute("offer_count", len(offers))
+
+A span started inside another one becomes its child, also in the coroutines
+started from it. Threads don't inherit the current span: functions run in an
+executor should be wrapped with `bind()`.
+
+The spans are exported when they end, to the exporters listed (comma-separated)
+in `TRACING_EXPORTERS`:
+
+- `log`: a `span` log line per span.
+- `file`: JSON lines appended to `TRACING_FILE`.
+- `opentelemetry`: spans of the OpenTelemetry SDK, exported to a collector as
+  configured by the environment. Requires the optional `opentelemetry-api`
+  package.
+
+Tracing is disabled by default, and the spans cost next to nothing when it is.
+"""
+
+import abc
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import structlog
+
+logger = structlog.get_logger()
+
+TRACING_FILE = os.environ.get("TRACING_FILE", "/tmp/sherlock_traces.jsonl")
+
+F = TypeVar("F", bound=Callable)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    attributes: dict[str, Any] = field(default_factory=dict)
+    # Seconds since the epoch
+    start_time: float = 0.0
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "span_name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class SpanExporter(abc.ABC):
+    def on_start(self, span: Span) -> None:
+        pass
+
+    @abc.abstractmethod
+    def on_end(self, span: Span) -> None:
+        pass
+
+
+class LogExporter(SpanExporter):
+    def on_end(self, span: Span) -> None:
+        logger.info("span", **span.to_dict())
+
+
+class FileExporter(SpanExporter):
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OpenTelemetryExporter(SpanExporter):
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self._tracer = trace.get_tracer("sherlock_offer_scrapers")
+        self._otel_spans: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span) -> None:
+        with self._lock:
+            parent = self._otel_spans.get(span.parent_id or "")
+        context = self._trace.set_span_in_context(parent) if parent else None
+        otel_span = self._tracer.start_span(span.name, context=context)
+        with self._lock:
+            self._otel_spans[span.span_id] = otel_span
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            otel_span = self._otel_spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+
+        for key, value in span.attributes.items():
+            if value is not None:
+                otel_span.set_attribute(key, value)
+        if span.error is not None:
+            otel_span.set_status(self._trace.StatusCode.ERROR, span.error)
+        otel_span.end()
+
+
+_EXPORTERS = {
+    "log": LogExporter,
+    "file": FileExporter,
+    "opentelemetry": OpenTelemetryExporter,
+}
+
+_exporters: list[SpanExporter] = []
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def add_exporter(exporter: SpanExporter) -> None:
+    _exporters.append(exporter)
+
+
+def clear_exporters() -> None:
+    _exporters.clear()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """Set an attribute of the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Measure the enclosed block as a child of the current span.
+
+    An exception raised in the block marks the span as failed and is
+    re-raised.
+    """
+    parent = _current_span.get()
+    new_span = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+        start_time=time.time(),
+    )
+    token = _current_span.set(new_span)
+    _export("on_start", new_span)
+
+    start = time.monotonic()
+    try:
+        yield new_span
+    except BaseException as ex:
+        new_span.error = repr(ex)
+        raise
+    finally:
+        new_span.duration_ms = round((time.monotonic() - start) * 1000, 1)
+        _current_span.reset(token)
+        _export("on_end", new_span)
+
+
+def bind(func: F) -> F:
+    """Wrap `func` to run it in the current context, e.g. in another thread,
+    so that its spans are children of the current span."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def run_in_context(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+
+    return run_in_context  # type: ignore
+
+
+def _export(event: str, exported_span: Span) -> None:
+    # A failing exporter never fails the traced code
+    for exporter in list(_exporters):
+        try:
+            getattr(exporter, event)(exported_span)
+        except Exception as ex:
+            logger.warning(
+                "span-exporter-failed",
+                exporter=type(exporter).__name__,
+                error=str(ex),
+            )
+
+
+def _configure_from_env() -> None:
+    exporters = os.environ.get("TRACING_EXPORTERS", "")
+    for name in [e.strip() for e in exporters.split(",") if e.strip()]:
+        if name not in _EXPORTERS:
+            logger.warning("unknown span exporter", exporter=name)
+            continue
+        try:
+            add_exporter(_EXPORTERS[name]())
+        except ImportError:
+            logger.warning("span exporter is not installed", exporter=name)
+
+
+_configure_from_env()
@@ -0,0 +1,227 @@
+"""Offers found per product, source and country, to choose where to scrape.
+
+Every scrape of a country records how many offers it found for the product.
+`select_countries()` then orders the countries of a product by the offers they
+have found so far, and skips the countries that have found nothing in several
+scrapes, until they are probed again after `YIELD_STATS_REPROBE_DAYS`.
+
+The statistics are kept in a SQLite file shared by the invocations of the
+instance, or by the processes of a script, when `YIELD_STATS_SQLITE_PATH` is
+set. Otherwise they are kept in memory, by the instance only.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+# Only the scrapes of this period are taken into account, and kept
+WINDOW_DAYS = float(os.environ.get("YIELD_STATS_WINDOW_DAYS", 30))
+
+# Skip a country once it has found no offer for the product this many times
+MIN_EMPTY_SCRAPES = int(os.environ.get("YIELD_STATS_MIN_EMPTY_SCRAPES", 3))
+
+# Scrape a skipped country again after this time, in case it has offers now
+REPROBE_DAYS = float(os.environ.get("YIELD_STATS_REPROBE_DAYS", 7))
+
+_SECONDS_PER_DAY = 24 * 3600
+
+
+@dataclass
+class CountryStats:
+    nb_scrapes: int
+    nb_offers: int
+    # Seconds since the epoch
+    last_scraped_at: float
+
+    @property
+    def offers_per_scrape(self) -> float:
+        return self.nb_offers / self.nb_scrapes
+
+
+class YieldStatsStore:
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        # A single connection, shared by the threads: an in-memory database
+        # only lives as long as its connection.
+        self._conn = sqlite3.connect(
+            path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS yields (
+                    offer_source TEXT NOT NULL,
+                    product_key TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    scraped_at REAL NOT NULL,
+                    nb_offers INTEGER NOT NULL
+                )
+                """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS yields_product
+                ON yields (offer_source, product_key, country, scraped_at)
+                """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS yields_scraped_at ON yields (scraped_at)"
+            )
+
+    @contextlib.contextmanager
+    def _cursor(self) -> Iterator[sqlite3.Cursor]:
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def record(
+        self,
+        offer_source: str,
+        product_key: str,
+        country: str,
+        nb_offers: int,
+        scraped_at: Optional[float] = None,
+    ) -> None:
+        scraped_at = time.time() if scraped_at is None else scraped_at
+        with self._cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO yields "
+                + "(offer_source, product_key, country, scraped_at, nb_offers) "
+                + "VALUES (?, ?, ?, ?, ?)",
+                (offer_source, product_key, country, scraped_at, nb_offers),
+            )
+            cursor.execute(
+                "DELETE FROM yields WHERE scraped_at < ?",
+                (time.time() - WINDOW_DAYS * _SECONDS_PER_DAY,),
+            )
+
+    def get_stats(
+        self, offer_source: str, product_key: Optional[str] = None
+    ) -> dict[str, CountryStats]:
+        """Statistics per country of the scrapes of the window, for one product
+        or, if `product_key` is None, for all of them."""
+        query = (
+            "SELECT country, COUNT(*), SUM(nb_offers), MAX(scraped_at) FROM yields "
+            + "WHERE offer_source = ? AND scraped_at >= ?"
+        )
+        params: tuple = (offer_source, time.time() - WINDOW_DAYS * _SECONDS_PER_DAY)
+        if product_key is not None:
+            query += " AND product_key = ?"
+            params += (product_key,)
+
+        with self._cursor() as cursor:
+            rows = cursor.execute(query + " GROUP BY country", params).fetchall()
+
+        return {
+            country: CountryStats(nb_scrapes, nb_offers, last_scraped_at)
+            for country, nb_scrapes, nb_offers, last_scraped_at in rows
+        }
+
+    def select_countries(
+        self,
+        offer_source: str,
+        product_key: str,
+        countries: list[str],
+        max_countries: Optional[int] = None,
+    ) -> list[str]:
+        """The `countries` worth scraping for the product, the most promising
+        first, and at most `max_countries` of them.
+
+        The countries where the product has offers come first, then the
+        countries never scraped for the product, by their yield for all the
+        products, then the countries without offers so far. A country that has
+        found no offer in `MIN_EMPTY_SCRAPES` scrapes or more is skipped until
+        it's due to be probed again. Within the budget, at least one country
+        without known offers is kept, so that new offers are eventually found.
+        """
+        product_stats = self.get_stats(offer_source, product_key)
+        all_products_stats = self.get_stats(offer_source)
+        now = time.time()
+
+        with_offers, never_scraped, without_offers, skipped = [], [], [], []
+        for country in dict.fromkeys(countries):
+            stats = product_stats.get(country)
+            if stats is None:
+                never_scraped.append(country)
+            elif stats.nb_offers > 0:
+                with_offers.append(country)
+            elif (
+                stats.nb_scrapes >= MIN_EMPTY_SCRAPES
+                and now - stats.last_scraped_at < REPROBE_DAYS * _SECONDS_PER_DAY
+            ):
+                skipped.append(country)
+            else:
+                without_offers.append(country)
+
+        with_offers.sort(key=lambda c: product_stats[c].offers_per_scrape, reverse=True)
+        never_scraped.sort(
+            key=lambda c: (
+                all_products_stats[c].offers_per_scrape
+                if c in all_products_stats
+                else float("inf")
+            ),
+            reverse=True,
+        )
+        probes = never_scraped + without_offers
+        selected = with_offers + probes
+
+        if max_countries is not None and len(selected) > max_countries:
+            skipped += selected[max_countries:]
+            selected = selected[:max_countries]
+            if probes and max_countries > 0 and not set(probes) & set(selected):
+                skipped.remove(probes[0])
+                skipped.append(selected[-1])
+                selected[-1] = probes[0]
+
+        if skipped:
+            logger.info(
+                "skipping low-yield countries",
+                offer_source=offer_source,
+                product_key=product_key,
+                countries=skipped,
+            )
+        return selected
+
+
+_store: Optional[YieldStatsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> YieldStatsStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = YieldStatsStore(
+                os.environ.get("YIELD_STATS_SQLITE_PATH", ":memory:")
+            )
+
+    return _store
+
+
+def set_store(store: Optional[YieldStatsStore]) -> None:
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def record(offer_source: str, product_key: str, country: str, nb_offers: int) -> None:
+    get_store().record(offer_source, product_key, country, nb_offers)
+
+
+def select_countries(
+    offer_source: str,
+    product_key: str,
+    countries: list[str],
+    max_countries: Optional[int] = None,
+) -> list[str]:
+    return get_store().select_countries(
+        offer_source, product_key, countries, max_countries
+    )
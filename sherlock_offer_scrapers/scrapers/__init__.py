@@ -1 +1,3 @@
-from . import idealo
+# The scrapers are not imported here on purpose: each of them is imported on
+# first use (see `main._load_scraper`), so that a function only pays the import
+# time of the sources it scrapes.
@@ -1,6 +1,11 @@
 import asyncio
+import collections
+import concurrent.futures
 import functools
-from typing import List, Optional, Tuple
+import itertools
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
 
 import structlog
 from bs4 import BeautifulSoup
@@ -11,6 +16,22 @@ from . import user_agents, parser
 
 logger = structlog.get_logger()
 
+# Don't start fetching an offer page with less time than this left before the
+# deadline of the invocation: it would most likely be killed half-way.
+MIN_SECONDS_PER_FETCH = 20
+
+# Offer pages fetched at the same time, over all the countries of a product
+MAX_CONCURRENT_FETCHES = int(
+    os.environ.get("GOOGLE_SHOPPING_MAX_CONCURRENT_FETCHES", 8)
+)
+
+# The threads of the fetches. Not the default executor of the loop: it only has
+# cpu + 4 threads, shared with the other scrapers of the invocation, so the
+# limit above would never be reached.
+_fetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_FETCHES, thread_name_prefix="google-shopping-fetch"
+)
+
 
 # Using UULE parameter to access the offer page in different countries.
 # Read about UULE here: https://valentin.app/uule.html
@@ -58,76 +79,179 @@ uule_of_country = {
 # }
 
 
-async def scrape_one_country(
-    gtin: Optional[str],
-    sku: Optional[str],
-    cached_offers_urls: Optional[dict],
-    country: str,
-) -> Tuple[List[helpers.offers.Offer], List[Tuple[Exception, str]]]:
+@dataclass(frozen=True)
+class Fetch:
+    """An offer page to fetch: a cached product URL in a country."""
+
+    cached_product_url: str
+    country: str
+
+
+def get_offer_sources(country: str) -> List[str]:
+    """
+    Sweden is a special case because this code used to search only in Sweden and we already have entries in the
+    database with "google_shopping" as `offer_source`.
+
+    That's why you will find "google_shopping_DK", but not "google_shopping_SE" in the database.
+
+    June 2024 update: Now we use "google_shopping" as the default source, so an URL can be assigned to a country
+    with the "google_shopping_DE" source, or it can be used in all the countries by using "google_shopping"
+    """
     offer_sources = ["google_shopping"]
     if country.upper() != "SE":
-        """
-        Sweden is a special case because this code used to search only in Sweden and we already have entries in the
-        database with "google_shopping" as `offer_source`.
+        offer_sources += [f"google_shopping_{country.upper()}"]
+    return offer_sources
 
-        That's why you will find "google_shopping_DK", but not "google_shopping_SE" in the database.
 
-        June 2024 update: Now we use "google_shopping" as the default source, so an URL can be assigned to a country
-        with the "google_shopping_DE" source, or it can be used in all the countries by using "google_shopping"
-        """
-        offer_sources += [f"google_shopping_{country.upper()}"]
+def plan_fetches(
+    gtin: Optional[str],
+    cached_offers_urls: dict,
+    countries: List[str],
+) -> List[Fetch]:
+    """List the offer pages to fetch in all the countries, in the order they
+    should be fetched.
+
+    The same page is fetched once, even if its URL is cached for several
+    sources of the country. The countries take turns, one page each, in the
+    order of `countries` (the most promising first, see
+    `helpers.yield_stats`), so that a country with many cached URLs doesn't
+    delay the others.
+    """
+    fetches_per_country: dict[str, List[Fetch]] = {}
+    for country in dict.fromkeys(countries):
+        offer_sources = get_offer_sources(country)
+        fetches: dict[str, Fetch] = {}
+        for offer_source in offer_sources:
+            for cached_product_url in cached_offers_urls.get(offer_source, []):
+                cached_product_url = cached_product_url.strip()
+                url = __build_product_url(cached_product_url, country)
+                fetches.setdefault(url, Fetch(cached_product_url, country))
+
+        if not fetches:
+            logger.warning(
+                "Missing URLs for given sources, skip...",
+                offer_source=offer_sources,
+                gtin=gtin,
+            )
+        fetches_per_country[country] = list(fetches.values())
 
-    if not cached_offers_urls:
-        logger.warning(
-            "Search by GTIN has been disabled for google_shopping. "
-            + "No cached url provided, cannot fetch offers.",
-            offer_source=offer_sources,
-            gtin=gtin,
-        )
-        return [], []
+    rounds = itertools.zip_longest(*fetches_per_country.values())
+    return [
+        fetch for fetch_round in rounds for fetch in fetch_round if fetch is not None
+    ]
 
-    product_urls = [u for s in offer_sources for u in cached_offers_urls.get(s, [])]
-    if not product_urls:
-        logger.warning(
-            "Missing URLs for given sources, skip...",
-            offer_source=offer_sources,
-            gtin=gtin,
-        )
-        return [], []
 
-    all_searches = []
-    for product_url in product_urls:
-        coro = fetch_offers_from_google_product_id(product_url, gtin, sku, country)  # type: ignore
-        all_searches.append(coro)
+async def _fetch_within_limit(
+    semaphore: asyncio.Semaphore,
+    fetch: Fetch,
+    gtin: Optional[str],
+    sku: Optional[str],
+) -> Tuple[List[Offer], str, Optional[Exception]]:
+    async with semaphore:
+        with helpers.tracing.span(
+            "fetch-offers",
+            offer_source="google_shopping",
+            country=fetch.country,
+            gtin=gtin,
+        ) as fetch_span:
+            offers, country, exception = await fetch_offers_from_google_product_id(
+                fetch.cached_product_url, gtin, sku, fetch.country
+            )
+            fetch_span.set_attribute("offer_count", len(offers))
+    return offers, country, exception
 
-    offer_results = await asyncio.gather(*all_searches)
 
+async def scrape(
+    gtin: Optional[str],
+    sku: Optional[str],
+    cached_offers_urls: Optional[dict],
+    countries=["SE"],
+) -> Tuple[List[helpers.offers.Offer], List[Tuple[Exception, str]]]:
     all_offers = []
-    exceptions = []
-    for offers, country, exception in offer_results:
+    all_exceptions = []
+    async for _, offers, exceptions in scrape_by_country(
+        gtin, sku, cached_offers_urls, countries
+    ):
         all_offers.extend(offers)
-        if exception is not None:
-            exceptions.append((exception, country))
+        all_exceptions.extend(exceptions)
 
-    return all_offers, exceptions
+    return all_offers, all_exceptions
 
 
-async def scrape(
+async def scrape_by_country(
     gtin: Optional[str],
     sku: Optional[str],
     cached_offers_urls: Optional[dict],
-    countries=["SE"],
-) -> Tuple[List[helpers.offers.Offer], List[Tuple[Exception, str]]]:
-    results_per_country = await asyncio.gather(
-        *[
-            scrape_one_country(gtin, sku, cached_offers_urls, country)
-            for country in countries
-        ]
-    )
+    countries: List[str],
+) -> AsyncIterator[Tuple[str, List[helpers.offers.Offer], List[Tuple[Exception, str]]]]:
+    """Fetch the offer pages of all countries, at most `MAX_CONCURRENT_FETCHES`
+    at a time (see `plan_fetches()`), and yield the results of each country as
+    soon as all its pages are done, so that slow countries don't hold back
+    fast ones.
+
+    Countries that are still running when the invocation deadline is reached
+    are abandoned. The pages skipped for lack of time come with a
+    `DeadlineExceeded` in the exceptions of their country.
+    """
+    countries = list(dict.fromkeys(countries))
+    if not cached_offers_urls:
+        logger.warning(
+            "Search by GTIN has been disabled for google_shopping. "
+            + "No cached url provided, cannot fetch offers.",
+            offer_source="google_shopping",
+            gtin=gtin,
+        )
+        for country in countries:
+            yield country, [], []
+        return
+
+    fetches = plan_fetches(gtin, cached_offers_urls, countries)
+    nb_pending_fetches = collections.Counter(fetch.country for fetch in fetches)
+    offers_per_country: dict[str, List[Offer]] = {c: [] for c in countries}
+    exceptions_per_country: dict[str, List[Tuple[Exception, str]]] = {
+        c: [] for c in countries
+    }
+
+    for country in countries:
+        if not nb_pending_fetches[country]:
+            yield country, [], []
+
+    # The tasks wait for the semaphore in the order they are created, i.e.
+    # in the order of the plan
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    tasks = {
+        asyncio.ensure_future(_fetch_within_limit(semaphore, fetch, gtin, sku)): fetch
+        for fetch in fetches
+    }
+
+    pending = set(tasks.keys())
+    while pending:
+        done, pending = await asyncio.wait(
+            pending,
+            timeout=helpers.deadline.remaining(),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if not done:
+            logger.warning(
+                "deadline reached, abandoning countries",
+                gtin=gtin,
+                countries=sorted({tasks[task].country for task in pending}),
+            )
+            for task in pending:
+                task.cancel()
+            return
 
-    return [o for r in results_per_country for o in r[0]], [
-        e for r in results_per_country for e in r[1]
-    ]
+        for task in done:
+            country = tasks[task].country
+            offers, _, exception = task.result()
+            offers_per_country[country].extend(offers)
+            if exception is not None:
+                exceptions_per_country[country].append((exception, country))
+
+            nb_pending_fetches[country] -= 1
+            if not nb_pending_fetches[country]:
+                exceptions = exceptions_per_country[country]
+                yield country, offers_per_country[country], exceptions
 
 
 def find_product_id(gtin: str, country: str = "se") -> Optional[str]:
@@ -139,6 +263,7 @@ def find_product_id(gtin: str, country: str = "se") -> Optional[str]:
         headers={"User-Agent": user_agents.choose_random()},
         cookies={"CONSENT": "YES+cb.20210329-17-p2.en+FX+900"},
         proxy_country="SE",
+        retry_policy=helpers.requests.DEFAULT_RETRY_POLICY,
     ).text
     soup = BeautifulSoup(html, features="html.parser")
 
@@ -190,6 +315,23 @@ def __build_product_url(cached_product_url: str, country: str):
     )
 
 
+def _get_offer_page_within_deadline(
+    url: str, proxy_country: str, country: str, conditional_headers: dict
+):
+    # Checked when the request is actually about to be sent, which might be a
+    # while after it was scheduled if the thread pool is busy.
+    if not helpers.deadline.has_time_for(MIN_SECONDS_PER_FETCH):
+        raise helpers.deadline.DeadlineExceeded()
+
+    return helpers.requests.get(
+        url,
+        headers={"User-Agent": user_agents.choose_random(), **conditional_headers},
+        proxy_country=proxy_country,
+        offer_source_country=country,
+        retry_policy=helpers.requests.DEFAULT_RETRY_POLICY,
+    )
+
+
 async def fetch_offers_from_google_product_id(
     cached_product_url: str,
     gtin: Optional[str],
@@ -202,30 +344,67 @@ async def fetch_offers_from_google_product_id(
 
         loop = asyncio.get_event_loop()
 
-        response = await loop.run_in_executor(
-            None,
-            functools.partial(
-                helpers.requests.get,
-                url,
-                headers={"User-Agent": user_agents.choose_random()},
-                proxy_country=proxy_country,
-                offer_source_country=country,
-            ),
+        previous = await loop.run_in_executor(
+            _fetch_executor, helpers.page_fingerprints.get, url
         )
-
-        soup = BeautifulSoup(response.text, "html.parser")
         try:
-            offers = parser.parser_offer_page(soup, country)
-            return offers, country, None
-        except Exception as ex:
-            logger.msg("error parsing html", country=country, exception=str(ex))
-            helpers.dump_html.dump_html(
-                response.text,
-                "google_shopping",
-                gtin if gtin else sku,
-                country,
+            response = await loop.run_in_executor(
+                _fetch_executor,
+                helpers.tracing.bind(
+                    functools.partial(
+                        _get_offer_page_within_deadline,
+                        url,
+                        proxy_country,
+                        country,
+                        helpers.page_fingerprints.conditional_headers(previous),
+                    )
+                ),
+            )
+        except helpers.deadline.DeadlineExceeded as ex:
+            logger.warning(
+                "not enough time left, skipping fetch",
+                google_pid=cached_product_url,
+                country=country,
             )
-            raise ex
+            # Not an error, but the country is incomplete
+            return [], country, ex
+
+        region_hash = (
+            parser.offers_region_hash(response.text)
+            if response.status_code == 200
+            else None
+        )
+        offers = helpers.page_fingerprints.unchanged_offers(
+            url, previous, response, region_hash
+        )
+        if offers is None:
+            soup = BeautifulSoup(response.text, "html.parser")
+            try:
+                with helpers.tracing.span(
+                    "parse-offers", country=country
+                ) as parse_span:
+                    offers = parser.parser_offer_page(soup, country)
+                    parse_span.set_attribute("offer_count", len(offers))
+            except Exception as ex:
+                logger.msg("error parsing html", country=country, exception=str(ex))
+                helpers.dump_html.dump_html(
+                    response.text,
+                    "google_shopping",
+                    gtin if gtin else sku,
+                    country,
+                )
+                raise ex
+
+        await loop.run_in_executor(
+            _fetch_executor,
+            helpers.page_fingerprints.store,
+            url,
+            response,
+            region_hash,
+            offers,
+            previous,
+        )
+        return offers, country, None
     except Exception as ex:
         logger.error(
             "error when fetching offers",
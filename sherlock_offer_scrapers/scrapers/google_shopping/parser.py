@@ -1,15 +1,106 @@
 import json
-import re
+from dataclasses import dataclass
 from typing import Optional, Tuple
 
 import bs4
-import price_parser
+import soupsieve
 import structlog
 
+from sherlock_offer_scrapers import helpers
 from sherlock_offer_scrapers.helpers.offers import Offer
 
 logger = structlog.get_logger()
-currency_regex = re.compile(r"^[A-Za-z]{3}$")
+
+
+@dataclass(frozen=True)
+class PageVariant:
+    """Where to find the offers on one variant of the offers page.
+
+    The variants are tried in order, the first one whose title is on the page
+    is used. The selectors are compiled once, instead of on every row.
+    """
+
+    index: int
+    # The product name, e.g. <div class="MPhl6c">
+    title_tags: Tuple[str, ...]
+    title_class: str
+    rows: soupsieve.SoupSieve
+    # Within a row
+    price: soupsieve.SoupSieve
+    link: soupsieve.SoupSieve
+    # Prepended to the href of the link, which is relative on some variants
+    url_prefix: str
+    # The element containing all the rows, as (tag, class), if there is one
+    offers_region: Optional[Tuple[str, str]] = None
+
+
+PAGE_VARIANTS = [
+    PageVariant(
+        index=0,
+        title_tags=("a", "span"),
+        title_class="sh-t__title-pdp",
+        rows=soupsieve.compile("table.dOwBOc > tbody > tr.sh-osd__offer-row"),
+        # price=soupsieve.compile(".drzWO"),  # this is price total price
+        # 2023-04-25: We switched to item price (without shipping) for our b2b usecase
+        price=soupsieve.compile(".g9WBQb.fObmGc"),
+        link=soupsieve.compile("a.b5ycib"),
+        url_prefix="https://www.google.com",
+        offers_region=("table", "dOwBOc"),
+    ),
+    PageVariant(
+        index=1,
+        title_tags=("div",),
+        title_class="MPhl6c",
+        rows=soupsieve.compile("div.Nq7DI div.MVQv4e"),
+        price=soupsieve.compile("div.DX0ugf div.xwW5Ce div.DX0ugf span.Lhpu7d"),
+        link=soupsieve.compile("a.ueI0Ed"),
+        url_prefix="",
+        offers_region=("div", "Nq7DI"),
+    ),
+    # One-offer product page, identified by the query parameter "prds" instead
+    # of a product id
+    PageVariant(
+        index=2,
+        title_tags=("div",),
+        title_class="fbrNcd",
+        rows=soupsieve.compile("div.qEeQL"),
+        price=soupsieve.compile("div.WwE9ce"),
+        link=soupsieve.compile("a"),
+        url_prefix="https://www.google.com",
+    ),
+]
+
+IMAGE_CLASS = "r4m4nf"
+
+_TITLE_AND_IMAGE_CLASSES = frozenset(
+    [page_variant.title_class for page_variant in PAGE_VARIANTS] + [IMAGE_CLASS]
+)
+
+
+def offers_region_hash(html: str) -> Optional[str]:
+    """Hash of the rows and the product name of an offers page, to recognize
+    an unchanged page without parsing it, see `helpers.page_fingerprints`.
+
+    None if the page has none of the known offers regions.
+    """
+    for page_variant in PAGE_VARIANTS:
+        if page_variant.offers_region is None:
+            continue
+        offers_region = helpers.page_fingerprints.find_element(
+            html, *page_variant.offers_region
+        )
+        if offers_region is None:
+            continue
+
+        titles = [
+            helpers.page_fingerprints.find_element(html, tag, page_variant.title_class)
+            for tag in page_variant.title_tags
+        ]
+        return helpers.page_fingerprints.region_hash(
+            offers_region, *[title for title in titles if title is not None]
+        )
+
+    return None
 
 
 def parser_offer_page(soup, country) -> list[Offer]:
@@ -39,8 +130,8 @@ def parser_offer_page(soup, country) -> list[Offer]:
         return []
 
     try:
-        product_name, page_variant = _extract_product_name(soup)
-        logger.info("page variant", page_variant=page_variant)
+        page_variant, product_name, image = _match_page_variant(soup)
+        logger.info("page variant", page_variant=page_variant.index)
     except Exception as ex:
         div_MPhl6c_exist = len(soup.select(".MPhl6c")) > 0
         logger.error(
@@ -50,68 +141,42 @@ def parser_offer_page(soup, country) -> list[Offer]:
         )
         raise ex
 
-    image = None
-    image_element = soup.find("img", class_="r4m4nf")
-    if image_element is not None:
-        image = image_element.get("src")
-
-    if page_variant == 0:
-        rows = soup.select("table.dOwBOc > tbody > tr.sh-osd__offer-row")
-    elif page_variant == 1:
-        rows = soup.select("div.Nq7DI div.MVQv4e")
-    elif page_variant == 2:
-        rows = soup.select("div.qEeQL")
+    if image is not None:
+        metadata = json.dumps({"images": [image]})
+    else:
+        metadata = None
 
     offers: list[Offer] = []
-    for row in rows:
-        if page_variant == 0:
-            # price_divs = row.select(".drzWO")  # this is price total price
-            # 2023-04-25: We switched to item price (without shipping) for our b2b usecase
-            price_divs = row.select(".g9WBQb.fObmGc")
-        elif page_variant == 1:
-            price_divs = row.select("div.DX0ugf div.xwW5Ce div.DX0ugf span.Lhpu7d")
-        elif page_variant == 2:
-            price_divs = row.select("div.WwE9ce")
-
-        if len(price_divs) == 0:  # skip rows without prices
+    for row in page_variant.rows.select(soup):
+        price_div = page_variant.price.select_one(row)
+        if price_div is None:  # skip rows without prices
             continue
-        price_text = price_divs[0].get_text()
+        price_text = price_div.get_text()
         price_and_currency = _extract_price_and_currency(price_text, country)
         if price_and_currency is None:
             continue
         price, currency = price_and_currency
 
-        if page_variant == 0:
-            link_anchor = row.select("a.b5ycib")[0]
-            offer_url = link_anchor.attrs["href"]
-            offer_url = f"https://www.google.com{offer_url}"
-        elif page_variant == 1:
-            link_anchor = row.select("a.ueI0Ed")[0]
-            offer_url = link_anchor.attrs["href"]
-        elif page_variant == 2:
-            link_anchor = row.select("a")[0]
-            offer_url = link_anchor.attrs["href"]
-            offer_url = f"https://www.google.com{offer_url}"
+        link_anchor = page_variant.link.select_one(row)
+        if link_anchor is None:
+            raise Exception("Cannot find offer link")
+        offer_url = page_variant.url_prefix + str(link_anchor.attrs["href"])
 
         retailer_name = link_anchor.contents[0].get_text()
 
-        if image is not None:
-            metadata = json.dumps({"images": [image]})
-        else:
-            metadata = None
-
-        offer: Offer = {
-            "offer_source": f"google_shopping_{country}",
-            "offer_url": offer_url,
-            "retail_prod_name": product_name,
-            "retailer_name": retailer_name,
-            "country": country,
-            "price": price,
-            "currency": currency,
-            "stock_status": "in_stock",
-            "metadata": metadata,
-        }
-        offers.append(offer)
+        offer = Offer.create_or_none(
+            offer_source=f"google_shopping_{country}",
+            offer_url=offer_url,
+            retail_prod_name=product_name,
+            retailer_name=retailer_name,
+            country=country,
+            price=price,
+            currency=currency,
+            stock_status="in_stock",
+            metadata=metadata,
+        )
+        if offer is not None:
+            offers.append(offer)
 
     return offers
 
@@ -131,24 +196,29 @@ def _is_server_error_page(soup) -> bool:
     return soup.find("h1", string="Server Error") is not None
 
 
-def _extract_product_name(soup) -> Tuple[str, int]:
-    page_variant = 0
-
-    product_title = soup.find(["a", "span"], class_="sh-t__title-pdp")
-    if product_title is None:
-        product_title = soup.find("div", class_="MPhl6c")
-        page_variant = 1
-
-    if product_title is None:
-        product_title = soup.find("div", class_="fbrNcd")
-        page_variant = 2  # This is e one-offer product page identified by the query parameter "prds", instead of a product id
+def _match_page_variant(soup) -> Tuple[PageVariant, str, Optional[str]]:
+    """Find the variant of the page, its product name and its image, in a
+    single traversal of the page."""
+    titles: dict[int, bs4.Tag] = {}
+    image = None
+    for element in soup.find_all(class_=_TITLE_AND_IMAGE_CLASSES.__contains__):
+        classes = element.get("class", [])
+        if element.name == "img" and IMAGE_CLASS in classes and image is None:
+            image = element.get("src")
 
-    if product_title is None:
-        raise Exception("Cannot find product title")
+        for page_variant in PAGE_VARIANTS:
+            if (
+                page_variant.index not in titles
+                and element.name in page_variant.title_tags
+                and page_variant.title_class in classes
+            ):
+                titles[page_variant.index] = element
 
-    product_name = product_title.get_text()
+    for page_variant in PAGE_VARIANTS:
+        if page_variant.index in titles:
+            return page_variant, titles[page_variant.index].get_text(), image
 
-    return product_name, page_variant
+    raise Exception("Cannot find product title")
 
 
 def _is_cookies_prompt_page(soup) -> bool:
@@ -184,54 +254,15 @@ def _extract_price_and_currency(
 ) -> Optional[Tuple[int, str]]:
     price_text_normalized = price_text.replace("'", "").replace("’", "")
 
-    price_obj = price_parser.parse_price(price_text_normalized)
-
-    if price_obj.amount == 0:
-        return None
-
-    if price_obj.amount is None or price_obj.currency is None:
-        raise Exception(f"Error when parsing price: {price_text_normalized}")
-
-    amount, currency = round(price_obj.amount * 100), price_obj.currency
-    # Convert currency symbols to ISO 4217 currency code:
-    if price_obj.currency == "kr":
-        if country == "SE":
-            currency = "SEK"
-        if country == "NO":
-            currency = "NOK"
-        if country == "DK":
-            currency = "DKK"
-    elif price_obj.currency == "€":
-        currency = "EUR"
-    elif price_obj.currency == "£":
-        currency = "GBP"
-    elif price_obj.currency == "$":
-        currency = "USD"
-    elif price_obj.currency == "NZ$":
-        currency = "NZD"
-    elif price_obj.currency == "A$" or price_obj.currency == "AU$":
-        currency = "AUD"
-    elif price_obj.currency == "MX$" or price_obj.currency == "Mex$":
-        currency = "MXN"
-    elif price_obj.currency == "₪":
-        currency = "ILS"
-    elif (
-        price_obj.currency == "Can$"
-        or price_obj.currency == "C$"
-        or price_obj.currency == "CA$"
-    ):
-        currency = "CAD"
-    elif len(currency) == 3 and currency_regex.search(currency) is not None:
-        currency = price_obj.currency.upper()  # already in ISO format, do nothing
-    else:
+    try:
+        return helpers.prices.parse_price(price_text_normalized, country)
+    except helpers.prices.UnknownCurrencyError as ex:
         logger.error(
             "error when parsing price and currency",
             input_price_text=price_text,
             input_price_text_normalized=price_text_normalized,
             country=country,
-            output_amount=amount,
-            output_currency=currency,
+            output_amount=ex.amount,
+            output_currency=ex.currency,
         )
-        raise Exception(f"Cannot convert currency: {currency}")
-
-    return amount, currency
+        raise ex
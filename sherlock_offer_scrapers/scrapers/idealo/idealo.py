@@ -1,15 +1,19 @@
+import functools
+import html
 import json
+import re
 from typing import List, Optional, Tuple, Dict
 import concurrent.futures
 import structlog
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from bs4.element import NavigableString
 from unidecode import unidecode
 import codecs
 
 
 from sherlock_offer_scrapers import helpers
+from sherlock_offer_scrapers.helpers.offers import Offer, StockStatus
 from . import errors, user_agents, products
 
 
@@ -18,6 +22,40 @@ logger = structlog.get_logger()
 
 COUNTRIES = ["DE", "UK", "ES", "IT", "FR", "AT"]
 
+# ROT47 rotates the 94 printable ASCII characters, from "!" to "~"
+_ROT47_TABLE = str.maketrans(
+    "".join(chr(code) for code in range(33, 127)),
+    "".join(chr(33 + ((code + 14) % 94)) for code in range(33, 127)),
+)
+
+# Tags and comments, as skipped by html.parser
+_HTML_TAG_REGEX = re.compile(r"<!--.*?-->|</?[a-zA-Z][^>]*>", re.DOTALL)
+
+# Classes of the only regions of a product page that we read, see
+# `_parse_offers()`. Everything else (menus, scripts, ads, ...) is skipped by the
+# parser instead of being built into the tree.
+_PAGE_REGION_CLASSES = frozenset(
+    [
+        "captcha",
+        "breadcrumb",
+        "editorialProductTextInner",
+        "simple-carousel-item",
+        "datasheet-list",
+        "productOffers-list",
+    ]
+)
+
+
+def _is_page_region(class_value) -> bool:
+    if class_value is None:
+        return False
+    # The parser gives the raw value of the attribute, e.g. "delivery out"
+    classes = class_value.split() if isinstance(class_value, str) else class_value
+    return not _PAGE_REGION_CLASSES.isdisjoint(classes)
+
+
+_PAGE_REGIONS = SoupStrainer(attrs={"class": _is_page_region})
+
 base_urls = {
     "DE": "https://www.idealo.de",
     "UK": "https://www.idealo.co.uk",
@@ -55,7 +93,9 @@ def scrape(gtin, cached_offer_urls: Optional[dict]) -> list:
         for product_url in idealo_product_urls.values():
             if not product_url:
                 continue
-            future = executor.submit(get_offers_from_url, product_url)
+            future = executor.submit(
+                helpers.tracing.bind(get_offers_from_url), product_url
+            )
             futures.append(future)
 
     all_offers = []
@@ -132,24 +172,52 @@ def idealo_product_id_to_url_alternative(idealo_product_id, country: str) -> str
     return f"{base_url}/{idealo_product_id}"
 
 
-def get_offers_from_url(idealo_product_url: str) -> List[dict]:
+def get_offers_from_url(idealo_product_url: str) -> List[Offer]:
     """Retrieve the html page of the product and scrape its data."""
-    try:
-        response = _make_request(idealo_product_url)
-    except errors.IdealoExpectedError as ex:
-        logger.warning("expected idealo error", ex=ex)
-        return []
-
-    content = response.text
     country = _get_country_from_product_url(idealo_product_url)
-    offers = _parse_offers(content, country)
+    with helpers.tracing.span(
+        "fetch-offers", offer_source="idealo", country=country, url=idealo_product_url
+    ):
+        previous = helpers.page_fingerprints.get(idealo_product_url)
+        try:
+            fetched_url, response = _make_request(
+                idealo_product_url,
+                helpers.page_fingerprints.conditional_headers(previous),
+            )
+        except errors.IdealoExpectedError as ex:
+            logger.warning("expected idealo error", ex=ex)
+            return []
 
-    for offer in offers:
-        # offer["product_id"] = product_id
-        offer["country"] = country
-        offer["offer_source"] = f"idealo_{country}"
+        # The alternative url is another page, with its own validators
+        is_product_url = fetched_url == idealo_product_url
+        if not is_product_url:
+            previous = None
 
-    return offers
+        region_hash = _offers_region_hash(response)
+        offers = helpers.page_fingerprints.unchanged_offers(
+            idealo_product_url, previous, response, region_hash
+        )
+        if offers is None:
+            with helpers.tracing.span("parse-offers", country=country) as parse_span:
+                offers = _parse_offers(response.text, country)
+                parse_span.set_attribute("offer_count", len(offers))
+        if is_product_url:
+            helpers.page_fingerprints.store(
+                idealo_product_url, response, region_hash, offers, previous
+            )
+        return offers
+
+
+def _offers_region_hash(response: requests.Response) -> Optional[str]:
+    """Hash of the list of offers of a product page. The other regions read by
+    `_parse_offers()` (category, specs, ...) describe the product and are not
+    expected to change while the offers don't."""
+    if response.status_code != 200:
+        return None
+    offers_list = helpers.page_fingerprints.find_element(
+        response.text, "ul", "productOffers-list"
+    )
+    return helpers.page_fingerprints.region_hash(offers_list) if offers_list else None
 
 
 def _get_headers():
@@ -161,10 +229,20 @@ def _get_headers():
     }
 
 
-def _make_request(url) -> requests.Response:
-    response = helpers.requests.get(url, headers=_get_headers(), proxy_country="DE")
-    if response.status_code == 200:
-        return response
+def _make_request(
+    url, conditional_headers: Optional[dict] = None
+) -> Tuple[str, requests.Response]:
+    """The response of the `url`, or of its alternative url if it failed, with
+    the url it came from."""
+    response = helpers.requests.get(
+        url,
+        headers={**_get_headers(), **(conditional_headers or {})},
+        proxy_country="DE",
+        retry_policy=helpers.requests.DEFAULT_RETRY_POLICY,
+    )
+    # 304 when the page hasn't changed since `conditional_headers` were given
+    if response.status_code in (200, 304):
+        return url, response
 
     # Try an alternative url:
     alter_url = _switch_url(url)
@@ -185,11 +263,14 @@ def _make_request(url) -> requests.Response:
 
     # Request to alt_url:
     response = helpers.requests.get(
-        alter_url, headers=_get_headers(), proxy_country="DE"
+        alter_url,
+        headers=_get_headers(),
+        proxy_country="DE",
+        retry_policy=helpers.requests.DEFAULT_RETRY_POLICY,
     )
 
     if response.status_code == 200:
-        return response
+        return alter_url, response
 
     # alt_url also failed:
     if response.status_code == 410:
@@ -353,21 +434,35 @@ def _extract_retail_product_name(offer_div) -> str:
 def _decode_product_name(encrypted_product_name: str) -> str:
     product_name_html = _decode_rot47(encrypted_product_name)
     # There might be some html codes after decryption, so prune them:
-    soup = BeautifulSoup(product_name_html, features="html.parser")
-    product_name = soup.get_text()
-    return product_name
+    return _strip_html(product_name_html)
 
 
-def _extract_price_and_currency(offer_div) -> Tuple[int, str]:
+def _strip_html(text: str) -> str:
+    """Text of an HTML snippet, without parsing it: the product names only
+    contain the odd tag or entity, if any."""
+    if "<" not in text and "&" not in text:
+        return text
+    return html.unescape(_HTML_TAG_REGEX.sub("", text))
+
+
+def _extract_price_and_currency(offer_div, country: str) -> Tuple[int, str]:
     price_tag = offer_div.find("a", class_="productOffers-listItemOfferPrice")
-    price_text = price_tag.text
+    return _parse_price_text(price_tag.text, country)
+
+
+@functools.lru_cache(maxsize=helpers.prices.PRICE_CACHE_SIZE)
+def _parse_price_text(price_text: str, country: str) -> Tuple[int, str]:
+    """The price in cents and the currency, the one of the `country` if the
+    text has no currency symbol.
 
-    if "£" in price_text:
-        price_text = price_text.replace("£", "")
-        currency = "GBP"
-    if "€" in price_text:
-        price_text = price_text.replace("€", "")
-        currency = "EUR"
+    Raise ValueError if the currency is unknown."""
+    currency = helpers.prices.COUNTRY_CURRENCIES.get(country)
+    for symbol in ["£", "€"]:
+        if symbol in price_text:
+            price_text = price_text.replace(symbol, "")
+            currency = helpers.prices.CURRENCY_SYMBOLS[symbol]
+    if currency is None:
+        raise ValueError(f"Unknown currency of price {price_text!r} in {country}")
 
     # Normalize characters such as non-breaking space /xa0:
     price_text = unidecode(price_text)
@@ -376,7 +471,7 @@ def _extract_price_and_currency(offer_div) -> Tuple[int, str]:
     return price, currency
 
 
-def _extract_stock_status(offer_div) -> str:
+def _extract_stock_status(offer_div) -> StockStatus:
     # There are at least 7 different situations for gray icon,
     # We select 'Check availability in the shop' as 'unknown'
     unknown_filters = [
@@ -434,8 +529,10 @@ def _extract_retailer_from_logo(retailer_logo_link) -> Optional[str]:
     return retailer_name
 
 
-def _parse_offers(html_content: str, country: str) -> List[dict]:
-    soup = BeautifulSoup(html_content, features="html.parser")
+def _parse_offers(html_content: str, country: str) -> List[Offer]:
+    soup = BeautifulSoup(
+        html_content, features="html.parser", parse_only=_PAGE_REGIONS
+    )
 
     if _is_captcha_page(soup):
         raise Exception("Captcha page encountered.")
@@ -448,6 +545,16 @@ def _parse_offers(html_content: str, country: str) -> List[dict]:
     # Iterate over the HTML of the page and grab all the retail offers
     offers_results = _parse_offers_results(soup)
 
+    # Same for all the offers of the page
+    metadata = json.dumps(
+        {
+            "category": category,
+            "description": description,
+            "images": images,
+            "specs": specs,
+        }
+    )
+
     # Parse the offer DIVs and all other data
     formated_offers = []
     for offer_div in offers_results:
@@ -461,7 +568,7 @@ def _parse_offers(html_content: str, country: str) -> List[dict]:
             continue
 
         retail_prod_name = _extract_retail_product_name(offer_div)
-        price, currency = _extract_price_and_currency(offer_div)
+        price, currency = _extract_price_and_currency(offer_div, country)
         stock_status = _extract_stock_status(offer_div)
 
         info_payload = json.loads(price_tag["data-gtm-payload"])
@@ -488,24 +595,18 @@ def _parse_offers(html_content: str, country: str) -> List[dict]:
             )
             continue
 
-        offer = {
-            "retail_prod_name": retail_prod_name,
-            "retailer_name": retailer_name,
-            "price": price,
-            "currency": currency,
-            "offer_url": base_urls[country] + offer_link["href"],
-            "stock_status": stock_status,
-            "metadata": json.dumps(
-                {
-                    "category": category,
-                    "description": description,
-                    "images": images,
-                    "specs": specs,
-                }
-            ),
-        }
-
-        if not None in offer.values():
+        offer = Offer.create_or_none(
+            offer_source=f"idealo_{country}",
+            offer_url=base_urls[country] + offer_link["href"],
+            retail_prod_name=retail_prod_name,
+            retailer_name=retailer_name,
+            country=country,
+            price=price,
+            currency=currency,
+            stock_status=stock_status,
+            metadata=metadata,
+        )
+        if offer is not None:
             formated_offers.append(offer)
 
     return formated_offers
@@ -517,17 +618,9 @@ def _decode_rot47(ciphertext: str) -> str:
     # Note that ROT47 is reversable(?) cipher,
     # which means rot47(rot47(plaintext)) = plaintext
 
-    original = ""
     text = ciphertext.replace(r"（", r"W").replace(
         r"）",
         r"X",
     )  # replace the weird parentheses
     text = codecs.decode(text, "unicode_escape")  # type:ignore
-    for i, ch in enumerate(text):
-        ascii_code = ord(ch)
-        if ascii_code >= 33 and ascii_code <= 126:
-            original += chr(33 + ((ascii_code + 14) % 94))
-        else:
-            original += ch
-
-    return original
+    return text.translate(_ROT47_TABLE)
@@ -1,5 +1,6 @@
 import json
 import os
+from typing import Optional
 from unicodedata import category
 
 import structlog
@@ -31,27 +32,152 @@ COUNTRIES = [
 ]
 # COUNTRIES = ["SE"]
 
+# EANs searched with a single request, see `scrape_many`
+EANS_PER_REQUEST = int(os.environ.get("KELKOO_EANS_PER_REQUEST", 20))
+PAGE_SIZE = int(os.environ.get("KELKOO_PAGE_SIZE", 100))
+MAX_PAGES = int(os.environ.get("KELKOO_MAX_PAGES", 10))
+
 logger = structlog.get_logger()
 
 
 def scrape(gtin: str):
     all_offers = []
     for country in COUNTRIES:
-        offers = fetch_offers(country, gtin)
+        with helpers.tracing.span(
+            "fetch-offers", offer_source="kelkoo", country=country, gtin=gtin
+        ) as fetch_span:
+            offers = fetch_offers(country, gtin)
+            fetch_span.set_attribute("offer_count", len(offers))
         if offers:
             all_offers.extend(offers)
 
     return all_offers
 
 
+def scrape_many(gtins: list[str]) -> dict[str, list[Offer]]:
+    """Offers of many products, grouped by gtin.
+
+    The EANs are searched `EANS_PER_REQUEST` at a time in every country, so
+    that b2b jobs covering thousands of products don't make one request per
+    product and country. A failed request only loses the offers of its batch.
+    The EANs of a batch that may have lost offers without a usable EAN are
+    searched again one at a time.
+    """
+    offers_per_gtin: dict[str, list[Offer]] = {gtin: [] for gtin in gtins}
+    gtins_per_ean: dict[str, list[str]] = {}
+    for gtin in gtins:
+        gtins_per_ean.setdefault(gtin_to_ean(gtin), []).append(gtin)
+
+    eans = list(gtins_per_ean)
+    for country in COUNTRIES:
+        for i in range(0, len(eans), EANS_PER_REQUEST):
+            batch = eans[i : i + EANS_PER_REQUEST]
+            eans_to_retry = _fetch_batch(
+                country, batch, gtins_per_ean, offers_per_gtin
+            )
+            # Offers without a usable EAN can't be matched to a product of the
+            # batch, but they could belong to any of the products without
+            # offers: search those on their own.
+            for ean in eans_to_retry:
+                _fetch_batch(country, [ean], gtins_per_ean, offers_per_gtin)
+
+    return offers_per_gtin
+
+
+def _fetch_batch(
+    country: str,
+    batch: list[str],
+    gtins_per_ean: dict[str, list[str]],
+    offers_per_gtin: dict[str, list[Offer]],
+) -> list[str]:
+    """Add the offers of the EANs of `batch` to `offers_per_gtin`.
+
+    Return the EANs of the batch to search again on their own, because some
+    offers could not be matched to an EAN.
+    """
+    try:
+        with helpers.tracing.span(
+            "fetch-offers", offer_source="kelkoo", country=country
+        ) as fetch_span:
+            kelkoo_offers = _search_offers(country, batch)
+            fetch_span.set_attribute("ean_count", len(batch))
+            fetch_span.set_attribute("offer_count", len(kelkoo_offers))
+
+            matched_eans = set()
+            nb_unmatched_offers = 0
+            for kelkoo_offer in kelkoo_offers:
+                ean = _get_ean(kelkoo_offer, batch)
+                if ean is None:
+                    nb_unmatched_offers += 1
+                    continue
+                if ean not in gtins_per_ean:
+                    logger.warning(
+                        "kelkoo offer of an unknown ean",
+                        ean=ean,
+                        country=country,
+                        offer_id=kelkoo_offer.get("offerId"),
+                    )
+                    continue
+
+                matched_eans.add(ean)
+                offer = _parse_offer(kelkoo_offer, country)
+                if offer is None:
+                    continue
+                for gtin in gtins_per_ean[ean]:
+                    offers_per_gtin[gtin].append(offer)
+
+            fetch_span.set_attribute("unmatched_offer_count", nb_unmatched_offers)
+    except Exception as ex:
+        logger.error(
+            "error when fetching offers",
+            error=ex,
+            country=country,
+            eans=batch,
+            offer_source="kelkoo",
+        )
+        return []
+
+    if nb_unmatched_offers == 0 or len(batch) == 1:
+        return []
+
+    eans_to_retry = [ean for ean in batch if ean not in matched_eans]
+    logger.warning(
+        "kelkoo offers without ean",
+        nb_offers=nb_unmatched_offers,
+        country=country,
+        eans_to_retry=eans_to_retry,
+    )
+    return eans_to_retry
+
+
 def fetch_offers(country: str, gtin: str) -> list[Offer]:
-    # Make request:
-    ean = gtin_to_ean(gtin)
+    kelkoo_offers = _search_offers(country, [gtin_to_ean(gtin)])
+    offers = [_parse_offer(kelkoo_offer, country) for kelkoo_offer in kelkoo_offers]
+    return [offer for offer in offers if offer is not None]
+
+
+def _search_offers(country: str, eans: list[str]) -> list[dict]:
+    """Offers of Kelkoo matching any of the EANs, from all the result pages."""
+    kelkoo_offers: list[dict] = []
+    page = 1
+    while True:
+        result = _request_offers(country, eans, page)
+        kelkoo_offers.extend(result["offers"])
+
+        total_pages = result.get("meta", {}).get("offers", {}).get("totalPages", 1)
+        if page >= min(total_pages, MAX_PAGES):
+            return kelkoo_offers
+        page += 1
+
+
+def _request_offers(country: str, eans: list[str], page: int) -> dict:
     url = (
         f"https://api.kelkoogroup.net/publisher/shopping/v2/search/offers"
         + f"?country={country.lower()}"
-        + f"&filterBy=codeEan:{ean}"
-        + f"&additionalFields=merchantName,categoryName,description"
+        + f"&filterBy=codeEan:{'|'.join(eans)}"
+        + f"&additionalFields=merchantName,categoryName,description,code"
+        + f"&pageSize={PAGE_SIZE}"
+        + f"&page={page}"
     )
 
     jwt = os.getenv("KELKOO_JWT_TOKEN")
@@ -60,6 +186,7 @@ def fetch_offers(country: str, gtin: str) -> list[Offer]:
         headers={
             "Authorization": f"Bearer {jwt}",
         },
+        retry_policy=helpers.requests.DEFAULT_RETRY_POLICY,
     )
     if response.status_code != 200:
         if response.status_code < 500:
@@ -68,47 +195,54 @@ def fetch_offers(country: str, gtin: str) -> list[Offer]:
             f"Status code: {response.status_code} when requesting to url: {url}"
         )
 
-    offers = _parse_result(response.json(), country)
-    return offers
-
-
-def _parse_result(result: dict, country: str) -> list[Offer]:
-    offers: list[Offer] = []
-    for kelkoo_offer in result["offers"]:
-        category = kelkoo_offer.get("category", {}).get("name", "")
-        category = [category] if len(category) > 0 else []
-
-        images = [
-            image.get("zoomUrl")
-            for image in kelkoo_offer.get("images", [])
-            if image.get("zoomUrl") is not None
-        ]
-
-        print(kelkoo_offer.get("images"))
-
-        offer: Offer = {
-            "offer_source": "kelkoo_" + country,
-            "offer_url": kelkoo_offer["goUrl"],
-            "retail_prod_name": kelkoo_offer["title"],
-            "retailer_name": kelkoo_offer["merchant"]["name"],
-            "country": country,
-            "price": round(float(kelkoo_offer["price"]) * 100),
-            "currency": kelkoo_offer["currency"],
-            "stock_status": _parse_stock_status(kelkoo_offer["availabilityStatus"]),
-            "metadata": json.dumps(
-                {
-                    "description": kelkoo_offer.get("description"),
-                    "brand": kelkoo_offer.get("brand", {}).get("name", ""),
-                    "category": category,
-                    "images": images,
-                }
-            ),
-            # "deliveryCost": kelkoo_offer["deliveryCost"],
-            # "totalPrice": kelkoo_offer["totalPrice"],
-        }
-        offers.append(offer)
-
-    return offers
+    return response.json()
+
+
+def _get_ean(kelkoo_offer: dict, eans: list[str]) -> Optional[str]:
+    """EAN of the product of the offer, among the searched `eans`."""
+    ean = (kelkoo_offer.get("code") or {}).get("ean")
+    if ean:
+        try:
+            return gtin_to_ean(ean)
+        except ValueError:
+            return None
+
+    # Without code, the offer can only be matched when a single EAN was searched
+    return eans[0] if len(eans) == 1 else None
+
+
+def _parse_offer(kelkoo_offer: dict, country: str) -> Optional[Offer]:
+    """The offer, or None if it's invalid."""
+    category = kelkoo_offer.get("category", {}).get("name", "")
+    category = [category] if len(category) > 0 else []
+
+    images = [
+        image.get("zoomUrl")
+        for image in kelkoo_offer.get("images", [])
+        if image.get("zoomUrl") is not None
+    ]
+
+    return Offer.create_or_none(
+        {"offer_id": kelkoo_offer.get("offerId")},
+        offer_source="kelkoo_" + country,
+        offer_url=kelkoo_offer["goUrl"],
+        retail_prod_name=kelkoo_offer["title"],
+        retailer_name=kelkoo_offer["merchant"]["name"],
+        country=country,
+        price=round(float(kelkoo_offer["price"]) * 100),
+        currency=kelkoo_offer["currency"],
+        stock_status=_parse_stock_status(kelkoo_offer["availabilityStatus"]),
+        metadata=json.dumps(
+            {
+                "description": kelkoo_offer.get("description"),
+                "brand": kelkoo_offer.get("brand", {}).get("name", ""),
+                "category": category,
+                "images": images,
+            }
+        ),
+        # deliveryCost=kelkoo_offer["deliveryCost"],
+        # totalPrice=kelkoo_offer["totalPrice"],
+    )
 
 
 def _parse_stock_status(kelkoo_availability_status: str):
@@ -1,67 +1,135 @@
 import json
 import os
 import re
-import urllib
-from typing import Dict
+from typing import Dict, Optional
 
-import requests
 import structlog
 from bs4 import BeautifulSoup, Tag
 
+from sherlock_offer_scrapers import helpers
 from sherlock_offer_scrapers.helpers.offers import Offer
 from sherlock_offer_scrapers.helpers.utils import gtin_to_ean
 
 logger = structlog.get_logger()
 root_url = 'https://www.kuantokusta.pt'
+offer_source = 'kuantokusta_PT'
 
+# Every Scrapfly request costs credits (a lot more with asp=true), so the pages and the product urls are cached when
+# a cache backend is configured, see `helpers.cache`.
+PRODUCT_URL_CACHE_TTL_SECONDS = float(os.environ.get('KUANTOKUSTA_PRODUCT_URL_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+PAGE_CACHE_TTL_SECONDS = float(os.environ.get('KUANTOKUSTA_PAGE_CACHE_TTL_SECONDS', 3600))
 
-def scrape(gtin: str) -> list[Offer]:
-    return fetch_offers(gtin)
 
+def scrape(gtin: str, cached_offer_urls: Optional[dict] = None) -> list[Offer]:
+    # The search request can be skipped when we already know the product page
+    if cached_offer_urls and cached_offer_urls.get(offer_source):
+        offers = fetch_offers_from_product_page(cached_offer_urls[offer_source])
+        if offers:
+            return offers
+
+        # The page may have moved or been removed: search it again
+        logger.warn('No offers on the known product page', url=cached_offer_urls[offer_source], gtin=gtin)
+        _forget_product_page_url(gtin_to_ean(gtin))
+
+    return fetch_offers(gtin)
 
-def scrapfly_request(url: str) -> requests.Response:
-    scrapfly_url = (
-        f"https://api.scrapfly.io/scrape"
-        f"?key={os.environ.get('SCRAPFLY_API_KEY', '')}"
-        f"&url={urllib.parse.quote(url)}"
-        "&tags=player%2Cproject%3Adefault"
-        "&country=pt"
-        "&asp=true"
-    )
 
-    return requests.get(scrapfly_url)
+def scrapfly_request(url: str) -> helpers.scrapfly.ScrapeResult:
+    return helpers.scrapfly.get_client().scrape(url, country='pt', asp=True, tags=['player', 'project:default'])
 
 
 def fetch_offers(gtin: str) -> list[Offer]:
     ean = gtin_to_ean(gtin)
-    url = f'{root_url}/search?q={ean}'
-    response = scrapfly_request(url)
-    response_object = json.loads(response.text)
-    if response.status_code >= 400 or response_object['result']['error']:
-        logger.warn(f"Received error code from Scrapfly API: {response.status_code}", payload=response_object)
+    product_page_url = _get_cached_product_page_url(ean)
+    if product_page_url is not None:
+        offers = fetch_offers_from_product_page(product_page_url)
+        if offers:
+            return offers
+
+        logger.warn('No offers on the cached product page', url=product_page_url, gtin=gtin)
+        _forget_product_page_url(ean)
+
+    content = get_page_content(f'{root_url}/search?q={ean}')
+    if content is None:
         return []
 
-    soup = BeautifulSoup(response_object['result']['content'], "html.parser")
-    return fetch_offers_from_search_page(soup)
+    soup = BeautifulSoup(content, "html.parser")
+    return fetch_offers_from_search_page(soup, gtin)
 
 
-def fetch_offers_from_search_page(soup: BeautifulSoup) -> list[Offer]:
+def fetch_offers_from_search_page(soup: BeautifulSoup, gtin: Optional[str] = None) -> list[Offer]:
     if len(soup.select(".products-empty")) > 0:
         logger.warn("Product does not exist")
         return []
 
     product_page_url = parse_results_page(soup)
     if product_page_url == f'{root_url}#':
-        return [parse_results_page_with_unique_retailer(soup)]
+        offer = parse_results_page_with_unique_retailer(soup)
+        return [offer] if offer is not None else []
+
+    if gtin is not None:
+        _remember_product_page_url(gtin, product_page_url)
+
+    return fetch_offers_from_product_page(product_page_url)
 
-    response = scrapfly_request(product_page_url)
-    response_object = json.loads(response.text)
-    if response.status_code >= 400 or response_object['result']['error']:
-        logger.warn(f"Received error code from Scrapfly API: {response.status_code}", payload=response_object)
+
+def fetch_offers_from_product_page(product_page_url: str) -> list[Offer]:
+    content = get_page_content(product_page_url)
+    if content is None:
         return []
-    soup = BeautifulSoup(response_object['result']['content'], "html.parser")
 
-    return parse_product_page(soup)
+    with helpers.tracing.span('parse-offers', country='PT') as parse_span:
+        soup = BeautifulSoup(content, "html.parser")
+        offers = parse_product_page(soup)
+        parse_span.set_attribute('offer_count', len(offers))
+    return offers
+
+
+def get_page_content(url: str) -> Optional[str]:
+    """
+    Returns the html of the page rendered by Scrapfly, or None if it couldn't be fetched. Pages fetched recently are
+    returned from the cache, without spending credits.
+    """
+    backend = helpers.cache.get_backend()
+    cache_key = f'kuantokusta:page:{url}'
+    if backend is not None:
+        content = backend.get(cache_key)
+        if content is not None:
+            logger.info('kuantokusta-page-cache-hit', url=url)
+            return content
+
+    try:
+        result = scrapfly_request(url)
+    except helpers.scrapfly.ScrapflyError as ex:
+        logger.warn('Error when scraping the page with Scrapfly', url=url, error=str(ex))
+        return None
+
+    content = result.content
+    if backend is not None:
+        backend.set(cache_key, content, PAGE_CACHE_TTL_SECONDS)
+    return content
+
+
+def _get_cached_product_page_url(ean: str) -> Optional[str]:
+    backend = helpers.cache.get_backend()
+    if backend is None:
+        return None
+    return backend.get(f'kuantokusta:product_url:{ean}')
+
+
+def _forget_product_page_url(ean: str) -> None:
+    backend = helpers.cache.get_backend()
+    if backend is not None:
+        backend.delete(f'kuantokusta:product_url:{ean}')
+
+
+def _remember_product_page_url(gtin: str, product_page_url: str) -> None:
+    # Stored with the other offer urls, so that the next payloads for this gtin come with it
+    helpers.offers.publish_new_offer_urls(gtin, {offer_source: product_page_url})
+
+    backend = helpers.cache.get_backend()
+    if backend is not None:
+        backend.set(f'kuantokusta:product_url:{gtin_to_ean(gtin)}', product_page_url, PRODUCT_URL_CACHE_TTL_SECONDS)
 
 
 def parse_results_page(soup: BeautifulSoup) -> str:
@@ -77,7 +145,7 @@ def parse_results_page(soup: BeautifulSoup) -> str:
     return f'{root_url}{product_url}'
 
 
-def parse_results_page_with_unique_retailer(soup: BeautifulSoup) -> Offer:
+def parse_results_page_with_unique_retailer(soup: BeautifulSoup) -> Optional[Offer]:
     """
     There are special cases where only one retailer has that product in its offer, where the price aggregator will no
     longer redirect to its product page, but it would directly redirect to that unique retailer.
@@ -91,28 +159,24 @@ def parse_results_page_with_unique_retailer(soup: BeautifulSoup) -> Offer:
     product_name = product_element.find('h2', itemprop='name').text.strip()
     price = int(float(product_element.find('a', class_='product-item-price')['data-max-price-raw']) * 100)
 
-    return {
-        'offer_source': 'kuantokusta_PT',
-        'offer_url': offer_url,
-        'retail_prod_name': product_name,
-        'retailer_name': retailer_name,
-        'country': 'PT',
-        'price': price,
-        'currency': 'eur',
-        'stock_status': 'unknown',
-        'metadata': None
-    }
+    return Offer.create_or_none(
+        offer_source=offer_source,
+        offer_url=offer_url,
+        retail_prod_name=product_name,
+        retailer_name=retailer_name,
+        country='PT',
+        price=price,
+        currency='eur',
+        stock_status='unknown',
+        metadata=None
+    )
 
 
 def parse_product_page(soup: BeautifulSoup) -> list[Offer]:
     product_json_element = soup.find('script', id='__NEXT_DATA__', type='application/json')
-    offers = parse_product_page_by_json(product_json_element) if product_json_element is not None \
+    return parse_product_page_by_json(product_json_element) if product_json_element is not None \
         else parse_product_page_by_schema_org(soup)
 
-    # Sometimes this website displays offers without actual link to them, and this generates errors later in the
-    # search process. So we choose to filter them out right away.
-    return [o for o in offers if o['offer_url'] is not None]
-
 
 def parse_product_page_by_json(product_json_element: Tag) -> list[Offer]:
     product_json = product_json_element.text
@@ -133,17 +197,30 @@ def parse_product_page_by_json(product_json_element: Tag) -> list[Offer]:
         'specs': specs
     }
 
-    return [{
-        'offer_source': 'kuantokusta_PT',
-        'offer_url': o['businessRules']['cpc']['url'],
-        'retail_prod_name': o['productName'],
-        'retailer_name': o['storeName'],
-        'country': 'PT',
-        'price': round(float(o['price']) * 100),
-        'currency': 'eur',
-        'stock_status': 'unknown',
-        'metadata': json.dumps(metadata)
-    } for o in product['offers']]
+    metadata_json = json.dumps(metadata)
+
+    result: list[Offer] = []
+    for o in product['offers']:
+        # Sometimes this website displays offers without actual link to them, and this generates errors later in the
+        # search process. So we choose to filter them out right away.
+        if o['businessRules']['cpc']['url'] is None:
+            continue
+
+        offer = Offer.create_or_none(
+            offer_source=offer_source,
+            offer_url=o['businessRules']['cpc']['url'],
+            retail_prod_name=o['productName'],
+            retailer_name=o['storeName'],
+            country='PT',
+            price=round(float(o['price']) * 100),
+            currency='eur',
+            stock_status='unknown',
+            metadata=metadata_json
+        )
+        if offer is not None:
+            result.append(offer)
+
+    return result
 
 
 def parse_product_page_by_schema_org(soup: BeautifulSoup) -> list[Offer]:
@@ -162,18 +239,19 @@ def parse_product_page_by_schema_org(soup: BeautifulSoup) -> list[Offer]:
         retailer_name: str = offer_element.find('div', itemtype='http://schema.org/Organization')\
             .find('meta', itemprop='name')['content']
 
-        offer: Offer = {
-            'offer_source': 'kuantokusta_PT',
-            'offer_url': f'{root_url}/follow/products/{product_id}/offers/{retailer_id}',
-            'retail_prod_name': offer_element.find('p', itemprop='alternateName').text,
-            'retailer_name': retailer_name,
-            'country': 'PT',
-            'price': round(float(offer_element.find('meta', itemprop='price')['content']) * 100),
-            'currency': 'eur',
-            'stock_status': 'unknown',
-            'metadata': metadata
-        }
-        result.append(offer)
+        offer = Offer.create_or_none(
+            offer_source=offer_source,
+            offer_url=f'{root_url}/follow/products/{product_id}/offers/{retailer_id}',
+            retail_prod_name=offer_element.find('p', itemprop='alternateName').text,
+            retailer_name=retailer_name,
+            country='PT',
+            price=round(float(offer_element.find('meta', itemprop='price')['content']) * 100),
+            currency='eur',
+            stock_status='unknown',
+            metadata=metadata
+        )
+        if offer is not None:
+            result.append(offer)
 
     return result
 
@@ -217,7 +295,9 @@ def _parse_product_page_by_html(soup: BeautifulSoup) -> list[Offer]:
 
     NOT USED !!!
     This method looks at the html, but after that we found, a json with all the details we need
-    This method is left here as a starting point in case the JSON disappears in the future
+    This method is left here as a starting point in case the JSON disappears in the future.
+
+    It gives no offers as is: the retailer name isn't parsed, and an Offer needs a non-empty one.
     """
 
     # we avoided using the class because it looks like compiled / obfuscated so it might change with a new version
@@ -237,19 +317,19 @@ def _parse_product_page_by_html(soup: BeautifulSoup) -> list[Offer]:
 
         offer_name = text_element.string
 
-        offer: Offer = {
-            'offer_source': 'kuantokusta_PT',
-            'offer_url': element['href'],
-            'retail_prod_name': offer_name,
-            'retailer_name': '',  # TODO: parse retailer name
-            'country': 'pt',
-            'price': round(extract_price(element) * 100),
-            'currency': 'eur',
-            'stock_status': 'unknown',
-            'metadata': None
-        }
-
-        result.append(offer)
+        offer = Offer.create_or_none(
+            offer_source='kuantokusta_PT',
+            offer_url=element['href'],
+            retail_prod_name=offer_name,
+            retailer_name='',  # TODO: parse retailer name
+            country='pt',
+            price=round(extract_price(element) * 100),
+            currency='eur',
+            stock_status='unknown',
+            metadata=None
+        )
+        if offer is not None:
+            result.append(offer)
 
     return result
 
@@ -2,7 +2,11 @@ import random
 import time
 import requests
 
-from sherlock_offer_scrapers.helpers.requests import SessionWithLogger
+from sherlock_offer_scrapers.helpers.requests import (
+    DEFAULT_RETRY_POLICY,
+    SessionWithLogger,
+    send_with_retries,
+)
 
 from . import user_agents
 
@@ -16,7 +20,7 @@ BASE_URL = {
 def create_session(country: str):
     headers = _get_headers(country)
     # session = requests.Session()
-    session = SessionWithLogger()
+    session = SessionWithLogger(country=country)
     session.headers.update(headers)
     return session
 
@@ -35,7 +39,7 @@ def get_header_authority(country: str) -> str:
 
 
 def make_request(url, session):
-    response = session.get(url)
+    response = _get_with_retries(url, session)
 
     # Check if we wasn't able to acces the content because Pricerunner blocker our IP
     if response.status_code == 403:
@@ -45,7 +49,7 @@ def make_request(url, session):
         time.sleep(0.25)
         # fetch the data api again
 
-        response = session.get(url)
+        response = _get_with_retries(url, session)
         # check 403 again
         if response.status_code == 403:
             print("They still block us")
@@ -61,6 +65,15 @@ def make_request(url, session):
     return response
 
 
+def _get_with_retries(url, session):
+    return send_with_retries(
+        lambda timeout: session.get(url, timeout=timeout),
+        "GET",
+        url,
+        DEFAULT_RETRY_POLICY,
+    )
+
+
 def pause_execution_random(min_sec=1, max_sec=300):
     rand_duration = random.randint(min_sec, max_sec)
     print("Pause for " + str(rand_duration) + "s")
@@ -1,3 +1,4 @@
+from sherlock_offer_scrapers.helpers import tracing
 from sherlock_offer_scrapers.helpers.offers import Offer
 from . import common
 from .common import BASE_URL, make_request, pause_execution_random, create_session
@@ -23,7 +24,10 @@ def get_offers(product_page_url: str, country: str) -> list[Offer]:
         print(f"status code: {response.status_code} when requesting to {offer_url}")
         return []
     else:
-        return _parse_offers(response.json(), country)
+        with tracing.span("parse-offers", country=country) as parse_span:
+            offers = _parse_offers(response.json(), country)
+            parse_span.set_attribute("offer_count", len(offers))
+        return offers
 
 
 def _get_offer_api_url(product_url: str, country: str) -> str:
@@ -42,18 +46,19 @@ def _parse_offers(json_result: dict, country: str) -> list[Offer]:
         offer_url = _extract_full_offer_url(offer_info["url"], country)
         price = _extract_price(merchant_offer["price"]["amount"])
         stock_status = _extract_stock_status(offer_info["stockStatus"])
-        offer: Offer = {
-            "offer_source": f"pricerunner_{country}",
-            "offer_url": offer_url,
-            "retail_prod_name": retail_prod_name,
-            "retailer_name": merchants[merchant_offer["merchantId"]]["name"],
-            "country": country,
-            "price": price,
-            "currency": merchant_offer["price"]["currency"],
-            "stock_status": stock_status,
-            "metadata": None,
-        }
-        offers.append(offer)
+        offer = Offer.create_or_none(
+            offer_source=f"pricerunner_{country}",
+            offer_url=offer_url,
+            retail_prod_name=retail_prod_name,
+            retailer_name=merchants[merchant_offer["merchantId"]]["name"],
+            country=country,
+            price=price,
+            currency=merchant_offer["price"]["currency"],
+            stock_status=stock_status,
+            metadata=None,
+        )
+        if offer is not None:
+            offers.append(offer)
 
     return offers
 
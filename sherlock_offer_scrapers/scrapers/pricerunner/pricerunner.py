@@ -1,6 +1,7 @@
 from typing import Optional
 
 
+from sherlock_offer_scrapers.helpers import tracing
 from sherlock_offer_scrapers.helpers.offers import Offer
 from . import gtin_searcher, offer_scraper
 
@@ -30,7 +31,11 @@ def scrape(gtin, cached_offer_urls: Optional[dict]) -> list[Offer]:
             print("No product found for gtin", gtin, "in country", country)
             continue
 
-        offers = offer_scraper.get_offers(url_path, country)
+        with tracing.span(
+            "fetch-offers", offer_source="pricerunner", country=country, url=url_path
+        ) as fetch_span:
+            offers = offer_scraper.get_offers(url_path, country)
+            fetch_span.set_attribute("offer_count", len(offers))
         all_offers.extend(offers)
 
     return all_offers
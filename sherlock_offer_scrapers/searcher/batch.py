@@ -0,0 +1,196 @@
+"""Search many products on Google Shopping with several processes.
+
+Parsing the search, product and retailer pages is CPU-bound, so a single
+process is limited to one core whatever the number of threads. `run_sharded()`
+runs the searches in worker processes instead, each with its own HTTP
+connections and its own copy of the caches of `GoogleShoppingSearcher`.
+
+All the searches of a product go to the same worker, whatever the country, so
+that the product pages it has already visited are in the cache of the worker.
+The workers send back the entries they have added to the caches, and the
+coordinator merges them in its own caches: only the coordinator writes them to
+disk.
+
+The products can also be split between several tasks of a Cloud Batch job
+with `select_shard()`, each task searching its own shard. The results of the
+shards are then merged with `merge_results()` before being saved.
+"""
+
+import concurrent.futures
+import csv
+import hashlib
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from structlog import get_logger
+
+from sherlock_offer_scrapers.persistence.sink import ProductSearchResult
+from sherlock_offer_scrapers.searcher.generic import normalise_gtin14
+from sherlock_offer_scrapers.searcher.google_shopping import GoogleShoppingSearcher
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class SearchTask:
+    sku: str
+    gtin: str
+    name: str
+    brand: str
+    country: str
+
+
+@dataclass
+class SearchResult:
+    task: SearchTask
+    product_id: Optional[str] = None
+    error: Optional[str] = None
+    # Entries added to the caches of the searcher by the search
+    id_to_gtin_cache: dict = field(default_factory=dict)
+    products_without_gtin: set = field(default_factory=set)
+    ad_links: set = field(default_factory=set)
+
+
+def shard_of(key: str, nb_shards: int) -> int:
+    """Shard of `key`, the same in every process and on every run."""
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % nb_shards
+
+
+def shard_name(shard_index: int, shard_count: int) -> str:
+    return f"shard-{shard_index}-of-{shard_count}"
+
+
+def select_shard(
+    items: Iterable[T], key: Callable[[T], str], shard_index: int, shard_count: int
+) -> list[T]:
+    """The `items` of the shard `shard_index`, out of `shard_count` shards.
+
+    Every item is in exactly one shard, always the same for the same key.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}")
+    return [item for item in items if shard_of(key(item), shard_count) == shard_index]
+
+
+def read_results(path: str) -> list[ProductSearchResult]:
+    """The products found by a run, from its `products_results.csv`."""
+    product_results = []
+    with open(path) as results_file:
+        csv_reader = csv.reader(results_file)
+        for row in csv_reader:
+            if len(row) < 3 or not row[2]:
+                continue  # if we don't have an id now, we don't save it to the db
+
+            product_results.append(
+                ProductSearchResult(
+                    sku=row[0],
+                    gtin=row[1],
+                    url=row[2],
+                )
+            )
+    return product_results
+
+
+def merge_results(
+    results_per_shard: Iterable[list[ProductSearchResult]],
+) -> list[ProductSearchResult]:
+    """The results of all the shards, each product id once per product."""
+    merged: dict[tuple[Optional[str], Optional[str], str], ProductSearchResult] = {}
+    for results in results_per_shard:
+        for result in results:
+            merged.setdefault((result.sku, result.gtin, result.url), result)
+    return list(merged.values())
+
+
+def search(searcher: GoogleShoppingSearcher, task: SearchTask) -> Optional[str]:
+    return searcher.find_product_id(
+        name=task.name,
+        gtin=normalise_gtin14(task.gtin),
+        sku=task.sku,
+        country=task.country,
+        brand=task.brand,
+    )
+
+
+def run_sharded(
+    tasks: Iterable[SearchTask],
+    searcher: GoogleShoppingSearcher,
+    processes: int,
+    on_result: Callable[[SearchResult], None],
+) -> None:
+    """Run the `tasks` in `processes` worker processes, starting from the
+    caches of `searcher`, and call `on_result` in this process as soon as each
+    task is done, after merging its cache entries into `searcher`.
+    """
+    # One process per executor, to choose the process of each task
+    executors = [
+        concurrent.futures.ProcessPoolExecutor(
+            max_workers=1,
+            initializer=_init_worker,
+            initargs=(searcher.id_to_gtin_cache, searcher.products_without_gtin),
+        )
+        for _ in range(processes)
+    ]
+    try:
+        futures = {}
+        for task in tasks:
+            # By product, see the module docstring. Salted, otherwise all the
+            # products of a Cloud Batch shard would go to the same process.
+            process = shard_of(f"process:{task.gtin or task.sku}", processes)
+            executor = executors[process]
+            futures[executor.submit(_run_task, task)] = task
+
+        for result in _results(futures):
+            searcher.id_to_gtin_cache.update(result.id_to_gtin_cache)
+            searcher.products_without_gtin.update(result.products_without_gtin)
+            searcher.ad_links.update(result.ad_links)
+            on_result(result)
+    finally:
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+
+
+def _results(futures: dict) -> Iterator[SearchResult]:
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            yield future.result()
+        except Exception as ex:
+            # The worker died (e.g. out of memory), its other tasks fail too
+            yield SearchResult(task=futures[future], error=repr(ex))
+
+
+_searcher: Optional[GoogleShoppingSearcher] = None
+
+
+def _init_worker(id_to_gtin_cache: dict, products_without_gtin: set) -> None:
+    global _searcher
+    _searcher = GoogleShoppingSearcher()
+    _searcher.id_to_gtin_cache.update(id_to_gtin_cache)
+    _searcher.products_without_gtin.update(products_without_gtin)
+
+
+def _run_task(task: SearchTask) -> SearchResult:
+    assert _searcher is not None
+    id_to_gtin_cache = dict(_searcher.id_to_gtin_cache)
+    products_without_gtin = set(_searcher.products_without_gtin)
+    ad_links = set(_searcher.ad_links)
+
+    result = SearchResult(task=task)
+    try:
+        result.product_id = search(_searcher, task)
+    except Exception as ex:
+        result.error = str(ex)
+
+    result.id_to_gtin_cache = {
+        product_id: gtin
+        for product_id, gtin in _searcher.id_to_gtin_cache.items()
+        if id_to_gtin_cache.get(product_id) != gtin
+    }
+    result.products_without_gtin = (
+        _searcher.products_without_gtin - products_without_gtin
+    )
+    result.ad_links = _searcher.ad_links - ad_links
+    return result
@@ -0,0 +1,181 @@
+"""Rank the products of a Google Shopping search before visiting them.
+
+Visiting a candidate costs its product page and the pages of its retailers,
+so `GoogleShoppingSearcher.find_product_id()` visits the most promising ones
+first, and skips the ones that don't look like the product. The ranking only
+uses what is already on the search page:
+
+- the similarity of the title of the candidate to the name and brand searched,
+- its price, compared to the prices of the other candidates: the accessories
+  and spare parts of a product are much cheaper than the product itself,
+- its number of merchants, as more offers give more chances to find the GTIN,
+- the product ids whose GTIN is already known, which cost nothing to check.
+
+When the cards of the search page can't be parsed, e.g. after a change of
+layout, all the candidates rank the same, and are visited in page order.
+"""
+
+import math
+import os
+import re
+import statistics
+import unicodedata
+from dataclasses import dataclass
+from typing import Optional
+
+from bs4 import BeautifulSoup, Tag
+
+from sherlock_offer_scrapers import helpers
+from sherlock_offer_scrapers.searcher.generic import normalise_gtin14
+
+# Skip the candidates scored lower than this, once at least
+# MIN_CANDIDATES_VISITED have been visited. A candidate whose title has all the
+# words of the name searched scores at least 1, and 0 with none of them.
+MIN_SCORE = float(os.environ.get("CANDIDATE_MIN_SCORE", 0.5))
+MIN_CANDIDATES_VISITED = int(os.environ.get("CANDIDATE_MIN_VISITED", 3))
+
+# Cheaper than this fraction of the median price of the candidates: likely an
+# accessory, a spare part or a sample of the product
+LOW_PRICE_RATIO = 1 / 3
+
+# The number of merchants above which more merchants don't rank higher
+MANY_MERCHANTS = 20
+
+# Classes of the result cards of the search page, in the grid and list layouts
+CARD_CLASSES = ["sh-dgr__content", "sh-dgr__grid-result", "sh-dlr__list-result"]
+TITLE_SELECTOR = "h3, h4"
+PRICE_SELECTOR = "span.a8Pemb"
+
+_merchants_regex = re.compile(r"(\d+)\+?\s*(?:stores|shops|sellers)", re.IGNORECASE)
+_word_regex = re.compile(r"\w+")
+
+
+@dataclass
+class Candidate:
+    product_id: str
+    title: Optional[str] = None
+    # In cents, in the currency of the country
+    price: Optional[int] = None
+    nb_merchants: Optional[int] = None
+    # Set by `rank()`, None when the title is unknown
+    title_similarity: Optional[float] = None
+    score: float = 0.0
+
+
+def parse_candidates(soup: BeautifulSoup, country: str, limit: int) -> list[Candidate]:
+    """The first `limit` products of the search page, in page order."""
+    candidates = {}
+    for a in soup.select("a.Lq5OHe"):
+        # Only consider links to google shopping products. Ignore links directly to seller websites.
+        href = str(a["href"])
+        if "/shopping/product/" not in href:
+            continue
+        # /shopping/product/2336121681419728525?q=05400653007411&hl=en&... -> 2336121681419728525
+        product_id = href.split("/shopping/product/")[1].split("?")[0]
+        if product_id in candidates:
+            continue
+
+        candidates[product_id] = _parse_card(product_id, a, country)
+        if len(candidates) == limit:
+            break
+
+    return list(candidates.values())
+
+
+def _parse_card(product_id: str, a: Tag, country: str) -> Candidate:
+    card = a.find_parent("div", class_=CARD_CLASSES)
+    if not isinstance(card, Tag):
+        card = a.parent or a
+    candidate = Candidate(product_id)
+
+    title = card.select_one(TITLE_SELECTOR) or a
+    candidate.title = title.get_text(" ", strip=True) or None
+
+    price = card.select_one(PRICE_SELECTOR)
+    if price is not None:
+        try:
+            parsed_price = helpers.prices.parse_price(
+                price.get_text(strip=True), country
+            )
+        except ValueError:
+            parsed_price = None
+        if parsed_price is not None:
+            candidate.price = parsed_price[0]
+
+    merchants = _merchants_regex.search(card.get_text(" ", strip=True))
+    if merchants is not None:
+        candidate.nb_merchants = int(merchants.group(1))
+
+    return candidate
+
+
+def rank(
+    candidates: list[Candidate],
+    name: str,
+    brand: str,
+    gtin: Optional[str],
+    id_to_gtin_cache: dict,
+) -> list[Candidate]:
+    """The `candidates` ordered from the most to the least promising."""
+    prices = [c.price for c in candidates if c.price is not None]
+    median_price = statistics.median(prices) if prices else None
+
+    for candidate in candidates:
+        known_gtin = id_to_gtin_cache.get(candidate.product_id)
+        if known_gtin is not None and gtin is not None:
+            if normalise_gtin14(known_gtin) == normalise_gtin14(gtin):
+                candidate.score = math.inf
+            else:
+                candidate.score = -math.inf
+            continue
+
+        candidate.title_similarity = (
+            title_similarity(candidate.title, name, brand)
+            if candidate.title is not None
+            else None
+        )
+        candidate.score = (
+            candidate.title_similarity
+            if candidate.title_similarity is not None
+            else MIN_SCORE
+        )
+        if candidate.nb_merchants is not None:
+            candidate.score += 0.2 * min(
+                math.log1p(candidate.nb_merchants) / math.log1p(MANY_MERCHANTS), 1
+            )
+        if (
+            median_price is not None
+            and candidate.price is not None
+            and candidate.price < LOW_PRICE_RATIO * median_price
+        ):
+            candidate.score -= 0.3
+
+    # Stable: the candidates that rank the same stay in page order
+    return sorted(candidates, key=lambda c: c.score, reverse=True)
+
+
+def title_similarity(title: str, name: str, brand: str) -> float:
+    """Share of the words of the name and brand found in the title, from 0 to 1."""
+    expected_words = _words(f"{brand} {name}")
+    if not expected_words:
+        return 1.0
+    return len(expected_words & _words(title)) / len(expected_words)
+
+
+def is_worth_visiting(candidate: Candidate, nb_visited: int) -> bool:
+    """Whether to visit the `candidate`, ranked by `rank()`, once `nb_visited`
+    candidates have been visited."""
+    if candidate.score == -math.inf:
+        # Already known to be another product
+        return False
+    if nb_visited < MIN_CANDIDATES_VISITED or candidate.score == math.inf:
+        return True
+    # Without a title, the score says too little to skip it
+    return candidate.title_similarity is None or candidate.score >= MIN_SCORE
+
+
+def _words(text: str) -> set[str]:
+    # "Fåtölj" and "Fatolj" are the same word
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return set(_word_regex.findall(text))
@@ -1,14 +1,16 @@
 import asyncio
+import concurrent.futures
 import csv
 import functools
 import os
+import queue
+import threading
 import time
 import urllib.parse
-from typing import Optional, Tuple
+from typing import Any, Callable, Optional, Tuple
 
 import requests.exceptions
 from bs4 import BeautifulSoup
-from requests.exceptions import ProxyError
 from structlog import get_logger
 from tqdm import tqdm
 
@@ -17,6 +19,7 @@ from sherlock_offer_scrapers.scrapers.google_shopping import (
     user_agents,
     uule_of_country,
 )
+from sherlock_offer_scrapers.searcher import candidates
 from sherlock_offer_scrapers.searcher.generic import (
     find_gtin_from_retailer_url,
     normalise_gtin14,
@@ -24,6 +27,13 @@ from sherlock_offer_scrapers.searcher.generic import (
 
 logger = get_logger()
 
+# In a hedged multi-market search, start searching the next market once the
+# current one has run for this long, or has visited this many candidates
+HEDGE_AFTER_SECONDS = float(os.environ.get("GOOGLE_SHOPPING_HEDGE_AFTER_SECONDS", 20))
+HEDGE_AFTER_CANDIDATES = int(
+    os.environ.get("GOOGLE_SHOPPING_HEDGE_AFTER_CANDIDATES", 4)
+)
+
 
 class ScrapingSpeedException(Exception):
     pass
@@ -43,11 +53,26 @@ class GoogleShoppingSearcher:
     search_proxy_country = "SE"
     product_proxy_country = "SE"
 
+    # Only retry connection errors (e.g. the proxy refusing the connection).
+    # A 429 is handled by the caller as a signal to slow down instead.
+    PROXY_ERROR_RETRY_POLICY = helpers.requests.RetryPolicy(
+        max_attempts=4, backoff_base_seconds=1, retry_on_status=frozenset()
+    )
+
     GOOGLE_SHOPPING_COOKIES = {
         "SOCS": "CAESNQgCEitib3FfaWRlbnRpdHlmcm9udGVuZHVpc2VydmVyXzIwMjQwMTAyLjA1X3AwGgJlbiACGgYIgI3drAY",
         "CONSENT": "PENDING+105",
     }
 
+    def __init__(self):
+        # So that the markets searched at the same time don't fetch the same
+        # candidate twice, see `search_for_gtin()`
+        self._candidate_locks: dict[str, threading.Lock] = {}
+        self._candidate_locks_lock = threading.Lock()
+        # Searches of the markets that lost a hedged search, still finishing
+        # their current candidate, see `wait_for_background_searches()`
+        self._background_searches: list[concurrent.futures.Future] = []
+
     def find_gtin_from_gs_url(
         self, offer_url: str, expected_gtin: Optional[str], expected_sku: Optional[str]
     ):
@@ -186,6 +211,15 @@ class GoogleShoppingSearcher:
 
     def search_for_gtin(
         self, product_id: str, search_gtin: str, search_sku: str, country: str
+    ) -> Tuple[str, Optional[str]]:
+        # Wait for another market resolving the same candidate, then use its gtin
+        with self._candidate_locks_lock:
+            lock = self._candidate_locks.setdefault(product_id, threading.Lock())
+        with lock:
+            return self._search_for_gtin(product_id, search_gtin, search_sku, country)
+
+    def _search_for_gtin(
+        self, product_id: str, search_gtin: str, search_sku: str, country: str
     ) -> Tuple[str, Optional[str]]:
         if product_id in self.id_to_gtin_cache:
             gtin_for_product = self.id_to_gtin_cache[product_id]
@@ -213,7 +247,6 @@ class GoogleShoppingSearcher:
         expected_gtin: Optional[str] = None,
         expected_sku: Optional[str] = None,
         known_variant_products=None,
-        retry_ttl=3,
     ) -> Tuple[str, Optional[str]]:
         if known_variant_products is None:
             known_variant_products = []
@@ -233,18 +266,10 @@ class GoogleShoppingSearcher:
                 headers={"User-Agent": user_agents.choose_random()},
                 cookies=self.GOOGLE_SHOPPING_COOKIES,
                 proxy_country=self.product_proxy_country,
-            )
-        except ProxyError as e:
-            logger.warning("Proxy error encountered, will retry")
-            time.sleep(2 ** (3 - retry_ttl))
-            return self.search_for_gtin_within_variants(
-                product_id,
-                country,
-                expected_gtin,
-                known_variant_products,
-                retry_ttl=retry_ttl - 1,
+                retry_policy=self.PROXY_ERROR_RETRY_POLICY,
             )
         except requests.RequestException as e:
+            logger.warning("Requests error encountered", exception=str(e))
             return product_id, None
 
         html = resp.text
@@ -273,6 +298,7 @@ class GoogleShoppingSearcher:
                 variant_id,
                 country,
                 expected_gtin,
+                expected_sku,
                 known_variant_products=known_variant_products
                 + sub_variant_product_list,
             )
@@ -289,10 +315,22 @@ class GoogleShoppingSearcher:
         sku: Optional[str],
         countries=None,
         brand: str = "GUBI",
+        hedged: bool = False,
     ) -> Optional[str]:
+        """
+        Search the markets one after the other, and stop at the first one where the product is found.
+
+        With `hedged`, the search of the next market starts without waiting for the current one to finish, once it
+        has run for `HEDGE_AFTER_SECONDS` or visited `HEDGE_AFTER_CANDIDATES` candidates. The first market to find
+        the product stops the others. They keep writing to the caches of the searcher until the end of their current
+        candidate: call `wait_for_background_searches()` before reading the caches.
+        """
         if countries is None:
             countries = ["DK", "SE", "DE"]
 
+        if hedged:
+            return self._find_product_id_hedged(name, gtin, sku, countries, brand)
+
         for country in tqdm(countries, desc="Markets"):
             id_in_country = self.find_product_id(name, gtin, sku, country, brand)
 
@@ -301,6 +339,101 @@ class GoogleShoppingSearcher:
 
         return None
 
+    def _find_product_id_hedged(
+        self,
+        name: str,
+        gtin: Optional[str],
+        sku: Optional[str],
+        countries: list[str],
+        brand: str,
+    ) -> Optional[str]:
+        # (country, number of candidates visited, None) while searching, then
+        # (country, product id or exception, True) when done
+        events: "queue.Queue[tuple[str, Any, Optional[bool]]]" = queue.Queue()
+        stop = threading.Event()
+
+        def search_market(country: str):
+            # The offers of a candidate are fetched with the event loop of the thread
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                product_id = self.find_product_id(
+                    name,
+                    gtin,
+                    sku,
+                    country,
+                    brand,
+                    stop=stop,
+                    on_visited=lambda count: events.put((country, count, None)),
+                )
+                events.put((country, product_id, True))
+            except Exception as ex:
+                events.put((country, ex, True))
+            finally:
+                loop.close()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(countries))
+        pending = list(countries)
+        running = set()
+        last_started = None
+        last_started_at = 0.0
+
+        def start_next_market():
+            nonlocal last_started, last_started_at
+            last_started = pending.pop(0)
+            last_started_at = time.monotonic()
+            running.add(last_started)
+            self._background_searches = [
+                future for future in self._background_searches if not future.done()
+            ]
+            self._background_searches.append(
+                executor.submit(search_market, last_started)
+            )
+
+        start_next_market()
+        try:
+            while running:
+                timeout = None
+                if pending:
+                    elapsed = time.monotonic() - last_started_at
+                    timeout = max(0.0, HEDGE_AFTER_SECONDS - elapsed)
+                try:
+                    country, value, done = events.get(timeout=timeout)
+                except queue.Empty:
+                    logger.info("Hedging slow market", country=last_started)
+                    start_next_market()
+                    continue
+
+                if not done:
+                    if (
+                        country == last_started
+                        and value >= HEDGE_AFTER_CANDIDATES
+                        and pending
+                    ):
+                        logger.info("Hedging market", country=country, visited=value)
+                        start_next_market()
+                    continue
+
+                running.discard(country)
+                if isinstance(value, Exception):
+                    raise value
+                if value is not None:
+                    logger.info("Found in market", country=country, product_id=value)
+                    return value
+                if country == last_started and pending:
+                    start_next_market()
+
+            return None
+        finally:
+            # The other markets stop before their next candidate
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def wait_for_background_searches(self) -> None:
+        """Wait for the markets that lost a hedged search to stop."""
+        concurrent.futures.wait(self._background_searches)
+        self._background_searches = []
+
     def find_product_id(
         self,
         name: str,
@@ -308,12 +441,17 @@ class GoogleShoppingSearcher:
         sku: Optional[str],
         country: str = "se",
         brand: str = "GUBI",
+        stop: Optional[threading.Event] = None,
+        on_visited: Optional[Callable[[int], None]] = None,
     ) -> Optional[str]:
         """
         Find product_id of a google shopping product based on name and GTIN.
 
         The idea is to go through all the google shopping products that are returned when searching for the name and match
         them based on the GTIN we extract from one of the offers
+
+        The search gives up before the next candidate once `stop` is set, and calls `on_visited` with the number of
+        candidates visited so far after each of them.
         """
 
         if not gtin and not sku:
@@ -334,14 +472,14 @@ class GoogleShoppingSearcher:
             logger.warning("Requests error encountered", exception=str(ex))
             return None
 
-        all_a_tags = soup.select("a.Lq5OHe")
-        # Only consider links to google shopping products. Ignore links directly to seller websites.
-        product_a_tags = [a for a in all_a_tags if "/shopping/product/" in a["href"]]
-        possible_product_ids = [
-            a["href"].split("/shopping/product/")[1].split("?")[0]
-            for a in product_a_tags
-            # /shopping/product/2336121681419728525?q=05400653007411&hl=en&... -> 2336121681419728525
-        ][:12]
+        # The most promising candidates first, see `searcher.candidates`
+        possible_products = candidates.rank(
+            candidates.parse_candidates(soup, country, limit=12),
+            main_name,
+            brand,
+            gtin,
+            self.id_to_gtin_cache,
+        )
 
         ad_tags = soup.find_all("a", attrs={"data-offer-id": True})
         current_ad_links = [
@@ -357,56 +495,69 @@ class GoogleShoppingSearcher:
         self.ad_links.update(current_ad_links)
 
         visited_product_pages_count = 0
-        for possible_product_id in tqdm(
-            possible_product_ids, "Google Shopping products"
-        ):
+        skipped_candidates_count = 0
+        for possible_product in tqdm(possible_products, "Google Shopping products"):
+            if stop is not None and stop.is_set():
+                break
+            if not candidates.is_worth_visiting(
+                possible_product, visited_product_pages_count
+            ):
+                skipped_candidates_count += 1
+                continue
+
             variant_id, found_gtin = self.search_for_gtin(
-                possible_product_id, gtin, sku, country
+                possible_product.product_id, gtin, sku, country
             )
             visited_product_pages_count += 1
+            if on_visited is not None:
+                on_visited(visited_product_pages_count)
 
             if found_gtin:
                 logger.info(
                     "Visited product pages",
                     visited_product_pages_count=visited_product_pages_count,
+                    skipped_candidates_count=skipped_candidates_count,
                 )
                 return variant_id
 
         logger.info(
             "Visited product pages",
             visited_product_pages_count=visited_product_pages_count,
+            skipped_candidates_count=skipped_candidates_count,
         )
         return None
 
-    def load_from_disk(self):
-        if os.path.exists("output/id_to_gtin_cache.csv"):
-            with open("output/id_to_gtin_cache.csv", "r") as f:
+    def load_from_disk(self, output_dir: str = "output"):
+        if os.path.exists(os.path.join(output_dir, "id_to_gtin_cache.csv")):
+            with open(os.path.join(output_dir, "id_to_gtin_cache.csv"), "r") as f:
                 csv_reader = csv.reader(f)
                 next(csv_reader)
                 for row in csv_reader:
                     self.id_to_gtin_cache[row[0]] = row[1]
 
-        if os.path.exists("output/products_without_gtin.csv"):
-            with open("output/products_without_gtin.csv", "r") as f:
+        if os.path.exists(os.path.join(output_dir, "products_without_gtin.csv")):
+            with open(os.path.join(output_dir, "products_without_gtin.csv"), "r") as f:
                 csv_reader = csv.reader(f)
                 next(csv_reader)
                 for row in csv_reader:
                     self.products_without_gtin.add((row[0], row[1]))
 
-    def save_to_disk(self):
+    def save_to_disk(self, output_dir: str = "output"):
+        self.wait_for_background_searches()
+
         # Save id_to_gtin_cache to a csv file
-        with open("output/id_to_gtin_cache.csv", "w") as f:
+        with open(os.path.join(output_dir, "id_to_gtin_cache.csv"), "w") as f:
             f.write("product_id,gtin\n")
             for product_id, gtin in self.id_to_gtin_cache.items():
                 f.write(f"{product_id},{gtin}\n")
 
         # Save the products without a gtin
-        with open("output/products_without_gtin.csv", "w") as f:
+        with open(os.path.join(output_dir, "products_without_gtin.csv"), "w") as f:
             f.write("product_id\n")
             for product_id, country in self.products_without_gtin:
                 f.write(f"{product_id},{country}\n")
 
-        with open("output/ad_links.csv", "w") as f:
+        with open(os.path.join(output_dir, "ad_links.csv"), "w") as f:
             f.write("ad_link\n")
             for ad_link in self.ad_links:
                 f.write(f'{ad_link[0]},{ad_link[1]},"{ad_link[2]}"\n')
@@ -0,0 +1,24 @@
+import sqlite3
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import cache
+
+
+@pytest.mark.unit
+def test_sqlite_backend_deletes_expired_keys_on_write(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    backend = cache.SQLiteCacheBackend(path)
+    now = 1_800_000_000.0
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+
+    backend.set("page:1", "<html>1</html>", 60)
+    backend.add("claim:1", "1", 60)
+    backend.increment("credits:1", 5, 60)
+    now += 120
+    backend.set("page:2", "<html>2</html>", 60)
+
+    with sqlite3.connect(path) as conn:
+        keys = [key for key, in conn.execute("SELECT key FROM cache")]
+    assert keys == ["page:2"]
+    assert backend.get("page:2") == "<html>2</html>"
@@ -0,0 +1,73 @@
+import pytest
+
+from sherlock_offer_scrapers.helpers import cache, coalescing, deadline
+from sherlock_offer_scrapers.helpers.offers import Offer
+
+
+@pytest.fixture(autouse=True)
+def sqlite_backend(tmp_path):
+    backend = cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    cache.set_backend(backend)
+    deadline.clear()
+    yield backend
+    cache.set_backend(None)
+    deadline.clear()
+
+
+@pytest.mark.unit
+def test_key_does_not_depend_on_countries_order():
+    key_1 = coalescing.make_key("google_shopping", "123", None, ["SE", "FR"], {})
+    key_2 = coalescing.make_key("google_shopping", "123", None, ["FR", "SE"], {})
+    key_3 = coalescing.make_key("google_shopping", "123", None, ["SE"], {})
+
+    assert key_1 == key_2
+    assert key_1 != key_3
+
+
+@pytest.mark.unit
+def test_first_scrape_claims_then_shares_its_offers():
+    key = coalescing.make_key("idealo", "123", None, None, {})
+    offers = [
+        Offer(
+            offer_source="idealo_DE",
+            offer_url="https://example.com",
+            retail_prod_name="Panasonic Lumix DMC-LX15",
+            retailer_name="Retailer",
+            country="DE",
+            price=40000,
+            currency="EUR",
+            stock_status="in_stock",
+            metadata=None,
+        )
+    ]
+
+    assert coalescing.get_or_claim(key) == (None, True)
+
+    coalescing.store(key, offers)
+    coalescing.release(key)
+
+    assert coalescing.get_or_claim(key) == (offers, False)
+
+
+@pytest.mark.unit
+def test_duplicate_scrape_gives_up_waiting_in_time_to_scrape():
+    key = coalescing.make_key("idealo", "123", None, None, {})
+    assert coalescing.get_or_claim(key) == (None, True)
+
+    deadline.start(
+        timeout=deadline.SAFETY_MARGIN_SECONDS + coalescing.MIN_SCRAPE_SECONDS
+    )
+
+    # Without claiming: the first scrape is still running
+    assert coalescing.get_or_claim(key) == (None, False)
+    assert coalescing.get_or_claim(key) == (None, False)
+
+
+@pytest.mark.unit
+def test_nothing_is_cached_without_backend():
+    cache.set_backend(None)
+    key = coalescing.make_key("idealo", "123", None, None, {})
+
+    coalescing.store(key, [])
+
+    assert coalescing.get_or_claim(key) == (None, False)
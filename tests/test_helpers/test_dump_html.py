@@ -0,0 +1,72 @@
+import gzip
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import deadline, dump_html
+
+PAGE = '<html><div class="sh-osd__offer-row">{}</div></html>'
+OTHER_PAGE = '<html><div class="captcha">{}</div></html>'
+
+
+class FailingBackend(dump_html.DumpBackend):
+    def upload(self, path, data):
+        raise IOError("bucket not found")
+
+
+@pytest.fixture
+def dump_queue(tmp_path):
+    deadline.clear()
+    return dump_html.DumpQueue(dump_html.LocalDirBackend(str(tmp_path)), max_dumps=3)
+
+
+def read_dumps(tmp_path):
+    return {
+        str(path.relative_to(tmp_path)): gzip.decompress(path.read_bytes()).decode()
+        for path in tmp_path.rglob("*.html.gz")
+    }
+
+
+@pytest.mark.unit
+def test_dumps_are_uploaded_compressed(dump_queue, tmp_path):
+    assert dump_queue.put(PAGE.format("10 kr"), "google_shopping", "123", "SE")
+    assert dump_queue.flush()
+
+    variant = dump_html.page_variant_hash(PAGE)
+    assert read_dumps(tmp_path) == {
+        f"offer_scrapers_html/google_shopping/123_SE_{variant}.html.gz": PAGE.format(
+            "10 kr"
+        )
+    }
+
+
+@pytest.mark.unit
+def test_page_variants_are_dumped_once_per_product(dump_queue, tmp_path):
+    assert dump_queue.put(PAGE.format("10 kr"), "google_shopping", "123", "SE")
+    assert not dump_queue.put(PAGE.format("1 €"), "google_shopping", "123", "DE")
+    assert dump_queue.put(OTHER_PAGE.format(""), "google_shopping", "123", "DE")
+    assert dump_queue.put(PAGE.format("10 kr"), "google_shopping", "456", "SE")
+    dump_queue.flush()
+
+    assert len(read_dumps(tmp_path)) == 3
+
+
+@pytest.mark.unit
+def test_dumps_are_capped_per_invocation(dump_queue, tmp_path):
+    for gtin in ["1", "2", "3"]:
+        assert dump_queue.put(PAGE, "google_shopping", gtin, "SE")
+    assert not dump_queue.put(PAGE, "google_shopping", "4", "SE")
+
+    # The cap is reset for the next invocation
+    dump_queue.flush()
+    assert dump_queue.put(PAGE, "google_shopping", "4", "SE")
+    dump_queue.flush()
+
+    assert len(read_dumps(tmp_path)) == 4
+
+
+@pytest.mark.unit
+def test_failed_uploads_are_not_raised():
+    dump_queue = dump_html.DumpQueue(FailingBackend())
+
+    assert dump_queue.put(PAGE, "google_shopping", "123", "SE")
+    assert dump_queue.flush()
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import message_encoding
+
+METADATA = json.dumps(
+    {
+        "description": 'Compact camera with a "Leica" lens',
+        "images": ["https://example.com/image.jpg"],
+        "specs": {"General": {"Colour": "Black"}},
+    }
+)
+
+
+def make_message():
+    offers = [
+        {
+            "offer_source": "idealo",
+            "offer_url": f"https://example.com/offer/{i}",
+            "retail_prod_name": "Panasonic Lumix DMC-LX15",
+            "retailer_name": f"Retailer {i}",
+            "country": "DE",
+            "price": 40000 + i,
+            "currency": "EUR",
+            "stock_status": "in_stock",
+            "metadata": METADATA,
+        }
+        for i in range(5)
+    ]
+    offers[1]["metadata"] = None
+    offers[2]["metadata"] = "not json"
+
+    return {
+        "gtin": "00889842651393",
+        "offer_urls": {},
+        "triggered_by": {"source": "b2b_job"},
+        "offer_source": "idealo",
+        "offers": offers,
+    }
+
+
+@pytest.mark.unit
+def test_json_format_is_unchanged():
+    message = make_message()
+
+    data, attributes = message_encoding.encode(message, "json", "none")
+
+    assert data == json.dumps(message).encode("utf-8")
+    assert attributes == {}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("message_format", ["json", "compact"])
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_round_trip(message_format, compression):
+    message = make_message()
+
+    data, attributes = message_encoding.encode(message, message_format, compression)
+    decoded = message_encoding.decode(data, attributes)
+
+    assert decoded == message
+
+
+@pytest.mark.unit
+def test_compact_format_stores_metadata_once():
+    data, attributes = message_encoding.encode(make_message(), "compact", "none")
+    compact_message = json.loads(data)
+
+    assert attributes == {"format": "compact/1"}
+    assert compact_message["metadata"] == [json.loads(METADATA)]
+    assert [offer["metadata"] for offer in compact_message["offers"]] == [
+        0,
+        None,
+        "not json",
+        0,
+        0,
+    ]
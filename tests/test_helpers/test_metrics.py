@@ -0,0 +1,89 @@
+import gzip
+import http.server
+import threading
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import deadline, metrics
+from sherlock_offer_scrapers.helpers import requests as helpers_requests
+
+BODY = b"<html>" + b"offer " * 10000 + b"</html>"
+
+
+class GzipHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = gzip.compress(BODY)
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ListSink(metrics.MetricsSink):
+    def __init__(self):
+        self.recorded = []
+
+    def record_request(self, request_metrics):
+        self.recorded.append(request_metrics)
+
+
+class FailingSink(metrics.MetricsSink):
+    def record_request(self, request_metrics):
+        raise RuntimeError("exporter is down")
+
+
+@pytest.fixture
+def server_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), GzipHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline.clear()
+    yield f"http://127.0.0.1:{server.server_address[1]}/page"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sink():
+    sink = ListSink()
+    metrics.clear_sinks()
+    metrics.add_sink(sink)
+    yield sink
+    metrics.clear_sinks()
+
+
+@pytest.mark.unit
+def test_requests_are_measured(server_url, sink):
+    response = helpers_requests.get(server_url, offer_source_country="SE")
+
+    assert response.content == BODY
+    [request_metrics] = sink.recorded
+    assert request_metrics.host == "127.0.0.1"
+    assert request_metrics.country == "SE"
+    assert request_metrics.status_code == 200
+    assert request_metrics.attempts == 1
+    assert request_metrics.body_bytes == len(BODY)
+    assert request_metrics.wire_bytes == len(gzip.compress(BODY))
+    assert request_metrics.duration_ms >= request_metrics.ttfb_ms >= 0
+
+
+@pytest.mark.unit
+def test_session_records_its_country(server_url, sink):
+    response = helpers_requests.SessionWithLogger(country="DK").get(server_url)
+
+    assert response.status_code == 200
+    [request_metrics] = sink.recorded
+    assert request_metrics.country == "DK"
+
+
+@pytest.mark.unit
+def test_failing_sink_does_not_fail_the_request(server_url, sink):
+    metrics.add_sink(FailingSink())
+
+    response = helpers_requests.SessionWithLogger().get(server_url)
+
+    assert response.status_code == 200
+    assert len(sink.recorded) == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from sherlock_offer_scrapers.helpers.offers import Offer
+
+FIELDS = {
+    "offer_source": "idealo_DE",
+    "offer_url": "https://www.idealo.de/relocator/relocate?offerKey=1",
+    "retail_prod_name": "Panasonic Lumix DMC-LX15",
+    "retailer_name": "Cyberport",
+    "country": "DE",
+    "price": 49900,
+    "currency": "EUR",
+    "stock_status": "in_stock",
+    "metadata": None,
+}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("retailer_name", ""),
+        ("retail_prod_name", ""),
+        ("offer_url", None),
+        ("price", -1),
+        ("price", 0),
+        ("price", 499.0),
+        ("stock_status", "available"),
+    ],
+)
+def test_invalid_offers_are_rejected(name, value):
+    with pytest.raises(ValueError, match=name):
+        Offer(**{**FIELDS, name: value})
+
+
+@pytest.mark.unit
+def test_create_or_none_skips_invalid_offers():
+    assert Offer.create_or_none(**FIELDS) == Offer(**FIELDS)
+    assert Offer.create_or_none({"offer_id": "1"}, **{**FIELDS, "price": -1}) is None
@@ -0,0 +1,115 @@
+import pytest
+import requests
+
+from sherlock_offer_scrapers.helpers import cache, page_fingerprints
+from sherlock_offer_scrapers.helpers.offers import Offer
+
+URL = "https://www.idealo.de/preisvergleich/OffersOfProduct/5380100"
+
+
+@pytest.fixture(autouse=True)
+def sqlite_backend(tmp_path):
+    backend = cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    cache.set_backend(backend)
+    yield backend
+    cache.set_backend(None)
+
+
+def make_response(status_code=200, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def make_offer(price):
+    return Offer(
+        offer_source="idealo_DE",
+        offer_url="https://www.idealo.de/relocator/relocate?offerKey=1",
+        retail_prod_name="Panasonic Lumix DMC-LX15",
+        retailer_name="Cyberport",
+        country="DE",
+        price=price,
+        currency="EUR",
+        stock_status="in_stock",
+        metadata=None,
+    )
+
+
+@pytest.mark.unit
+def test_find_element_includes_nested_elements():
+    html = (
+        '<ul class="menu"><li>Menu</li></ul>'
+        + '<ul class="productOffers-list big"><li><ul><li>1</li></ul></li>'
+        + "<li>2</li></ul><ul><li>Footer</li></ul>"
+    )
+
+    element = page_fingerprints.find_element(html, "ul", "productOffers-list")
+
+    assert element == (
+        '<ul class="productOffers-list big"><li><ul><li>1</li></ul></li>'
+        + "<li>2</li></ul>"
+    )
+    assert page_fingerprints.find_element(html, "ul", "productOffers") is None
+
+
+@pytest.mark.unit
+def test_offers_are_reused_while_the_region_is_the_same():
+    page_fingerprints.store(URL, make_response(), "hash-1", [make_offer(45900)])
+
+    previous = page_fingerprints.get(URL)
+
+    assert page_fingerprints.unchanged_offers(
+        URL, previous, make_response(), "hash-1"
+    ) == [make_offer(45900)]
+    assert (
+        page_fingerprints.unchanged_offers(URL, previous, make_response(), "hash-2")
+        is None
+    )
+    assert (
+        page_fingerprints.unchanged_offers(URL, None, make_response(), "hash-1") is None
+    )
+
+
+@pytest.mark.unit
+def test_offers_are_reused_when_not_modified():
+    headers = {"ETag": '"v1"', "Last-Modified": "Mon, 19 Oct 2026 08:00:00 GMT"}
+    page_fingerprints.store(URL, make_response(headers=headers), None, [])
+    previous = page_fingerprints.get(URL)
+
+    assert page_fingerprints.conditional_headers(previous) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Mon, 19 Oct 2026 08:00:00 GMT",
+    }
+    not_modified = make_response(304)
+    assert page_fingerprints.unchanged_offers(URL, previous, not_modified, None) == []
+
+    # The validators of the page are kept
+    page_fingerprints.store(URL, not_modified, None, [], previous)
+    assert page_fingerprints.get(URL).etag == '"v1"'
+
+
+@pytest.mark.unit
+def test_pages_without_region_nor_validators_are_not_stored():
+    page_fingerprints.store(URL, make_response(), None, [make_offer(45900)])
+
+    assert page_fingerprints.get(URL) is None
+
+
+@pytest.mark.unit
+def test_reused_offers_are_parsed_again_after_the_ttl(monkeypatch):
+    now = 1_800_000_000.0
+    monkeypatch.setattr(page_fingerprints.time, "time", lambda: now)
+    page_fingerprints.store(URL, make_response(), "hash-1", [make_offer(45900)])
+
+    # Reusing the offers doesn't extend their expiry
+    now += page_fingerprints.TTL_SECONDS / 2
+    previous = page_fingerprints.get(URL)
+    offers = page_fingerprints.unchanged_offers(
+        URL, previous, make_response(), "hash-1"
+    )
+    page_fingerprints.store(URL, make_response(), "hash-1", offers, previous)
+    assert page_fingerprints.get(URL).parsed_at == previous.parsed_at
+
+    now += page_fingerprints.TTL_SECONDS / 2
+    assert page_fingerprints.get(URL) is None
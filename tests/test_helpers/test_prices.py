@@ -0,0 +1,107 @@
+import random
+import re
+
+import price_parser
+import pytest
+
+from sherlock_offer_scrapers.helpers import prices
+
+COUNTRIES = ["SE", "NO", "DK", "FI", "DE", "UK", "NL", "PL", "US", "NZ"]
+SYMBOLS = ["kr", "€", "£", "$", "NZ$", "A$", "AU$", "MX$", "Mex$", "₪", "C$", "CA$"]
+CODES = ["SEK", "EUR", "PLN", "chf", "USD", "Kč", "zł", "Ft", "R$", "lei"]
+
+
+def reference_parse_price(price_text, country):
+    """The price parsing of the Google Shopping parser, before the table."""
+    price_obj = price_parser.parse_price(price_text)
+
+    if price_obj.amount == 0:
+        return None
+
+    if price_obj.amount is None or price_obj.currency is None:
+        raise ValueError(f"Error when parsing price: {price_text}")
+
+    amount, currency = round(price_obj.amount * 100), price_obj.currency
+    if price_obj.currency == "kr":
+        if country == "SE":
+            currency = "SEK"
+        if country == "NO":
+            currency = "NOK"
+        if country == "DK":
+            currency = "DKK"
+    elif price_obj.currency == "€":
+        currency = "EUR"
+    elif price_obj.currency == "£":
+        currency = "GBP"
+    elif price_obj.currency == "$":
+        currency = "USD"
+    elif price_obj.currency == "NZ$":
+        currency = "NZD"
+    elif price_obj.currency == "A$" or price_obj.currency == "AU$":
+        currency = "AUD"
+    elif price_obj.currency == "MX$" or price_obj.currency == "Mex$":
+        currency = "MXN"
+    elif price_obj.currency == "₪":
+        currency = "ILS"
+    elif (
+        price_obj.currency == "Can$"
+        or price_obj.currency == "C$"
+        or price_obj.currency == "CA$"
+    ):
+        currency = "CAD"
+    elif len(currency) == 3 and re.search(r"^[A-Za-z]{3}$", currency) is not None:
+        currency = price_obj.currency.upper()
+    else:
+        raise ValueError(f"Cannot convert currency: {currency}")
+
+    return amount, currency
+
+
+def generate_price_texts(nb_price_texts):
+    random.seed(0)
+    price_texts = []
+    for _ in range(nb_price_texts):
+        amount = random.choice(
+            ["0", "0,00", "1 999,00", "19 990", "1.449,99", "1,449.99", "12.5", "999"]
+        )
+        currency = random.choice(SYMBOLS + CODES)
+        separator = random.choice(["", " ", "\xa0"])
+        if random.random() < 0.5:
+            price_texts.append(f"{currency}{separator}{amount}")
+        else:
+            price_texts.append(f"{amount}{separator}{currency}")
+    return price_texts
+
+
+def outcome(parse, price_text, country):
+    try:
+        return parse(price_text, country)
+    except ValueError as ex:
+        return str(ex)
+
+
+@pytest.mark.unit
+def test_same_as_reference():
+    for price_text in generate_price_texts(300):
+        for country in COUNTRIES:
+            assert outcome(prices.parse_price, price_text, country) == outcome(
+                reference_parse_price, price_text, country
+            ), price_text
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "country, expected",
+    [("SE", "SEK"), ("NO", "NOK"), ("DK", "DKK"), ("FI", "kr")],
+)
+def test_krona_depends_on_country(country, expected):
+    assert prices.parse_price("19 990,00 kr", country) == (1999000, expected)
+
+
+@pytest.mark.unit
+def test_unknown_currency():
+    with pytest.raises(prices.UnknownCurrencyError) as ex:
+        prices.parse_price("1 999 Kč", "CZ")
+
+    assert ex.value.currency == "Kč"
+    assert ex.value.amount == 199900
@@ -0,0 +1,120 @@
+import pytest
+import requests
+
+from sherlock_offer_scrapers.helpers import deadline
+from sherlock_offer_scrapers.helpers.requests import RetryPolicy, send_with_retries
+
+
+FAST_POLICY = RetryPolicy(max_attempts=3, backoff_base_seconds=0)
+
+
+def make_response(status_code: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+class FakeSend:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, timeout):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return make_response(outcome)
+
+
+@pytest.fixture(autouse=True)
+def no_deadline():
+    deadline.clear()
+    yield
+    deadline.clear()
+
+
+@pytest.mark.unit
+def test_retry_until_success():
+    send = FakeSend([503, requests.ConnectionError(), 200])
+
+    response = send_with_retries(send, "GET", "https://example.com", FAST_POLICY)
+
+    assert response.status_code == 200
+    assert send.calls == 3
+
+
+@pytest.mark.unit
+def test_non_retryable_status_is_returned_directly():
+    send = FakeSend([404, 200])
+
+    response = send_with_retries(send, "GET", "https://example.com", FAST_POLICY)
+
+    assert response.status_code == 404
+    assert send.calls == 1
+
+
+@pytest.mark.unit
+def test_give_up_after_max_attempts():
+    send = FakeSend([503, 503, 503, 200])
+
+    response = send_with_retries(send, "GET", "https://example.com", FAST_POLICY)
+
+    assert response.status_code == 503
+    assert send.calls == 3
+
+
+@pytest.mark.unit
+def test_last_exception_is_raised():
+    send = FakeSend([requests.Timeout(), requests.ConnectionError()])
+
+    with pytest.raises(requests.ConnectionError):
+        send_with_retries(
+            send, "GET", "https://example.com", RetryPolicy(2, backoff_base_seconds=0)
+        )
+    assert send.calls == 2
+
+
+@pytest.mark.unit
+def test_non_idempotent_request_is_not_retried():
+    send = FakeSend([503, 200])
+
+    response = send_with_retries(send, "POST", "https://example.com", FAST_POLICY)
+
+    assert response.status_code == 503
+    assert send.calls == 1
+
+
+@pytest.mark.unit
+def test_no_retry_past_the_deadline():
+    deadline.start(timeout=deadline.SAFETY_MARGIN_SECONDS + 1)
+    send = FakeSend([503, 200])
+
+    response = send_with_retries(send, "GET", "https://example.com", FAST_POLICY)
+
+    assert response.status_code == 503
+    assert send.calls == 1
+
+
+@pytest.mark.unit
+def test_timeout_is_capped_by_the_deadline():
+    deadline.start(timeout=deadline.SAFETY_MARGIN_SECONDS + 10)
+    timeouts = []
+
+    def send(timeout):
+        timeouts.append(timeout)
+        return make_response(200)
+
+    send_with_retries(send, "GET", "https://example.com", FAST_POLICY, timeout=600)
+
+    assert 0 < timeouts[0] <= 10
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("attempt", [1, 2, 3, 4, 10])
+def test_backoff_is_bounded(attempt):
+    policy = RetryPolicy(backoff_base_seconds=0.5, backoff_max_seconds=4)
+    ceiling = min(4, 0.5 * 2 ** (attempt - 1))
+
+    for _ in range(50):
+        assert 0 <= policy.backoff(attempt) <= ceiling
@@ -0,0 +1,223 @@
+import http.server
+import json
+import socket
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import cache, deadline, scrapfly
+from sherlock_offer_scrapers.helpers.requests import RetryPolicy
+
+FAST_POLICY = RetryPolicy(max_attempts=3, backoff_base_seconds=0)
+
+
+def success(content="<html></html>", cost=25):
+    body = {
+        "context": {"cost": {"total": cost}},
+        "result": {"status_code": 200, "content": content, "error": None},
+    }
+    return 200, body
+
+
+def error(code, retryable, status_code=422):
+    body = {
+        "context": {"cost": {"total": 1}},
+        "result": {
+            "status_code": None,
+            "content": "",
+            "error": {"code": code, "message": "Failed", "retryable": retryable},
+        },
+    }
+    return status_code, body
+
+
+class ScrapflyStub(http.server.ThreadingHTTPServer):
+    """Local server answering like the Scrapfly API, with the given responses."""
+
+    def __init__(self, responses, delay_seconds=0.0):
+        super().__init__(("127.0.0.1", 0), ScrapflyStubHandler)
+        self.responses = list(responses)
+        self.delay_seconds = delay_seconds
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/scrape"
+
+
+class ScrapflyStubHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server
+        with stub.lock:
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+            stub.requests.append(
+                urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            )
+            status_code, body = stub.responses.pop(0) if stub.responses else success()
+
+        time.sleep(stub.delay_seconds)
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+        with stub.lock:
+            stub.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def make_stub():
+    stubs = []
+
+    def make_stub(responses=(), delay_seconds=0.0):
+        stub = ScrapflyStub(responses, delay_seconds)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        stubs.append(stub)
+        return stub
+
+    deadline.clear()
+    yield make_stub
+    for stub in stubs:
+        stub.shutdown()
+        stub.server_close()
+    deadline.clear()
+
+
+def make_client(stub, **kwargs):
+    kwargs.setdefault("retry_policy", FAST_POLICY)
+    return scrapfly.ScrapflyClient("api-key", api_url=stub.url, **kwargs)
+
+
+@pytest.mark.unit
+def test_scrape(make_stub):
+    stub = make_stub([success("<html>offers</html>", cost=30)])
+
+    result = make_client(stub).scrape(
+        "https://example.com/p/1", country="pt", asp=True, tags=["player"]
+    )
+
+    assert result.content == "<html>offers</html>"
+    assert result.cost == 30
+    assert stub.requests == [
+        {
+            "key": ["api-key"],
+            "url": ["https://example.com/p/1"],
+            "country": ["pt"],
+            "asp": ["true"],
+            "tags": ["player"],
+        }
+    ]
+
+
+@pytest.mark.unit
+def test_retryable_errors_are_retried(make_stub):
+    stub = make_stub(
+        [
+            error("ERR::ASP::SHIELD_PROTECTION_FAILED", retryable=True),
+            error("ERR::THROTTLE::MAX_CONCURRENT_REQUEST_EXCEEDED", True, 429),
+            success(),
+        ]
+    )
+
+    result = make_client(stub).scrape("https://example.com/p/1")
+
+    assert result.content == "<html></html>"
+    assert len(stub.requests) == 3
+
+
+@pytest.mark.unit
+def test_other_errors_are_raised(make_stub):
+    stub = make_stub([error("ERR::SCRAPE::BAD_UPSTREAM_RESPONSE", retryable=False)])
+
+    with pytest.raises(scrapfly.ScrapflyError) as ex:
+        make_client(stub).scrape("https://example.com/p/1")
+
+    assert ex.value.code == "ERR::SCRAPE::BAD_UPSTREAM_RESPONSE"
+    assert len(stub.requests) == 1
+
+
+@pytest.mark.unit
+def test_connection_errors_do_not_leak_the_api_key():
+    with socket.socket() as closed_socket:
+        closed_socket.bind(("127.0.0.1", 0))
+        port = closed_socket.getsockname()[1]
+    client = scrapfly.ScrapflyClient(
+        "secret-api-key",
+        api_url=f"http://127.0.0.1:{port}/scrape",
+        retry_policy=RetryPolicy(max_attempts=1),
+    )
+
+    with pytest.raises(scrapfly.ScrapflyError) as ex:
+        client.scrape("https://example.com/p/1")
+
+    assert ex.value.code == "CONNECTION"
+    assert "/scrape?key=REDACTED" in str(ex.value)
+    assert "secret-api-key" not in str(ex.value)
+
+
+@pytest.mark.unit
+def test_no_request_past_the_deadline(make_stub):
+    stub = make_stub()
+    deadline.start(timeout=deadline.SAFETY_MARGIN_SECONDS)
+
+    with pytest.raises(scrapfly.ScrapflyError) as ex:
+        make_client(stub).scrape("https://example.com/p/1")
+
+    assert ex.value.code == "DEADLINE_EXCEEDED"
+    assert stub.requests == []
+
+
+@pytest.mark.unit
+def test_too_large_response_is_dropped(make_stub):
+    stub = make_stub([success("x" * 2000)])
+
+    with pytest.raises(scrapfly.ScrapflyError) as ex:
+        make_client(stub, max_response_bytes=1000).scrape("https://example.com/p/1")
+
+    assert ex.value.code == "TOO_LARGE"
+
+
+@pytest.mark.unit
+def test_concurrency_is_limited(make_stub):
+    stub = make_stub(delay_seconds=0.05)
+    client = make_client(stub, concurrency=2)
+
+    threads = [
+        threading.Thread(target=client.scrape, args=(f"https://example.com/p/{i}",))
+        for i in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stub.requests) == 6
+    assert stub.max_in_flight == 2
+
+
+@pytest.mark.unit
+def test_no_request_once_the_daily_budget_is_spent(make_stub, tmp_path):
+    cache.set_backend(cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")))
+    stub = make_stub([success(cost=25), success(cost=25)])
+    client = make_client(stub, daily_credit_budget=30)
+
+    try:
+        client.scrape("https://example.com/p/1")
+        client.scrape("https://example.com/p/2")
+        with pytest.raises(scrapfly.ScrapflyBudgetExceeded):
+            client.scrape("https://example.com/p/3")
+    finally:
+        cache.set_backend(None)
+
+    assert len(stub.requests) == 2
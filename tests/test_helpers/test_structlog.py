@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+import requests
+import structlog
+
+from sherlock_offer_scrapers.helpers.structlog import (
+    REDACTED,
+    KeepFieldsProcessor,
+    SampleProcessor,
+    _parse_log_level,
+    redact_processor,
+)
+
+
+@pytest.mark.unit
+def test_secrets_are_redacted():
+    headers = requests.structures.CaseInsensitiveDict(
+        {"User-Agent": "Mozilla/5.0", "Proxy-Authorization": "Basic dXNlcjpwYXNz"}
+    )
+    event_dict = {
+        "event": "make-request",
+        "request_headers": headers,
+        "authorization": "Bearer token",
+    }
+
+    redacted = redact_processor(None, "info", event_dict)
+
+    assert redacted["request_headers"] == {
+        "User-Agent": "Mozilla/5.0",
+        "Proxy-Authorization": REDACTED,
+    }
+    assert redacted["authorization"] == REDACTED
+    # The headers of the request are left untouched
+    assert headers["Proxy-Authorization"] == "Basic dXNlcjpwYXNz"
+
+
+@pytest.mark.unit
+def test_only_info_events_are_sampled():
+    sample = SampleProcessor({"make-request": 0.0})
+
+    with pytest.raises(structlog.DropEvent):
+        sample(None, "info", {"event": "make-request"})
+
+    assert sample(None, "warning", {"event": "make-request"})
+    assert sample(None, "info", {"event": "offer-scraping-started"})
+
+
+@pytest.mark.unit
+def test_only_whitelisted_fields_are_kept():
+    keep_fields = KeepFieldsProcessor(["request_url"])
+
+    event_dict = keep_fields(
+        None,
+        "info",
+        {
+            "event": "make-request",
+            "level": "info",
+            "request_url": "https://example.com",
+            "request_headers": {},
+        },
+    )
+
+    assert event_dict == {
+        "event": "make-request",
+        "level": "info",
+        "request_url": "https://example.com",
+    }
+
+
+@pytest.mark.unit
+def test_log_levels_are_parsed():
+    assert _parse_log_level("debug") == logging.DEBUG
+    assert _parse_log_level(" WARNING ") == logging.WARNING
+    assert _parse_log_level("verbose") is None
@@ -0,0 +1,96 @@
+import asyncio
+import concurrent.futures
+import json
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import tracing
+
+
+class ListExporter(tracing.SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter():
+    exporter = ListExporter()
+    tracing.clear_exporters()
+    tracing.add_exporter(exporter)
+    yield exporter
+    tracing.clear_exporters()
+
+
+@pytest.mark.unit
+def test_spans_are_nested(exporter):
+    with tracing.span("sherlock-scrape", offer_source="idealo") as root:
+        with tracing.span("parse-offers") as child:
+            tracing.set_attribute("offer_count", 3)
+
+    assert exporter.spans == [child, root]
+    assert child.parent_id == root.span_id
+    assert child.trace_id == root.trace_id
+    assert root.parent_id is None
+    assert child.attributes == {"offer_count": 3}
+    assert root.duration_ms >= child.duration_ms >= 0
+    assert tracing.current_span() is None
+
+
+@pytest.mark.unit
+def test_bound_functions_are_children_in_other_threads(exporter):
+    def fetch(country):
+        with tracing.span("fetch-offers", country=country) as fetch_span:
+            return fetch_span
+
+    with tracing.span("sherlock-scrape") as root:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(tracing.bind(fetch), country)
+                for country in ["DE", "UK"]
+            ]
+            children = [future.result() for future in futures]
+
+    assert [child.parent_id for child in children] == [root.span_id, root.span_id]
+
+
+@pytest.mark.unit
+def test_coroutines_are_children(exporter):
+    async def scrape_country(country):
+        with tracing.span("scrape-country", country=country) as country_span:
+            await asyncio.sleep(0)
+            return country_span
+
+    async def scrape():
+        with tracing.span("sherlock-scrape") as root:
+            children = await asyncio.gather(scrape_country("SE"), scrape_country("FR"))
+        return root, children
+
+    root, children = asyncio.run(scrape())
+
+    assert [child.parent_id for child in children] == [root.span_id, root.span_id]
+
+
+@pytest.mark.unit
+def test_errors_are_recorded(exporter):
+    with pytest.raises(ValueError):
+        with tracing.span("parse-offers"):
+            raise ValueError("Cannot find offer link")
+
+    assert exporter.spans[0].error == "ValueError('Cannot find offer link')"
+
+
+@pytest.mark.unit
+def test_file_exporter(exporter, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracing.add_exporter(tracing.FileExporter(str(path)))
+
+    with tracing.span("publish-offers", offer_count=2):
+        pass
+
+    [line] = path.read_text().splitlines()
+    exported = json.loads(line)
+    assert exported["span_name"] == "publish-offers"
+    assert exported["offer_count"] == 2
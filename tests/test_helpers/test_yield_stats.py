@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from sherlock_offer_scrapers.helpers import yield_stats
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def store(tmp_path):
+    return yield_stats.YieldStatsStore(str(tmp_path / "yield_stats.sqlite3"))
+
+
+def record_scrapes(store, product_key, country, nb_offers_per_scrape, days_ago=1):
+    for nb_offers in nb_offers_per_scrape:
+        store.record(
+            "google_shopping",
+            product_key,
+            country,
+            nb_offers,
+            scraped_at=time.time() - days_ago * DAY,
+        )
+
+
+@pytest.mark.unit
+def test_stats_per_product_and_for_all_products(store):
+    record_scrapes(store, "1", "SE", [3, 5])
+    record_scrapes(store, "2", "SE", [1])
+    record_scrapes(store, "1", "DK", [0], days_ago=yield_stats.WINDOW_DAYS + 1)
+
+    product_stats = store.get_stats("google_shopping", "1")
+    all_products_stats = store.get_stats("google_shopping")
+
+    assert list(product_stats) == ["SE"]
+    assert product_stats["SE"].offers_per_scrape == 4
+    assert all_products_stats["SE"].nb_scrapes == 3
+    assert store.get_stats("idealo") == {}
+
+
+@pytest.mark.unit
+def test_countries_are_ordered_by_yield(store):
+    record_scrapes(store, "1", "SE", [1, 1])
+    record_scrapes(store, "1", "DK", [10])
+    record_scrapes(store, "1", "NO", [0])
+    # Never scraped for the product, but the best for the others
+    record_scrapes(store, "2", "DE", [20])
+
+    countries = store.select_countries(
+        "google_shopping", "1", ["SE", "NO", "FI", "DK", "DE"]
+    )
+
+    assert countries == ["DK", "SE", "FI", "DE", "NO"]
+
+
+@pytest.mark.unit
+def test_empty_countries_are_skipped_until_reprobed(store):
+    record_scrapes(store, "1", "SE", [2])
+    record_scrapes(store, "1", "DK", [0] * yield_stats.MIN_EMPTY_SCRAPES)
+    record_scrapes(
+        store,
+        "1",
+        "FI",
+        [0] * yield_stats.MIN_EMPTY_SCRAPES,
+        days_ago=yield_stats.REPROBE_DAYS + 1,
+    )
+
+    countries = store.select_countries("google_shopping", "1", ["SE", "DK", "FI"])
+
+    assert countries == ["SE", "FI"]
+
+
+@pytest.mark.unit
+def test_budget_keeps_a_probe(store):
+    record_scrapes(store, "1", "SE", [5])
+    record_scrapes(store, "1", "DK", [3])
+    record_scrapes(store, "1", "NO", [1])
+
+    countries = store.select_countries(
+        "google_shopping", "1", ["SE", "DK", "NO", "FI"], max_countries=2
+    )
+
+    assert countries == ["SE", "FI"]
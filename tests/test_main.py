@@ -0,0 +1,160 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+import main
+
+
+def make_payload(**triggered_by):
+    return {
+        "gtin": "00889842651393",
+        "offer_urls": {},
+        "triggered_by": triggered_by,
+    }
+
+
+@pytest.mark.unit
+def test_b2b_only_sources_are_skipped_for_clients():
+    payload = make_payload(source="client")
+
+    assert main._should_scrape("idealo", payload)
+    assert not main._should_scrape("google_shopping", payload)
+    assert not main._should_scrape("kuantokusta", payload)
+
+
+@pytest.mark.unit
+def test_only_requested_sources_are_scraped_for_b2b_jobs():
+    payload = make_payload(source="b2b_job", requested_sources=["google_shopping"])
+
+    assert main._should_scrape("google_shopping", payload)
+    assert not main._should_scrape("idealo", payload)
+
+
+@pytest.mark.unit
+def test_scrape_all_runs_every_source_even_if_one_fails(monkeypatch):
+    scraped = []
+
+    async def fake_scrape_async(offer_source, payload):
+        scraped.append(offer_source)
+        if offer_source == "idealo":
+            raise Exception("idealo failed")
+
+    monkeypatch.setattr(main, "_sherlock_scrape_async", fake_scrape_async)
+    payload = make_payload(source="b2b_job")
+
+    with pytest.raises(Exception, match="idealo failed"):
+        asyncio.run(
+            main._sherlock_scrape_all(
+                payload, ["idealo", "google_shopping", "pricerunner"]
+            )
+        )
+
+    assert sorted(scraped) == ["google_shopping", "idealo", "pricerunner"]
+
+
+@pytest.mark.unit
+def test_google_shopping_countries_skip_empty_countries(monkeypatch):
+    from sherlock_offer_scrapers.helpers import yield_stats
+
+    store = yield_stats.YieldStatsStore()
+    monkeypatch.setattr(yield_stats, "_store", store)
+    for _ in range(yield_stats.MIN_EMPTY_SCRAPES):
+        store.record("google_shopping", "00889842651393", "FI", 0)
+    store.record("google_shopping", "00889842651393", "DE", 4)
+
+    countries = main._get_google_shopping_countries(make_payload(source="b2b_job"))
+    target_countries = main._get_google_shopping_countries(
+        make_payload(source="b2b_job", target_countries=["FI"])
+    )
+
+    assert countries[0] == "DE"
+    assert "FI" not in countries
+    assert "SE" in countries
+    assert target_countries == ["FI"]
+
+
+@pytest.mark.unit
+def test_google_shopping_yield_is_not_recorded_for_skipped_fetches(monkeypatch):
+    from sherlock_offer_scrapers import helpers
+    from sherlock_offer_scrapers.scrapers import google_shopping
+
+    store = helpers.yield_stats.YieldStatsStore()
+    monkeypatch.setattr(helpers.yield_stats, "_store", store)
+
+    async def fake_scrape_by_country(gtin, sku, cached_offer_urls, countries):
+        yield "SE", [], []
+        yield "FI", [], [(helpers.deadline.DeadlineExceeded(), "FI")]
+
+    monkeypatch.setattr(google_shopping, "scrape_by_country", fake_scrape_by_country)
+    monkeypatch.setattr(
+        google_shopping, "get_offer_sources", lambda country: ["google_shopping"]
+    )
+
+    class FakePublisher:
+        def publish(self, offers, countries, is_last=False):
+            pass
+
+    offers, exceptions, is_complete = asyncio.run(
+        main._scrape_google_shopping_by_country(
+            "00889842651393",
+            None,
+            {"google_shopping": "https://www.google.com/shopping/product/1"},
+            ["SE", "FI"],
+            FakePublisher(),
+            "00889842651393",
+        )
+    )
+
+    assert offers == []
+    assert exceptions == []
+    assert not is_complete
+    assert set(store.get_stats("google_shopping", "00889842651393")) == {"SE"}
+
+
+@pytest.mark.unit
+def test_empty_scrapes_are_not_shared(monkeypatch, tmp_path):
+    from types import SimpleNamespace
+
+    from sherlock_offer_scrapers import helpers
+
+    helpers.cache.set_backend(
+        helpers.cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    )
+    scraped = []
+
+    # The first scrape fails softly, e.g. on a Scrapfly error
+    def scrape(gtin):
+        scraped.append(gtin)
+        return []
+
+    monkeypatch.setattr(
+        main, "_load_scraper", lambda offer_source: SimpleNamespace(scrape=scrape)
+    )
+    monkeypatch.setattr(helpers.offers, "publish_offers", lambda *args: None)
+    try:
+        asyncio.run(main._scrape_and_publish("kelkoo", make_payload()))
+        asyncio.run(main._scrape_and_publish("kelkoo", make_payload()))
+    finally:
+        helpers.cache.set_backend(None)
+
+    assert scraped == ["00889842651393", "00889842651393"]
+
+
+@pytest.mark.unit
+def test_scraper_dependencies_are_not_imported_with_main():
+    # In a new interpreter: the other tests have already imported them
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, main; "
+            + "print(' '.join(m for m in ['bs4', 'price_parser'] if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    assert imported == []
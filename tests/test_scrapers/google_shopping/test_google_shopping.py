@@ -2,6 +2,7 @@ import pytest
 import asyncio
 import pathlib
 import json
+import re
 
 import bs4
 
@@ -43,7 +44,7 @@ def test_parser_offer_page_variant_0():
 
     assert len(offers) == 6
 
-    assert offers[0] == {
+    assert offers[0].to_message() == {
         "offer_source": "google_shopping_NL",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwiTofLZ8tH1AhUZqncKHSzjCVgYABABGgJlZg&sig=AOD64_1L0RK8PcIMOzLLxeyFEdN7RB9ZtA&ctype=5&q=&ved=0ahUKEwiLwe_Z8tH1AhVMg_0HHYSmC84Q2ikIGA&adurl=",
         "retail_prod_name": 'AOC Agon AG493UCX 49" Curved Gaming Monitor(25)',
@@ -61,7 +62,7 @@ def test_parser_offer_page_variant_0():
         ),
     }
 
-    assert offers[1] == {
+    assert offers[1].to_message() == {
         "offer_source": "google_shopping_NL",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwiTofLZ8tH1AhUZqncKHSzjCVgYABADGgJlZg&sig=AOD64_3eUyndFT115pX3JPzpseH2xOFEpQ&ctype=5&q=&ved=0ahUKEwiLwe_Z8tH1AhVMg_0HHYSmC84Q2ikIGw&adurl=",
         "retail_prod_name": 'AOC Agon AG493UCX 49" Curved Gaming Monitor(25)',
@@ -79,7 +80,7 @@ def test_parser_offer_page_variant_0():
         ),
     }
 
-    assert offers[5] == {
+    assert offers[5].to_message() == {
         "offer_source": "google_shopping_NL",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwiTofLZ8tH1AhUZqncKHSzjCVgYABALGgJlZg&sig=AOD64_2EHLoapZU7SQY19NlfEjFRWpN42A&ctype=5&q=&ved=0ahUKEwiLwe_Z8tH1AhVMg_0HHYSmC84Q2ikIKg&adurl=",
         "retail_prod_name": 'AOC Agon AG493UCX 49" Curved Gaming Monitor(25)',
@@ -108,31 +109,46 @@ def test_parser_offer_page_variant_1():
 
     assert len(offers) == 2
 
-    assert offers[0]["offer_source"] == "google_shopping_BE"
+    assert offers[0].offer_source == "google_shopping_BE"
     assert (
-        offers[0]["offer_url"]
+        offers[0].offer_url
         == "https://www.galaxus.ch/de/product/14341970?utm_campaign=organicshopping&utm_source=google&utm_medium=organic"
     )
-    assert offers[0]["retail_prod_name"] == "AOC Monitor AG493UCX"
-    assert offers[0]["retailer_name"] == "galaxus.ch"
-    assert offers[0]["country"] == "BE"
-    assert offers[0]["price"] == 102200
-    assert offers[0]["currency"] == "CHF"
-    assert offers[0]["stock_status"] == "in_stock"
-    assert offers[0]["metadata"] == None
-
-    assert offers[1]["offer_source"] == "google_shopping_BE"
+    assert offers[0].retail_prod_name == "AOC Monitor AG493UCX"
+    assert offers[0].retailer_name == "galaxus.ch"
+    assert offers[0].country == "BE"
+    assert offers[0].price == 102200
+    assert offers[0].currency == "CHF"
+    assert offers[0].stock_status == "in_stock"
+    assert offers[0].metadata == None
+
+    assert offers[1].offer_source == "google_shopping_BE"
     assert (
-        offers[1]["offer_url"]
+        offers[1].offer_url
         == "https://www.digitec.ch/de/product/14341970?utm_campaign=organicshopping&utm_source=google&utm_medium=organic"
     )
-    assert offers[1]["retail_prod_name"] == "AOC Monitor AG493UCX"
-    assert offers[1]["retailer_name"] == "digitec.ch"
-    assert offers[1]["country"] == "BE"
-    assert offers[1]["price"] == 102200
-    assert offers[1]["currency"] == "CHF"
-    assert offers[1]["stock_status"] == "in_stock"
-    assert offers[1]["metadata"] == None
+    assert offers[1].retail_prod_name == "AOC Monitor AG493UCX"
+    assert offers[1].retailer_name == "digitec.ch"
+    assert offers[1].country == "BE"
+    assert offers[1].price == 102200
+    assert offers[1].currency == "CHF"
+    assert offers[1].stock_status == "in_stock"
+    assert offers[1].metadata == None
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "file_name, expected_variant", [("variant_0.html", 0), ("variant_1.html", 1)]
+)
+def test_match_page_variant(file_name, expected_variant):
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/{file_name}", "r") as f:
+        soup = bs4.BeautifulSoup(f, "html.parser")
+
+    page_variant, product_name, image = parser._match_page_variant(soup)
+
+    assert page_variant.index == expected_variant
+    assert product_name != ""
 
 
 @pytest.mark.unit
@@ -145,7 +161,7 @@ def test_parser_offer_page_nzd_currency():
 
     assert len(offers) == 16
 
-    assert offers[0] == {
+    assert offers[0].to_message() == {
         "offer_source": "google_shopping_PT",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwjr7qOCjdL1AhV_BaIDHWvjAMcYABABGgJsZQ&sig=AOD64_3v4BPx6YlNNhfQhKpUIJUs3KkxIQ&ctype=5&q=&ved=0ahUKEwjMg6GCjdL1AhWlk4sKHTggAIQQ2ikIGQ&adurl=",
         "retail_prod_name": 'ASUS PG259QNR 62.2 cm (24.5") 1920 x 1080 pixels Full HD LED Black(2)',
@@ -163,7 +179,7 @@ def test_parser_offer_page_nzd_currency():
         ),
     }
 
-    assert offers[1] == {
+    assert offers[1].to_message() == {
         "offer_source": "google_shopping_PT",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwjr7qOCjdL1AhV_BaIDHWvjAMcYABADGgJsZQ&sig=AOD64_3YBYovJD-IkkhqsDl4epet-B9N7Q&ctype=5&q=&ved=0ahUKEwjMg6GCjdL1AhWlk4sKHTggAIQQ2ikIHw&adurl=",
         "retail_prod_name": 'ASUS PG259QNR 62.2 cm (24.5") 1920 x 1080 pixels Full HD LED Black(2)',
@@ -214,7 +230,7 @@ def test_parser_offer_page_usd_currency():
 
     assert len(offers) == 20
 
-    assert offers[0] == {
+    assert offers[0].to_message() == {
         "offer_source": "google_shopping_EE",
         "offer_url": "https://www.google.com/aclk?sa=L&ai=DChcSEwimzoWv1NT1AhWBAOYKHSC_B9sYABABGgJscg&sig=AOD64_2mYVd5m8Dcwn2Gg4CG6BwcKCMuNQ&ctype=5&q=&ved=0ahUKEwjPv4Ov1NT1AhXooosKHXJQDi8Q2ikIGA&adurl=",
         "retail_prod_name": "Apple - AirTag Leather Loop - Saddle Brown(387)",
@@ -242,7 +258,7 @@ def test_parser_offer_page_zero_price():
     offers = parser.parser_offer_page(soup, "BE")
 
     for offer in offers:
-        assert offer["price"] != 0
+        assert offer.price != 0
 
     assert len(offers) == 19
 
@@ -278,7 +294,7 @@ def test_get_image_variant_0():
     offers = parser.parser_offer_page(soup, "NL")
 
     for offer in offers:
-        offer_metadata_dict = json.loads(offer["metadata"])
+        offer_metadata_dict = json.loads(offer.metadata)
         assert (
             offer_metadata_dict["images"][0]
             == "https://encrypted-tbn2.gstatic.com/shopping?q=tbn:ANd9GcRRI8YV7Fx14oOr8dR0XXmpWDy-kiQqEv79YUfcO2gjjTGIKsPHtMy-9gkO9HJLRKGLhPP67xI&usqp=CAY"
@@ -294,3 +310,145 @@ def test_server_error():
     offers = parser.parser_offer_page(soup, "LV")
 
     assert len(offers) == 0
+
+
+async def _collect_by_country(countries, cached_offer_urls=None):
+    return [
+        result
+        async for result in google_shopping.scrape_by_country(
+            "123", None, cached_offer_urls or {"google_shopping": ["1"]}, countries
+        )
+    ]
+
+
+@pytest.mark.unit
+def test_scrape_by_country_yields_fastest_country_first(monkeypatch):
+    delays = {"SE": 0.2, "DK": 0.0, "FI": 0.1}
+
+    async def fake_fetch(cached_product_url, gtin, sku, country):
+        await asyncio.sleep(delays[country])
+        return [{"country": country}], country, None
+
+    monkeypatch.setattr(
+        google_shopping.google, "fetch_offers_from_google_product_id", fake_fetch
+    )
+
+    results = asyncio.run(_collect_by_country(["SE", "DK", "FI"]))
+
+    assert [country for country, _, _ in results] == ["DK", "FI", "SE"]
+    assert results[0][1] == [{"country": "DK"}]
+
+
+@pytest.mark.unit
+def test_scrape_by_country_abandons_countries_after_deadline(monkeypatch):
+    from sherlock_offer_scrapers.helpers import deadline
+
+    async def fake_fetch(cached_product_url, gtin, sku, country):
+        await asyncio.sleep(0 if country == "SE" else 10)
+        return [{"country": country}], country, None
+
+    monkeypatch.setattr(
+        google_shopping.google, "fetch_offers_from_google_product_id", fake_fetch
+    )
+    deadline.start(timeout=deadline.SAFETY_MARGIN_SECONDS + 0.5)
+    try:
+        results = asyncio.run(_collect_by_country(["SE", "DK"]))
+    finally:
+        deadline.clear()
+
+    assert [country for country, _, _ in results] == ["SE"]
+
+
+@pytest.mark.unit
+def test_plan_fetches_dedupes_pages():
+    cached_offer_urls = {
+        "google_shopping": ["1", "2"],
+        "google_shopping_DK": ["2 ", "3"],
+    }
+
+    fetches = google_shopping.plan_fetches("123", cached_offer_urls, ["SE", "DK"])
+
+    assert sorted((f.country, f.cached_product_url) for f in fetches) == [
+        ("DK", "1"),
+        ("DK", "2"),
+        ("DK", "3"),
+        ("SE", "1"),
+        ("SE", "2"),
+    ]
+
+
+@pytest.mark.unit
+def test_plan_fetches_alternates_countries():
+    cached_offer_urls = {"google_shopping": ["1", "2"], "google_shopping_FI": ["3"]}
+
+    fetches = google_shopping.plan_fetches("123", cached_offer_urls, ["FI", "DK", "SE"])
+
+    assert [(f.country, f.cached_product_url) for f in fetches] == [
+        ("FI", "1"),
+        ("DK", "1"),
+        ("SE", "1"),
+        ("FI", "2"),
+        ("DK", "2"),
+        ("SE", "2"),
+        ("FI", "3"),
+    ]
+
+
+@pytest.mark.unit
+def test_scrape_by_country_limits_concurrent_fetches(monkeypatch):
+    running = 0
+    max_running = 0
+
+    async def fake_fetch(cached_product_url, gtin, sku, country):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return [{"country": country}], country, None
+
+    monkeypatch.setattr(
+        google_shopping.google, "fetch_offers_from_google_product_id", fake_fetch
+    )
+    monkeypatch.setattr(google_shopping.google, "MAX_CONCURRENT_FETCHES", 2)
+    cached_offer_urls = {"google_shopping": ["1", "2", "3"]}
+
+    results = asyncio.run(
+        _collect_by_country(["SE", "DK", "FI", "SE"], cached_offer_urls)
+    )
+
+    assert max_running == 2
+    assert sorted(country for country, _, _ in results) == ["DK", "FI", "SE"]
+    assert all(len(offers) == 3 for _, offers, _ in results)
+
+
+@pytest.mark.unit
+def test_offers_region_hash():
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/variant_0.html", "r") as f:
+        html = f.read()
+
+    region_hash = parser.offers_region_hash(html)
+
+    assert region_hash is not None
+    # Changes outside of the offers don't matter
+    assert parser.offers_region_hash(html.replace("</body>", "<p></p></body>")) == (
+        region_hash
+    )
+    with open(f"{dir}/data/no_content.html", "r") as f:
+        assert parser.offers_region_hash(f.read()) is None
+
+
+@pytest.mark.unit
+def test_offers_region_hash_ignores_click_tracking():
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/variant_1.html", "r") as f:
+        html = f.read()
+    # The tracking tokens of another response for the same offers
+    other_html = re.sub(r"ved=[\w-]+", "ved=0ahUKEwiOtherToken", html)
+    assert other_html != html
+
+    assert parser.offers_region_hash(other_html) == parser.offers_region_hash(html)
+    assert parser.offers_region_hash(
+        html.replace("1,022.00", "989.00")
+    ) != parser.offers_region_hash(html)
@@ -0,0 +1,187 @@
+import json
+import pathlib
+
+import pytest
+import requests
+
+from sherlock_offer_scrapers.scrapers.idealo import idealo as idealo_scraper
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "ciphertext, expected",
+    [
+        (
+            "!2?2D@?:4 {F>:I s|r\\\\{)`d q=24< cz q=24< {)\\\\`d",
+            "Panasonic Lumix DMC-LX15 Black 4K Black LX-15",
+        ),
+        # Quotes are escaped in the script
+        ("k3m$49H2CKk^3m U \\':56@", "<b>Schwarz</b> & Video"),
+        ("（!2?2D@?:4）", "(Panasonic)"),
+    ],
+)
+def test_decode_rot47(ciphertext, expected):
+    assert idealo_scraper._decode_rot47(ciphertext) == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "product_name_html, expected",
+    [
+        ("Panasonic Lumix DMC-LX15", "Panasonic Lumix DMC-LX15"),
+        ("Lumix <b>Schwarz</b> &amp; Tasche", "Lumix Schwarz & Tasche"),
+        ("Lumix<br/>LX15 <!-- 4K -->", "LumixLX15 "),
+        ("&quot;Kit&quot; &lt;2 Akkus&gt; 5 < 6", '"Kit" <2 Akkus> 5 < 6'),
+    ],
+)
+def test_strip_html(product_name_html, expected):
+    assert idealo_scraper._strip_html(product_name_html) == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "price_text, country, expected",
+    [
+        ("459,00\xa0€", "DE", (45900, "EUR")),
+        ("£1,049.00", "UK", (104900, "GBP")),
+        # The currency of the country when the text has no symbol
+        ("1.049,00", "FR", (104900, "EUR")),
+    ],
+)
+def test_parse_price_text(price_text, country, expected):
+    assert idealo_scraper._parse_price_text(price_text, country) == expected
+
+
+@pytest.mark.unit
+def test_parse_price_text_with_unknown_currency():
+    with pytest.raises(ValueError):
+        idealo_scraper._parse_price_text("1.049,00", "US")
+
+
+@pytest.mark.unit
+def test_parse_offers():
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/offers_page.html", "r") as f:
+        html_content = f.read()
+
+    offers = idealo_scraper._parse_offers(html_content, "DE")
+
+    # The offer without price and the one without retailer are skipped
+    assert [
+        (offer.retail_prod_name, offer.retailer_name, offer.price, offer.stock_status)
+        for offer in offers
+    ] == [
+        ("Panasonic Lumix DMC-LX15 Black", "Cyberport", 45900, "in_stock"),
+        (
+            "Panasonic Lumix DMC-LX15 Black 4K Black LX-15",
+            "MediaMarkt",
+            46999,
+            "in_stock",
+        ),
+        ("Panasonic Lumix DMC-LX15 Schwarz & Tasche", "Saturn", 104900, "unknown"),
+        ("Panasonic LX15 (Vlog Edition) 20,1 MP", "Foto Koch ", 47900, "out_of_stock"),
+        ('Panasonic Lumix DMC-LX15 "Kit" <2 Akkus>', "Amazon", 49900, "in_stock"),
+    ]
+
+    assert offers[0].to_message() == {
+        "offer_source": "idealo_DE",
+        "offer_url": "https://www.idealo.de/relocator/relocate?offerKey=1",
+        "retail_prod_name": "Panasonic Lumix DMC-LX15 Black",
+        "retailer_name": "Cyberport",
+        "country": "DE",
+        "price": 45900,
+        "currency": "EUR",
+        "stock_status": "in_stock",
+        "metadata": json.dumps(
+            {
+                "category": ["Foto", "Digitalkameras"],
+                "description": "Kompakte Kamera mit 1-Zoll-Sensor und lichtstarkem Leica-Objektiv.",
+                "images": [
+                    "https://cdn.idealo.com/folder/Product/5380/1/5380100/s1_produktbild_gross/panasonic-lumix-dmc-lx15.jpg"
+                ],
+                "specs": {
+                    "root": {},
+                    "Allgemein": {"Farbe": "Schwarz", "Sensor": "1 Zoll"},
+                },
+            }
+        ),
+    }
+
+
+@pytest.mark.unit
+def test_parse_offers_is_the_same_as_with_the_full_page(monkeypatch):
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/offers_page.html", "r") as f:
+        html_content = f.read()
+
+    offers = idealo_scraper._parse_offers(html_content, "DE")
+    monkeypatch.setattr(idealo_scraper, "_PAGE_REGIONS", None)
+    offers_from_full_page = idealo_scraper._parse_offers(html_content, "DE")
+
+    assert offers == offers_from_full_page
+
+
+@pytest.mark.unit
+def test_unchanged_offers_are_not_parsed_again(monkeypatch, tmp_path):
+    from sherlock_offer_scrapers.helpers import cache
+
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/offers_page.html", "r") as f:
+        html_content = f.read()
+    url = "https://www.idealo.de/preisvergleich/OffersOfProduct/5380100"
+
+    response = requests.Response()
+    response.status_code = 200
+    response._content = html_content.encode("utf-8")
+    monkeypatch.setattr(
+        idealo_scraper,
+        "_make_request",
+        lambda url, conditional_headers: (url, response),
+    )
+    parsed_pages = []
+    parse_offers = idealo_scraper._parse_offers
+
+    def counting_parse_offers(html_content, country):
+        parsed_pages.append(country)
+        return parse_offers(html_content, country)
+
+    monkeypatch.setattr(idealo_scraper, "_parse_offers", counting_parse_offers)
+    cache.set_backend(cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")))
+    try:
+        first_offers = idealo_scraper.get_offers_from_url(url)
+        second_offers = idealo_scraper.get_offers_from_url(url)
+    finally:
+        cache.set_backend(None)
+
+    assert len(first_offers) == 5
+    assert second_offers == first_offers
+    assert parsed_pages == ["DE"]
+
+
+@pytest.mark.unit
+def test_offers_of_alternative_url_are_not_remembered(monkeypatch, tmp_path):
+    from sherlock_offer_scrapers.helpers import cache, page_fingerprints
+
+    dir = pathlib.Path(__file__).parent.resolve()
+    with open(f"{dir}/data/offers_page.html", "r") as f:
+        html_content = f.read()
+    url = "https://www.idealo.de/preisvergleich/OffersOfProduct/5380100"
+    alternative_url = "https://www.idealo.de/preisvergleich/Typ/5380100"
+
+    response = requests.Response()
+    response.status_code = 200
+    response._content = html_content.encode("utf-8")
+    monkeypatch.setattr(
+        idealo_scraper,
+        "_make_request",
+        lambda url, conditional_headers: (alternative_url, response),
+    )
+    cache.set_backend(cache.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")))
+    try:
+        offers = idealo_scraper.get_offers_from_url(url)
+        fingerprint = page_fingerprints.get(url)
+    finally:
+        cache.set_backend(None)
+
+    assert len(offers) == 5
+    assert fingerprint is None
@@ -3,6 +3,7 @@ import pathlib
 import bs4
 import pytest
 
+from sherlock_offer_scrapers.helpers import cache, scrapfly
 from sherlock_offer_scrapers.helpers.offers import Offer
 from sherlock_offer_scrapers.scrapers.kuantokusta import kuantokusta
 
@@ -21,7 +22,7 @@ def test_normal_product_page():
     offers = kuantokusta.parse_product_page(normal_product_page)
 
     assert len(offers) == 14
-    assert all([o['offer_url'] is not None for o in offers])
+    assert all([o.offer_url is not None for o in offers])
 
 
 @pytest.mark.unit
@@ -39,8 +40,8 @@ def test_search_one_retailer():
 
     assert len(offers) == 1
     assert offers[0] is not None
-    assert offers[0]['retail_prod_name'] == 'Gre Piscina em Composite 326x186x96cm'
-    assert offers[0]['price'] == 406990
+    assert offers[0].retail_prod_name == 'Gre Piscina em Composite 326x186x96cm'
+    assert offers[0].price == 406990
 
 
 @pytest.mark.unit
@@ -51,6 +52,81 @@ def test_search_no_result():
     assert len(offers) == 0
 
 
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    backend = cache.SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'))
+    cache.set_backend(backend)
+    yield backend
+    cache.set_backend(None)
+
+
+@pytest.fixture
+def scrapfly_requests(monkeypatch):
+    urls = []
+
+    def scrapfly_request(url):
+        urls.append(url)
+        page = 'normal_result.html' if '/search' in url else 'product_page_normal.html'
+        with open(pathlib.Path(__file__).parent / 'data' / page) as f:
+            return scrapfly.ScrapeResult(url=url, status_code=200, content=f.read(), cost=25)
+
+    monkeypatch.setattr(kuantokusta, 'scrapfly_request', scrapfly_request)
+    monkeypatch.setattr(kuantokusta.helpers.offers, 'publish_new_offer_urls', lambda gtin, offer_urls: None)
+    return urls
+
+
+@pytest.mark.unit
+def test_cached_offer_url_skips_the_search(scrapfly_requests):
+    product_url = 'https://www.kuantokusta.pt/p/5637007/xiaomi-trotinete-mi-electric-scooter-essential'
+    offers = kuantokusta.scrape('06934177716768', {'kuantokusta_PT': product_url})
+
+    assert len(offers) == 14
+    assert scrapfly_requests == [product_url]
+
+
+@pytest.mark.unit
+def test_pages_and_product_url_are_cached(sqlite_backend, scrapfly_requests):
+    offers = kuantokusta.scrape('06934177716768')
+    assert len(offers) == 14
+    assert len(scrapfly_requests) == 2
+
+    # The product page is fetched again, from the cache
+    assert kuantokusta.scrape('06934177716768') == offers
+    assert len(scrapfly_requests) == 2
+
+
+@pytest.mark.unit
+def test_stale_product_url_falls_back_to_the_search(sqlite_backend, scrapfly_requests, monkeypatch):
+    stale_url = 'https://www.kuantokusta.pt/p/1/removed'
+    product_url = 'https://www.kuantokusta.pt/p/5637007/xiaomi-trotinete-mi-electric-scooter-essential'
+    sqlite_backend.set('kuantokusta:product_url:6934177716768', stale_url, 3600)
+    scrapfly_request = kuantokusta.scrapfly_request
+
+    def failing_scrapfly_request(url):
+        if url == stale_url:
+            scrapfly_requests.append(url)
+            raise scrapfly.ScrapflyError('ERR::SCRAPE::BAD_UPSTREAM_RESPONSE', 'Not found', retryable=False)
+        return scrapfly_request(url)
+
+    monkeypatch.setattr(kuantokusta, 'scrapfly_request', failing_scrapfly_request)
+
+    offers = kuantokusta.scrape('06934177716768', {'kuantokusta_PT': stale_url})
+
+    assert len(offers) == 14
+    assert scrapfly_requests == [stale_url, 'https://www.kuantokusta.pt/search?q=6934177716768', product_url]
+    assert sqlite_backend.get('kuantokusta:product_url:6934177716768') == product_url
+
+
+@pytest.mark.unit
+def test_scrapfly_error_gives_no_offers(monkeypatch):
+    def scrapfly_request(url):
+        raise scrapfly.ScrapflyError('ERR::ASP::SHIELD_PROTECTION_FAILED', 'Blocked', retryable=True)
+
+    monkeypatch.setattr(kuantokusta, 'scrapfly_request', scrapfly_request)
+
+    assert kuantokusta.scrape('06934177716768') == []
+
+
 def load_test_page(name: str) -> bs4.BeautifulSoup:
     directory = pathlib.Path(__file__).parent.resolve()
     with open(f'{directory}/data/{name}', 'r') as f:
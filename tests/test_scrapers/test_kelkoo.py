@@ -1,6 +1,7 @@
 import pytest
 
 from sherlock_offer_scrapers.scrapers import kelkoo
+from sherlock_offer_scrapers.scrapers.kelkoo import kelkoo as kelkoo_scraper
 
 
 @pytest.mark.integration
@@ -8,3 +9,116 @@ def test_scrape():
     gtin = "08806091153807"
     offers = kelkoo.scrape(gtin)
     assert len(offers) > 0
+
+
+def make_kelkoo_offer(offer_id: str, ean: str) -> dict:
+    return {
+        "offerId": offer_id,
+        "title": "Product",
+        "price": 19.95,
+        "currency": "EUR",
+        "availabilityStatus": "in_stock",
+        "goUrl": f"https://example.com/go/{offer_id}",
+        "merchant": {"id": 1, "name": "Merchant"},
+        "code": {"ean": ean},
+    }
+
+
+@pytest.fixture
+def kelkoo_requests(monkeypatch):
+    requests = []
+
+    # Two offers per EAN, one per page
+    def request_offers(country, eans, page):
+        requests.append((country, eans, page))
+        offers = [make_kelkoo_offer(f"{country}-{ean}-{page}", ean) for ean in eans]
+        return {"offers": offers, "meta": {"offers": {"totalPages": 2}}}
+
+    monkeypatch.setattr(kelkoo_scraper, "COUNTRIES", ["DE", "FR"])
+    monkeypatch.setattr(kelkoo_scraper, "EANS_PER_REQUEST", 2)
+    monkeypatch.setattr(kelkoo_scraper, "_request_offers", request_offers)
+    return requests
+
+
+@pytest.mark.unit
+def test_scrape_many_batches_the_eans(kelkoo_requests):
+    gtins = ["00000000000011", "0000000000022", "33"]
+
+    offers_per_gtin = kelkoo_scraper.scrape_many(gtins)
+
+    assert kelkoo_requests == [
+        ("DE", ["0000000000011", "0000000000022"], 1),
+        ("DE", ["0000000000011", "0000000000022"], 2),
+        ("DE", ["0000000000033"], 1),
+        ("DE", ["0000000000033"], 2),
+        ("FR", ["0000000000011", "0000000000022"], 1),
+        ("FR", ["0000000000011", "0000000000022"], 2),
+        ("FR", ["0000000000033"], 1),
+        ("FR", ["0000000000033"], 2),
+    ]
+    assert sorted(offers_per_gtin) == sorted(gtins)
+    assert [o.offer_url for o in offers_per_gtin["0000000000022"]] == [
+        "https://example.com/go/DE-0000000000022-1",
+        "https://example.com/go/DE-0000000000022-2",
+        "https://example.com/go/FR-0000000000022-1",
+        "https://example.com/go/FR-0000000000022-2",
+    ]
+
+
+@pytest.mark.unit
+def test_scrape_many_skips_failed_batches(kelkoo_requests, monkeypatch):
+    request_offers = kelkoo_scraper._request_offers
+
+    def failing_request_offers(country, eans, page):
+        if country == "DE":
+            raise Exception("Status code: 503")
+        return request_offers(country, eans, page)
+
+    monkeypatch.setattr(kelkoo_scraper, "_request_offers", failing_request_offers)
+
+    offers_per_gtin = kelkoo_scraper.scrape_many(["0000000000011"])
+
+    assert [o.country for o in offers_per_gtin["0000000000011"]] == ["FR", "FR"]
+
+
+@pytest.mark.unit
+def test_fetch_offers_skips_invalid_offers(monkeypatch):
+    invalid_offer = make_kelkoo_offer("2", "0000000000011")
+    invalid_offer["merchant"]["name"] = None
+    monkeypatch.setattr(
+        kelkoo_scraper,
+        "_search_offers",
+        lambda country, eans: [make_kelkoo_offer("1", "0000000000011"), invalid_offer],
+    )
+
+    offers = kelkoo_scraper.fetch_offers("FR", "00000000000011")
+
+    assert [o.offer_url for o in offers] == ["https://example.com/go/1"]
+
+
+@pytest.mark.unit
+def test_scrape_many_retries_the_eans_of_offers_without_code(monkeypatch):
+    offer_without_code = make_kelkoo_offer("2", "0000000000022")
+    del offer_without_code["code"]
+    offers_per_ean = {
+        "0000000000011": make_kelkoo_offer("1", "0000000000011"),
+        "0000000000022": offer_without_code,
+    }
+    requests = []
+
+    def request_offers(country, eans, page):
+        requests.append(eans)
+        return {"offers": [offers_per_ean[ean] for ean in eans]}
+
+    monkeypatch.setattr(kelkoo_scraper, "COUNTRIES", ["DE"])
+    monkeypatch.setattr(kelkoo_scraper, "_request_offers", request_offers)
+
+    offers_per_gtin = kelkoo_scraper.scrape_many(["0000000000011", "0000000000022"])
+
+    assert requests == [["0000000000011", "0000000000022"], ["0000000000022"]]
+    assert [o.offer_url for o in offers_per_gtin["0000000000011"]] == [
+        "https://example.com/go/1"
+    ]
+    assert [o.offer_url for o in offers_per_gtin["0000000000022"]] == [
+        "https://example.com/go/2"
+    ]
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from sherlock_offer_scrapers.searcher import batch
+from sherlock_offer_scrapers.searcher.google_shopping import GoogleShoppingSearcher
+
+
+def fake_search(searcher, task):
+    if task.name == "broken":
+        raise Exception("Too many requests")
+    product_id = f"{task.gtin}-{task.country}"
+    searcher.id_to_gtin_cache[product_id] = task.gtin
+    searcher.products_without_gtin.add((f"other-{task.gtin}", task.country))
+    return product_id
+
+
+def fake_search_with_pid(searcher, task):
+    searcher.id_to_gtin_cache[f"{task.gtin}-pid"] = str(os.getpid())
+    return None
+
+
+@pytest.fixture
+def searcher(monkeypatch):
+    # The caches are class attributes, shared by all the searchers
+    monkeypatch.setattr(GoogleShoppingSearcher, "id_to_gtin_cache", {"1": "00000001"})
+    monkeypatch.setattr(GoogleShoppingSearcher, "products_without_gtin", set())
+    monkeypatch.setattr(GoogleShoppingSearcher, "ad_links", set())
+    # Inherited by the worker processes, which are forked
+    monkeypatch.setattr(batch, "search", fake_search)
+    return GoogleShoppingSearcher()
+
+
+@pytest.mark.unit
+def test_shards_are_stable():
+    assert batch.shard_of("00889842651393", 4) == batch.shard_of("00889842651393", 4)
+    assert {batch.shard_of(str(gtin), 4) for gtin in range(100)} == {0, 1, 2, 3}
+
+
+@pytest.mark.unit
+def test_run_sharded_merges_the_caches_of_the_workers(searcher):
+    tasks = [
+        batch.SearchTask(sku="", gtin=gtin, name=name, brand="Muuto", country=country)
+        for gtin, name in [("00000002", "Chair"), ("00000003", "broken")]
+        for country in ["SE", "DK"]
+    ]
+    results = []
+
+    batch.run_sharded(tasks, searcher, 2, results.append)
+
+    assert sorted(
+        (result.task.gtin, result.task.country, result.product_id, result.error)
+        for result in results
+    ) == [
+        ("00000002", "DK", "00000002-DK", None),
+        ("00000002", "SE", "00000002-SE", None),
+        ("00000003", "DK", None, "Too many requests"),
+        ("00000003", "SE", None, "Too many requests"),
+    ]
+    assert searcher.id_to_gtin_cache == {
+        "1": "00000001",
+        "00000002-SE": "00000002",
+        "00000002-DK": "00000002",
+    }
+    assert searcher.products_without_gtin == {
+        ("other-00000002", "SE"),
+        ("other-00000002", "DK"),
+    }
+
+
+@pytest.mark.unit
+def test_every_item_is_in_one_shard():
+    gtins = [str(gtin) for gtin in range(100)]
+
+    shards = [batch.select_shard(gtins, lambda gtin: gtin, i, 3) for i in range(3)]
+
+    assert sorted(gtin for shard in shards for gtin in shard) == sorted(gtins)
+    assert shards[1] == batch.select_shard(gtins, lambda gtin: gtin, 1, 3)
+    with pytest.raises(ValueError):
+        batch.select_shard(gtins, lambda gtin: gtin, 3, 3)
+
+
+@pytest.mark.unit
+def test_a_shard_is_spread_over_all_the_processes(searcher):
+    gtins = [str(gtin).rjust(14, "0") for gtin in range(200)]
+    shard = batch.select_shard(gtins, lambda gtin: gtin, 1, 4)
+    tasks = [
+        batch.SearchTask(sku="", gtin=gtin, name="Chair", brand="Muuto", country="SE")
+        for gtin in shard
+    ]
+    pids = []
+
+    def on_result(result):
+        pids.append(result.id_to_gtin_cache[f"{result.task.gtin}-pid"])
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(batch, "search", fake_search_with_pid)
+        batch.run_sharded(tasks, searcher, 4, on_result)
+
+    assert len(set(pids)) == 4
+
+
+@pytest.mark.unit
+def test_merge_results_of_the_shards(tmp_path):
+    for shard, rows in [
+        ("shard-0-of-2", ["sku1,00000001,111\n", "sku2,00000002,\n"]),
+        ("shard-1-of-2", ["sku3,00000003,333\n", "sku1,00000001,111\n"]),
+    ]:
+        (tmp_path / shard).mkdir()
+        (tmp_path / shard / "products_results.csv").write_text("".join(rows))
+
+    results = batch.merge_results(
+        batch.read_results(str(tmp_path / shard / "products_results.csv"))
+        for shard in ["shard-0-of-2", "shard-1-of-2"]
+    )
+
+    assert [(r.sku, r.gtin, r.url) for r in results] == [
+        ("sku1", "00000001", "111"),
+        ("sku3", "00000003", "333"),
+    ]
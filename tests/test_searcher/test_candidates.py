@@ -0,0 +1,60 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from sherlock_offer_scrapers.searcher import candidates
+
+
+def search_page(*cards):
+    return BeautifulSoup(
+        "".join(f"""
+            <div class="sh-dgr__content">
+              <a class="Lq5OHe" href="/shopping/product/{product_id}?q=x&hl=en">
+                <h3>{title}</h3>
+              </a>
+              <span class="a8Pemb">{price}</span>
+              <a href="/shopping/product/{product_id}/offers">
+                Compare prices from {nb_merchants}+ stores
+              </a>
+            </div>
+            """ for product_id, title, price, nb_merchants in cards),
+        features="html.parser",
+    )
+
+
+@pytest.mark.unit
+def test_parse_candidates():
+    soup = search_page(
+        ("111", "Muuto Fiber Armchair", "2 495,00 kr", 12),
+        ("222", "Muuto Fiber Chair", "1 995,00 kr", 3),
+    )
+
+    parsed = candidates.parse_candidates(soup, "SE", limit=1)
+
+    assert parsed == [
+        candidates.Candidate("111", "Muuto Fiber Armchair", 249500, 12),
+    ]
+
+
+@pytest.mark.unit
+def test_rank_candidates():
+    soup = search_page(
+        ("111", "Seat cushion for Fiber Armchair", "199,00 kr", 2),
+        ("222", "Hay About A Chair", "2 000,00 kr", 30),
+        ("333", "Muuto Fiber Armchair Tube Base", "2 495,00 kr", 12),
+        ("444", "Muuto Fiber Armchair", "2 495,00 kr", 1),
+        ("555", "Muuto Fiber Armchair Wood Base", "2 995,00 kr", 8),
+    )
+
+    ranked = candidates.rank(
+        candidates.parse_candidates(soup, "SE", limit=12),
+        "Fiber Armchair",
+        "Muuto",
+        "05710562013423",
+        {"555": "5710562013423", "222": "5710562000000"},
+    )
+
+    assert [c.product_id for c in ranked] == ["555", "333", "444", "111", "222"]
+    assert [
+        candidates.is_worth_visiting(c, nb_visited)
+        for nb_visited, c in enumerate(ranked)
+    ] == [True, True, True, False, False]
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from sherlock_offer_scrapers.searcher import google_shopping
+from sherlock_offer_scrapers.searcher.google_shopping import GoogleShoppingSearcher
+
+
+def fake_find_product_id(found_in, visited_countries):
+    def find_product_id(name, gtin, sku, country, brand, stop=None, on_visited=None):
+        visited_countries.append(country)
+        for count in range(1, 13):
+            if stop is not None and stop.is_set():
+                return None
+            time.sleep(0.01)
+            if on_visited is not None:
+                on_visited(count)
+            if country in found_in and count == found_in[country]:
+                return f"{country}-id"
+        return None
+
+    return find_product_id
+
+
+@pytest.mark.unit
+def test_hedged_search_returns_the_first_market_found(monkeypatch):
+    monkeypatch.setattr(google_shopping, "HEDGE_AFTER_CANDIDATES", 2)
+    searcher = GoogleShoppingSearcher()
+    visited_countries = []
+    monkeypatch.setattr(
+        searcher,
+        "find_product_id",
+        fake_find_product_id({"DE": 1}, visited_countries),
+    )
+
+    product_id = searcher.find_product_id_multiple_markets(
+        "Chair", "00000001", None, ["DK", "SE", "DE"], hedged=True
+    )
+
+    assert product_id == "DE-id"
+    assert visited_countries == ["DK", "SE", "DE"]
+
+
+@pytest.mark.unit
+def test_hedged_search_starts_the_next_market_of_a_slow_one(monkeypatch):
+    monkeypatch.setattr(google_shopping, "HEDGE_AFTER_SECONDS", 0.05)
+    searcher = GoogleShoppingSearcher()
+    dk_stopped = threading.Event()
+
+    def find_product_id(name, gtin, sku, country, brand, stop=None, on_visited=None):
+        if country == "DK":
+            # A search page that doesn't answer
+            stop.wait()
+            dk_stopped.set()
+            return None
+        return f"{country}-id"
+
+    monkeypatch.setattr(searcher, "find_product_id", find_product_id)
+
+    product_id = searcher.find_product_id_multiple_markets(
+        "Chair", "00000001", None, ["DK", "SE"], hedged=True
+    )
+
+    assert product_id == "SE-id"
+    assert dk_stopped.wait(1)
+
+
+@pytest.mark.unit
+def test_hedged_search_not_found(monkeypatch):
+    searcher = GoogleShoppingSearcher()
+    visited_countries = []
+    monkeypatch.setattr(
+        searcher, "find_product_id", fake_find_product_id({}, visited_countries)
+    )
+
+    product_id = searcher.find_product_id_multiple_markets(
+        "Chair", "00000001", None, ["DK", "SE"], hedged=True
+    )
+
+    assert product_id is None
+    assert sorted(visited_countries) == ["DK", "SE"]
+
+
+@pytest.mark.unit
+def test_only_the_same_candidate_waits_for_another_market(monkeypatch):
+    searcher = GoogleShoppingSearcher()
+    monkeypatch.setattr(GoogleShoppingSearcher, "id_to_gtin_cache", {})
+    resolved = []
+    # Fails if the two candidates are not resolved at the same time
+    both_resolving = threading.Barrier(2, timeout=1)
+
+    def search_for_gtin_within_variants(product_id, country, **kwargs):
+        resolved.append(product_id)
+        try:
+            both_resolving.wait()
+        except threading.BrokenBarrierError:
+            resolved.append("timeout")
+        searcher.id_to_gtin_cache[product_id] = "00000001"
+        return product_id, "00000001"
+
+    monkeypatch.setattr(
+        searcher, "search_for_gtin_within_variants", search_for_gtin_within_variants
+    )
+
+    threads = [
+        threading.Thread(
+            target=searcher.search_for_gtin, args=(product_id, "00000001", None, c)
+        )
+        for product_id, c in [("1", "DK"), ("2", "SE"), ("1", "DE")]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(resolved) == ["1", "2"]